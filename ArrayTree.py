@@ -0,0 +1,321 @@
+"""
+        A compact tree representation for storing very many hypothesis values.
+
+        An ArrayTree is a tree written as parallel arrays in prefix order: for each node, its rule index, its
+        arity (number of FunctionNode children) and the size of its subtree, so that node i's subtree is
+        i...i+size[i]-1. Rule indices are the ones from Grammar.get_packing_index (with no bound variables in
+        scope), and, as in Grammar.pack, a bound variable is R plus the depth of the lambda that introduced it,
+        counting enclosing lambdas from 0. So alpha-equivalent trees have the same arrays.
+
+        An ArrayTree is one small numpy array and three references, instead of an object, a dict and an
+        args list for every node. Prior, stringification and uniform subnode sampling work on the arrays
+        directly, using an ArrayTable of per-rule values that is cached on the grammar (see
+        Grammar.get_array_table). Sampling with any other resampleProbability builds the FunctionNodes.
+        Use from_tree and to_tree to convert to and from FunctionNodes, e.g. for proposals.
+
+        ArrayTrees should be treated as immutable.
+"""
+from math import log
+from random import random, randrange
+
+import numpy as np
+
+from LOTlib3.FunctionNode import isFunctionNode, BVUseFunctionNode, NodeSamplingException, percent_s_regex, bv_regex
+from LOTlib3.GrammarRule import BVAddGrammarRule
+from LOTlib3.Miscellaneous import Infinity, lambdaOne
+
+
+class ArrayTable(object):
+    """
+    Everything about a grammar's rules that ArrayTrees need, indexed by rule index. This is built and
+    cached by Grammar.get_array_table; it is only valid for the grammar version it was built for.
+    """
+    def __init__(self, grammar):
+        assert len(grammar.current_bv_rules()) == 0, "*** ArrayTables must be built with no bound variables in scope"
+        self.version = grammar.version
+        self.BV_P = grammar.BV_P
+
+        sig2idx, idx2rule = grammar.get_packing_index()
+        self.sig2idx = sig2idx
+        self.offsets = dict(grammar.get_packing_offsets())
+        self.R = len(idx2rule)
+        self.rules = [idx2rule[i] for i in range(self.R)]
+        self.nonterminals = set(grammar.nonterminals())
+
+        self.Z = {nt: grammar.get_base_rule_index(nt).Z for nt in self.nonterminals}
+        self.log_probability = grammar.log_rule_probabilities()
+        self.adds_bv = np.array([isinstance(r, BVAddGrammarRule) for r in self.rules], dtype=bool)
+
+    def bv_p(self, r):
+        """ The p of the bound variable rule that the BVAddGrammarRule r introduces (see make_bv_rule) """
+        return self.BV_P if r.bv_p is None else r.bv_p
+
+
+class ArrayTree(object):
+    """
+    A tree from grammar, stored as arrays (see the top of this file).
+
+    Arguments
+    ---------
+    grammar : LOTlib3.Grammar
+        The grammar the rule indices refer to.
+    data : np.ndarray
+        A 3 x n int32 array of the rule index, arity and subtree size of each node, in prefix order.
+    nt : str
+        The nonterminal at the root (default: grammar.start).
+
+    """
+    __slots__ = ('grammar', 'nt', 'data')
+
+    def __init__(self, grammar, data, nt=None):
+        self.grammar = grammar
+        self.nt = grammar.start if nt is None else nt
+        self.data = data
+
+    @property
+    def rule(self):
+        return self.data[0]
+
+    @property
+    def arity(self):
+        return self.data[1]
+
+    @property
+    def size(self):
+        return self.data[2]
+
+    # --------------------------------------------------------------------------------------------------------
+    # Converting
+
+    @classmethod
+    def from_tree(cls, grammar, t):
+        """ Make an ArrayTree from the FunctionNode t """
+        table = grammar.get_array_table()
+        R, offsets = table.R, table.offsets
+
+        rules, arities = [], []
+        scope = dict() # the signatures of bound variables currently in scope -> their index
+        stack = [t]    # as in Grammar._pack_into
+        while stack:
+            x = stack.pop()
+            if not isFunctionNode(x): # we're done with the lambda that added x
+                del scope[x.get_rule_signature()]
+                continue
+
+            if isinstance(x, BVUseFunctionNode):
+                rules.append(scope[x.get_rule_signature()])
+            else:
+                rules.append(offsets[x.returntype] + grammar.rule_position(x))
+
+            if x.added_rule is not None:
+                stack.append(x.added_rule)
+                scope[x.added_rule.get_rule_signature()] = R + len(scope)
+            kids = list(x.argFunctionNodes())
+            arities.append(len(kids))
+            stack.extend(reversed(kids))
+
+        # the size of each subtree, going backwards so that each node's kids are done before it
+        n = len(rules)
+        sizes = [0]*n
+        done = []
+        for i in range(n-1, -1, -1):
+            s = 1
+            for _ in range(arities[i]):
+                s += done.pop()
+            sizes[i] = s
+            done.append(s)
+
+        return cls(grammar, np.array([rules, arities, sizes], dtype=np.int32), nt=t.returntype)
+
+    def to_tree(self):
+        """ Make a new FunctionNode from this tree """
+        grammar = self.grammar
+        table = grammar.get_array_table()
+        rules = self.rule.tolist()
+        base = len(grammar.current_bv_rules()) # bound variables pushed while we build start here
+        at = [0]
+
+        def make_stub(x, parent):
+            i = rules[at[0]]
+            at[0] += 1
+            r = table.rules[i] if i < table.R else grammar.current_bv_rules()[base + i - table.R]
+            assert r.nt == x, "*** Rule %s does not expand %s" % (r, x)
+            fn = r.make_FunctionNodeStub(grammar, parent)
+            if i < table.R:
+                grammar.annotate(fn, i - table.offsets[x])
+            return fn
+
+        return grammar._expand(self.nt, make_stub)
+
+    # --------------------------------------------------------------------------------------------------------
+    # Things computed directly on the arrays
+
+    def __len__(self):
+        return self.data.shape[1]
+
+    def count_nodes(self):
+        return len(self)
+
+    def count_subnodes(self):
+        return len(self)
+
+    def subtree(self, i):
+        """ The positions of node i's subtree """
+        return range(i, i + int(self.size[i]))
+
+    def sample_subnode(self, resampleProbability=lambdaOne):
+        """ Sample a node as FunctionNode.sample_subnode does, returning its position and the log probability of
+        choosing it. resampleProbability is called on FunctionNodes, so unless it is the default (uniform), this
+        makes the tree with to_tree and weights its nodes, which are in the same (prefix) order as ours """
+        if resampleProbability is lambdaOne:
+            n = len(self)
+            return randrange(n), -log(n)
+
+        weights = [1.0*resampleProbability(x) for x in self.to_tree()]
+        Z = sum(weights)
+        if not (Z > 0.0):
+            raise NodeSamplingException
+
+        r = random() * Z
+        for i, w in enumerate(weights):
+            r -= w
+            if r < 0:
+                return i, log(w) - log(Z)
+        i = max(i for i, w in enumerate(weights) if w > 0) # we can only get here by rounding
+        return i, log(weights[i]) - log(Z)
+
+    def has_bound_variables(self):
+        """ Does this tree have any lambdas that introduce bound variables? """
+        table = self.grammar.get_array_table()
+        rules = self.rule
+        return bool(table.adds_bv[rules[rules < table.R]].any())
+
+    def _scan(self):
+        """
+        Yield (i, d, rule, lambdas) for each node in prefix order, where d is its depth, rule is its GrammarRule
+        (for a bound variable, its lambda's BVAddGrammarRule) and lambdas is a list of (end, depth, rule) for the
+        lambdas enclosing it, outermost first. lambdas is modified as we go, so don't keep it.
+        """
+        table = self.grammar.get_array_table()
+        rules, sizes = self.rule.tolist(), self.size.tolist()
+        lambdas = []
+        depths = [0]*len(rules) # depth of each node
+        for i, ri in enumerate(rules):
+            while lambdas and lambdas[-1][0] <= i:
+                lambdas.pop()
+
+            r = table.rules[ri] if ri < table.R else lambdas[ri - table.R][2]
+            yield i, depths[i], r, lambdas
+
+            if ri < table.R and table.adds_bv[ri]:
+                lambdas.append((i + sizes[i], depths[i], r))
+
+            # kids are one deeper
+            j, end = i+1, i+sizes[i]
+            while j < end:
+                depths[j] = depths[i]+1
+                j += sizes[j]
+
+    def log_probability(self):
+        """ The log probability of this tree under its grammar, as in Grammar.log_probability """
+        table = self.grammar.get_array_table()
+        rules = self.rule
+
+        if not self.has_bound_variables(): # so each rule has a fixed probability
+            return float(table.log_probability[rules].sum())
+
+        lp = 0.0
+        extra = dict() # nt -> total p of bound variables rules for nt in scope
+        pushed = []    # the lambdas whose p is in extra
+        for i, _, r, lambdas in self._scan():
+            while len(pushed) > len(lambdas) or (pushed and pushed[-1] is not lambdas[len(pushed)-1]):
+                _, _, q = pushed.pop()
+                extra[q.bv_type] -= table.bv_p(q)
+            for l in lambdas[len(pushed):]:
+                pushed.append(l)
+                extra[l[2].bv_type] = extra.get(l[2].bv_type, 0.0) + table.bv_p(l[2])
+
+            ri = int(rules[i])
+            if ri < table.R:
+                nt, p = r.nt, r.p
+            else:
+                nt, p = r.bv_type, table.bv_p(r)
+            z = table.Z.get(nt, 0.0) + extra.get(nt, 0.0)
+            lp += log(p) - log(z) if p > 0.0 else -Infinity
+
+        return lp
+
+    def __str__(self):
+        """ The same string as str() of the FunctionNode (see FunctionNode.pystring) """
+        table = self.grammar.get_array_table()
+        rules, arity = self.rule.tolist(), self.arity.tolist()
+        n = len(rules)
+
+        # going forward, what each node looks like, with its bound variable names
+        names, bvns, tos, nts = [None]*n, ['']*n, [None]*n, [None]*n
+        for i, d, r, lambdas in self._scan():
+            bv_types = [l[2].bv_type for l in lambdas]
+            if rules[i] < table.R:
+                names[i], tos[i] = r.name, r.to
+                if table.adds_bv[rules[i]]:
+                    bvns[i] = r.bv_prefix + str(d)
+            else:
+                _, ld, lam = lambdas[rules[i] - table.R]
+                names[i], tos[i] = lam.bv_prefix + str(ld), lam.bv_args
+            nts[i] = None if tos[i] is None else \
+                [isinstance(a, str) and (a in table.nonterminals or a in bv_types) for a in tos[i]]
+
+        # going backward, so each node's kids are done before it
+        done = []
+        for i in range(n-1, -1, -1):
+            kids = [done.pop() for _ in range(arity[i])]
+            name, to, bvn = names[i], tos[i], bvns[i]
+            if to is None:
+                ret = name
+            else:
+                kids.reverse()
+                args = [kids.pop() if isnt else a for a, isnt in zip(to, nts[i])]
+                if name == '':
+                    assert len(args) == 1, "Null names must have exactly 1 argument"
+                    ret = args[0]
+                elif percent_s_regex.search(name):
+                    ret = name % tuple(args)
+                elif name == 'lambda':
+                    assert len(args) == 1
+                    ret = 'lambda %s: %s' % (bvn, args[0])
+                else:
+                    ret = name+'('+', '.join(args)+')'
+
+            if bv_regex.search(ret):
+                ret = bv_regex.sub(bvn, ret)
+            done.append(ret)
+
+        return done[0]
+
+    def __repr__(self):
+        return str(self)
+
+    # --------------------------------------------------------------------------------------------------------
+
+    def __eq__(self, other):
+        return isinstance(other, ArrayTree) and self.nt == other.nt and np.array_equal(self.data, other.data)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((self.nt, self.data.tobytes()))
+
+    def __copy__(self):
+        # the grammar is never copied
+        return ArrayTree(self.grammar, self.data.copy(), nt=self.nt)
+
+    def __deepcopy__(self, memo):
+        return self.__copy__()
+
+    def __getstate__(self):
+        return (self.grammar, self.nt, self.data)
+
+    def __setstate__(self, state):
+        self.grammar, self.nt, self.data = state
+
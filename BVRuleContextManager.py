@@ -28,7 +28,7 @@ class BVRuleContextManager(object):
                 #print "# Adding rule ", x.added_rule
                 r = x.added_rule
                 self.added_rules.append(r)
-                self.grammar.rules[r.nt].append(r)
+                self.grammar.push_bv_rule(r)
 
     def __exit__(self, t, value, traceback):
 
@@ -36,11 +36,38 @@ class BVRuleContextManager(object):
             return
 
         #print "# Removing rule", r
-        for r in self.added_rules:
-            self.grammar.rules[r.nt].remove(r)
+        for r in reversed(self.added_rules): # pop in the reverse order that we pushed
+            self.grammar.pop_bv_rule(r)
 
         # reset
         self.added_rules = []
 
         return False #re-raise exceptions
 
+
+
+class BVPathContextManager(object):
+
+    def __init__(self, grammar, path):
+        """
+            Like BVRuleContextManager with recurse_up=True, but for the nodes in path (a list of nodes from the root
+            down), so it does not depend on parent pointers. This adds the bound variable rules of everything in path.
+        """
+        self.grammar = grammar
+        self.path = path
+        self.added_rules = []
+
+    def __enter__(self):
+        assert len(self.added_rules) == 0, "Error, __enter__ called twice on BVPathContextManager"
+
+        for x in self.path:
+            if x.added_rule is not None:
+                self.added_rules.append(x.added_rule)
+                self.grammar.push_bv_rule(x.added_rule)
+
+    def __exit__(self, t, value, traceback):
+        for r in reversed(self.added_rules):
+            self.grammar.pop_bv_rule(r)
+        self.added_rules = []
+
+        return False #re-raise exceptions
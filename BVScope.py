@@ -0,0 +1,87 @@
+from LOTlib3.RuleIndex import RuleIndex
+
+
+class BVScope(object):
+    """
+    An immutable set of bound variable rules that are in scope, layered over a grammar's own rules.
+    Pushing a rule makes a new BVScope whose parent is this one, and popping just goes back to the
+    parent, so nothing in the grammar is ever modified. Each thread using a grammar has its own current
+    scope (see Grammar.push_bv_rule), so a single grammar can be shared between threads.
+
+    Arguments
+    ---------
+    parent : BVScope
+        The scope this one extends (None for the empty scope).
+    rule : GrammarRule
+        The bound variable rule that this scope adds to its parent.
+
+    Attributes
+    ----------
+    rules : tuple<GrammarRule>
+        All of the bound variable rules in scope, in the order they were pushed.
+    by_nt : dict
+        Maps each nonterminal to a tuple of its bound variable rules in scope.
+    names : frozenset
+        The names of all of the bound variable rules in scope.
+
+    """
+    def __init__(self, parent=None, rule=None):
+        self.parent = parent
+        self.rule = rule
+        self._indices = dict() # nt -> RuleIndex, for the grammar rules plus the bound variables here
+        self._key = None       # the last context_key
+
+        if parent is None:
+            self.rules, self.by_nt, self.names = (), dict(), frozenset()
+        else:
+            self.rules = parent.rules + (rule,)
+            self.by_nt = dict(parent.by_nt)
+            self.by_nt[rule.nt] = self.by_nt.get(rule.nt, ()) + (rule,)
+            self.names = parent.names.union((rule.name,))
+
+    def __len__(self):
+        return len(self.rules)
+
+    def push(self, rule):
+        return BVScope(self, rule)
+
+    def remove(self, rule):
+        """ A scope with everything here but rule, for when pops are not nested """
+        s = EMPTY_SCOPE
+        for r in self.rules:
+            if r is not rule:
+                s = s.push(r)
+        return s
+
+    def context_key(self, grammar):
+        """ See Grammar.context_key """
+        k = self._key
+        if k is None or k[1] != grammar.version or k[0] != grammar.uid:
+            k = self._key = (grammar.uid, grammar.version, self.names)
+        return k
+
+    def get_rule_index(self, grammar, nt):
+        """ The RuleIndex of nt's grammar rules followed by its bound variable rules in this scope """
+        idx = self._indices.get(nt)
+        if idx is not None and idx.version == grammar.version:
+            return idx
+
+        # go up to the nearest scope that has one we can extend, remembering the rules for nt we pass
+        added, s = [], self
+        while s.parent is not None:
+            idx = s._indices.get(nt)
+            if idx is not None and idx.version == grammar.version:
+                break
+            if s.rule.nt == nt:
+                added.append(s.rule)
+            s = s.parent
+        else:
+            idx = grammar.get_base_rule_index(nt)
+
+        for r in reversed(added):
+            idx = idx.extend(r)
+        self._indices[nt] = idx
+        return idx
+
+
+EMPTY_SCOPE = BVScope()
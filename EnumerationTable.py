@@ -0,0 +1,209 @@
+"""
+        Counting, ranking, and unranking the trees of a grammar at a given depth.
+
+        The trees at depth d are ordered exactly as Grammar.enumerate_at_depth yields them: by rule, then
+        by the vector of child depths (the first child varying fastest), then by the children themselves
+        (again with the first child varying fastest). Counts are memoized by (nonterminal, depth, scope)
+        where the scope is the list of bound variables that are available, so that counting is polynomial
+        and any tree can be built directly from its index.
+
+"""
+import itertools
+from random import randrange
+
+from LOTlib3.FunctionNode import isFunctionNode, BVUseFunctionNode
+from LOTlib3.GrammarRule import BVAddGrammarRule
+
+
+class EnumerationTable(object):
+    """
+    A dynamic programming table over (nonterminal, depth, scope) for a single version of a grammar.
+    This is built and cached by Grammar.get_enumeration_table; use Grammar.count_at_depth, unrank, rank,
+    and sample_at_depth rather than calling this directly.
+
+    Note
+    ----
+    A scope here is a tuple of (nonterminal, to) pairs, one for each bound variable introduced above,
+    outermost first. These determine the rules that are available, while the actual bound variable
+    rules (which have unique names) are only needed when we build or read a tree.
+
+    """
+    def __init__(self, grammar):
+        self.grammar = grammar
+        self.version = grammar.version
+        self.counts = dict()     # (nt, d, scope) -> list of the number of trees at exactly depth d, for each expansion
+        self.cumulative = dict() # (nt, d, scope) -> number of trees at depth <= d
+        self._expansions = dict() # (nt, scope) -> expansions(nt, scope)
+
+    # --------------------------------------------------------------------------------------------------------
+    # Rules in a scope
+
+    def is_nonterminal(self, x, scope):
+        return isinstance(x, str) and (x in self.grammar.rules or any(s[0] == x for s in scope))
+
+    def rules(self, nt, bv_rules):
+        """ The rules for nt, in the order that enumerate_at_depth sees them, given the bound variable rules in bv_rules """
+        return list(self.grammar.rules.get(nt, [])) + [r for r in bv_rules if r.nt == nt]
+
+    def expansions(self, nt, scope):
+        """ A list of (to, child scope, is terminal) for each rule of nt in scope, parallel to rules() """
+        key = (nt, scope)
+        if key not in self._expansions:
+            out = []
+            for r in self.grammar.rules.get(nt, []):
+                if isinstance(r, BVAddGrammarRule):
+                    out.append((r.to, scope + ((r.bv_type, _tuple(r.bv_args)),)))
+                else:
+                    out.append((r.to, scope))
+            for bnt, bto in scope:
+                if bnt == nt:
+                    out.append((bto, scope))
+            self._expansions[key] = [(to, cs, self.is_terminal_expansion(to, cs)) for to, cs in out]
+        return self._expansions[key]
+
+    def is_terminal_expansion(self, to, child_scope):
+        return to is None or not any(self.is_nonterminal(a, child_scope) for a in to)
+
+    def child_depths(self, to, d, child_scope):
+        """ The possible depths of each child of an expansion at depth d (as in enumerate_at_depth) """
+        return [range(d) if self.is_nonterminal(a, child_scope) else [0] for a in to]
+
+    def depth_vectors(self, to, d, child_scope):
+        """ Yield the vectors of child depths whose max is d-1, in the order of lazyproduct (first varying fastest) """
+        for rv in itertools.product(*reversed(self.child_depths(to, d, child_scope))):
+            cd = rv[::-1]
+            if max(cd) == d-1:
+                yield cd
+
+    # --------------------------------------------------------------------------------------------------------
+    # Counting
+
+    def count(self, x, d, scope=()):
+        """ How many trees are there from x at exactly depth d? """
+        if d < 0:
+            return 0
+        if not self.is_nonterminal(x, scope):
+            return 1 if d == 0 else 0
+        return sum(self.expansion_counts(x, d, scope))
+
+    def expansion_counts(self, x, d, scope):
+        """ A list of how many trees of depth exactly d there are for each expansion of the nonterminal x """
+        key = (x, d, scope)
+        if key not in self.counts:
+            self.counts[key] = [self.expansion_count(to, d, cs, term) for to, cs, term in self.expansions(x, scope)]
+        return self.counts[key]
+
+    def count_upto(self, x, d, scope=()):
+        """ How many trees are there from x at depth <= d? """
+        if d < 0:
+            return 0
+        if not self.is_nonterminal(x, scope):
+            return 1
+
+        key = (x, d, scope)
+        if key not in self.cumulative:
+            self.cumulative[key] = self.count_upto(x, d-1, scope) + self.count(x, d, scope)
+        return self.cumulative[key]
+
+    def expansion_count(self, to, d, child_scope, terminal):
+        """ How many trees of depth exactly d use an expansion to? """
+        if terminal:
+            return 1 if d == 0 else 0
+        elif d == 0:
+            return 0
+        else:
+            # everything with children at depth <= d-1, minus those with all children at depth <= d-2
+            upto, below = 1, 1
+            for a in to:
+                upto  *= self.count_upto(a, d-1, child_scope)
+                below *= self.count_upto(a, d-2, child_scope) if self.is_nonterminal(a, child_scope) else 1
+            return upto - below
+
+    def block_count(self, to, cd, child_scope):
+        """ How many trees use expansion to with child depths cd? """
+        n = 1
+        for a, di in zip(to, cd):
+            n *= self.count(a, di, child_scope)
+        return n
+
+    # --------------------------------------------------------------------------------------------------------
+    # Unranking and ranking
+
+    def unrank(self, x, d, k, parent=None, bv_rules=(), scope=()):
+        """ Return the k'th tree from x at depth d """
+        if not self.is_nonterminal(x, scope):
+            assert d == 0 and k == 0
+            return x
+
+        for j, (r, (to, cs, _), n) in enumerate(zip(self.rules(x, bv_rules), self.expansions(x, scope), self.expansion_counts(x, d, scope))):
+            if k >= n:
+                k -= n
+                continue
+
+            fn = r.make_FunctionNodeStub(self.grammar, parent)
+            self.grammar.annotate(fn, j) # the grammar's own rules come first, so j is its rule_position
+            if fn.args is None or d == 0:
+                return fn
+
+            child_bv_rules = bv_rules if fn.added_rule is None else bv_rules + (fn.added_rule,)
+            for cd in self.depth_vectors(to, d, cs):
+                n = self.block_count(to, cd, cs)
+                if k >= n:
+                    k -= n
+                    continue
+
+                # mixed radix, with the first child varying fastest
+                for i, (a, di) in enumerate(zip(to, cd)):
+                    ni = self.count(a, di, cs)
+                    k, ki = divmod(k, ni)
+                    fn.args[i] = self.unrank(a, di, ki, parent=fn, bv_rules=child_bv_rules, scope=cs)
+                return fn
+
+        raise IndexError("*** Index out of range for %s at depth %s" % (x, d))
+
+    def rank(self, t, bv_rules=(), scope=()):
+        """ Return (d, k) where t is the k'th tree from t.returntype at depth d """
+        x = t.returntype
+        rules = self.rules(x, bv_rules)
+        expansions = self.expansions(x, scope)
+
+        if isinstance(t, BVUseFunctionNode):
+            sig = t.get_rule_signature()
+            pos = [i for i, r in enumerate(rules) if r.get_rule_signature() == sig]
+            assert len(pos) == 1, "*** No unique rule matching %s" % str(sig)
+            pos = pos[0]
+        else:
+            pos = self.grammar.rule_position(t, self.grammar.get_base_rule_index(x))
+            assert pos is not None, "*** No rule matching %s" % str(t.get_rule_signature())
+        to, cs, _ = expansions[pos]
+
+        child_bv_rules = bv_rules if t.added_rule is None else bv_rules + (t.added_rule,)
+        kids = [self.rank(a, child_bv_rules, cs) if isFunctionNode(a) else (0, 0) for a in (t.args or [])]
+        d = 1 + max([kd for kd, _ in kids]) if any(isFunctionNode(a) for a in (t.args or [])) else 0
+
+        k = sum(self.expansion_counts(x, d, scope)[:pos])
+        if d == 0:
+            return d, k
+
+        cd = tuple(kd for kd, _ in kids)
+        for v in self.depth_vectors(to, d, cs):
+            if v == cd:
+                break
+            k += self.block_count(to, v, cs)
+
+        radix = 1
+        for a, (kd, kk) in zip(to, kids):
+            k += kk * radix
+            radix *= self.count(a, kd, cs)
+
+        return d, k
+
+    def sample(self, x, d):
+        """ Sample uniformly from the trees from x at depth d """
+        n = self.count(x, d)
+        assert n > 0, "*** There are no trees from %s at depth %s" % (x, d)
+        return self.unrank(x, d, randrange(n))
+
+
+def _tuple(x):
+    return None if x is None else tuple(x)
@@ -135,7 +135,10 @@ from LOTlib3.Miscellaneous import log, Infinity, log1mexp, attrmem
 from LOTlib3.Eval import EvaluationException
 
 class MyHypothesis(RecursiveLOTHypothesis):
-    
+
+    prior_parameters = ('gamma', 'maxnodes', 'prior_temperature')
+    likelihood_parameters = ()
+
     def __init__(self, gamma=-30, **kwargs):
         RecursiveLOTHypothesis.__init__(self, grammar, **kwargs)
         self.gamma=gamma
@@ -51,6 +51,8 @@ class MyHypothesis(BinaryLikelihood, LOTHypothesis):
     simple eval.
     """
 
+    likelihood_parameters = ()
+
     def __init__(self, **kwargs):
         LOTHypothesis.__init__(self, grammar, **kwargs)
 
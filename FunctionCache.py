@@ -0,0 +1,73 @@
+"""
+        A cache from hypotheses to their compiled functions.
+
+        LOTHypothesis.compile_function evals str(self) every time a hypothesis gets a value, which includes every
+        proposal. Chains revisit the same programs over and over, so compiling each one once saves building,
+        parsing and compiling python on most steps. LOTHypothesis keys the cache by the source it compiles,
+        str(self) (see LOTHypothesis.function_key), so two hypotheses share a function only if they have the
+        same code. pystring names bound variables by their depth, so alpha-equivalent trees share one too.
+
+        By default, every LOTHypothesis in a process uses the one FUNCTION_CACHE (see LOTHypothesis.function_cache),
+        but a model can have its own. The cache is least-recently-used, holding at most maxsize functions, and
+        keeps counts of its hits and misses.
+"""
+from collections import OrderedDict
+from threading import Lock
+
+
+class FunctionCache(object):
+
+    def __init__(self, maxsize=10000):
+        assert maxsize > 0, "*** FunctionCache must have maxsize>0"
+        self.maxsize = maxsize
+        self.table = OrderedDict() # key -> function, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.table)
+
+    def __contains__(self, key):
+        return key in self.table
+
+    def get(self, key, compile):
+        """ The function for key, calling compile(key) to make it if we don't have it """
+        with self.lock:
+            f = self.table.get(key)
+            if f is not None:
+                self.table.move_to_end(key)
+                self.hits += 1
+                return f
+            self.misses += 1
+
+        f = compile(key) # not holding the lock, since this may be slow (or call get itself)
+
+        with self.lock:
+            self.table[key] = f
+            self.table.move_to_end(key)
+            while len(self.table) > self.maxsize:
+                self.table.popitem(last=False)
+        return f
+
+    def hit_rate(self):
+        n = self.hits + self.misses
+        return self.hits / n if n > 0 else 0.0
+
+    def stats(self):
+        """ A dict of the size, hits, misses and hit rate """
+        return {'size': len(self), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hit_rate()}
+
+    def clear(self):
+        """ Drop all of the functions and reset the counts """
+        with self.lock:
+            self.table.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __str__(self):
+        return "<FunctionCache %s/%s functions, %s hits, %s misses>" % (len(self), self.maxsize, self.hits, self.misses)
+
+
+FUNCTION_CACHE = FunctionCache()
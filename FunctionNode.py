@@ -18,6 +18,35 @@ def isFunctionNode(x):
     return isinstance(x, FunctionNode)
 
 
+def fold(t, combine, enter=None, d=0):
+    """The traversal core for computing something from a whole tree without recursion.
+
+    This calls enter(x, depth) (if given) on each node x below t on the way down, in prefix order, and
+    combine(x, depth, args) on the way back up, where args is x.args with each FunctionNode replaced by what
+    combine returned for it (or None, if x.args is None). Returns what combine returns for t. Since it uses an
+    explicit stack, this works on trees of any depth. t is at depth d.
+    """
+    results = []
+    stack = [(t, d, False)]
+    while stack:
+        x, dx, done = stack.pop()
+        if not done:
+            if enter is not None:
+                enter(x, dx)
+            stack.append((x, dx, True))
+            stack.extend((a, dx+1, False) for a in reversed(list(x.argFunctionNodes())))
+        else:
+            args = None
+            if x.args is not None:
+                n = sum(1 for a in x.args if isFunctionNode(a))
+                kids = iter(results[len(results)-n:])
+                del results[len(results)-n:]
+                args = [next(kids) if isFunctionNode(a) else a for a in x.args]
+            results.append(combine(x, dx, args))
+
+    return results[0]
+
+
 def cleanFunctionNodeString(x):
     """Makes FunctionNode strings easier to read."""
     s = re.sub("lambda", "\u03BB", str(x))  # make lambdas the single char
@@ -55,10 +84,30 @@ class FunctionNode(object):
     * If a node has [ None ] as args, it is treated as a thunk
     * Each FunctionNode used to store the rule that generated it. This caused problems when loading a FunctionNode from
       a pickle file and trying to compute its probability under a new grammar. Now, matching to rules is done on the fly
-      using get_rule_signature()
+      using get_rule_signature(), except that a node may store the position of its rule (rule_id) for the one grammar
+      version given by rule_key (see Grammar.rule_position)
 
     """
-    NoCopy = {'self', 'parent', 'returntype', 'name', 'args', 'parent'}
+    NoCopy = {'self', 'parent', 'returntype', 'name', 'args', 'parent', 'shared'}
+
+    # Values cached on a node that depend on the subtree below it. These are dropped by invalidate()
+    # and are not carried over by shallow copies (whose args are usually about to be replaced).
+    Caches = {'lp_cache', 'hash_cache', 'size_cache', 'weight_cache', 'preorder_cache'}
+    NodeCaches = {'preorder_cache'} # caches that hold nodes, which copies must not share
+    lp_cache = None # (Grammar.context_key(), log probability), set by Grammar.log_probability
+    hash_cache = None # (closed part, free variable coefficients, hash), set by structural_hash
+    size_cache = None # (number of nodes, depth), set by count_subnodes and depth
+    weight_cache = None # (resampleProbability, sum of resampleProbability below), set by sample_node_normalizer
+    preorder_cache = None # list of subnodes, set by preorder
+
+    # The position of this node's rule among its nonterminal's rules, for the grammar version rule_key (see
+    # Grammar.rule_position). These describe only this node, so they are copied like any other attribute.
+    rule_id = None
+    rule_key = None
+
+    # True for the nodes of a NodeStore, which are part of many trees at once and so have no parent. Copies
+    # of them are ordinary nodes.
+    shared = False
 
     def __init__(self, parent, returntype, name, args):
         self_update(self,locals())
@@ -80,6 +129,26 @@ class FunctionNode(object):
         for a in self.argFunctionNodes():
             a.parent = self
         self.parent = old_parent
+        self.__dict__.pop('preorder_cache', None) # this would start with q
+
+        # anything cached above us is now wrong
+        if self.parent is not None:
+            self.parent.invalidate()
+
+    def invalidate(self, recurse_up=True):
+        """Drop the values cached on this node (see FunctionNode.Caches) and, if recurse_up, on everything
+        above it. This must be called if you modify a node's args in place; setto does it for you.
+        """
+        for x in (self.up_to(to=None) if recurse_up else [self]):
+            for k in FunctionNode.Caches:
+                x.__dict__.pop(k, None)
+
+    def __getstate__(self):
+        """ Don't pickle weight_cache, since it holds a function (which may be a lambda), or preorder_cache """
+        d = dict(self.__dict__)
+        d.pop('weight_cache', None)
+        d.pop('preorder_cache', None)
+        return d
 
     def get_rule_signature(self):
         """ The rule signature is used to pair up FunctionNodes with GrammarRules in computing log probability
@@ -106,7 +175,8 @@ class FunctionNode(object):
         fn = FunctionNode(self.parent, self.returntype, self.name, None)
 
         # And then then copy the rest -- needed for if we add info to FunctionNodes, like a resample_p
-        for k in set(self.__dict__.keys()).difference(FunctionNode.NoCopy): # None of these!
+        nocopy = FunctionNode.NoCopy.union(FunctionNode.Caches if shallow else FunctionNode.NodeCaches)
+        for k in set(self.__dict__.keys()).difference(nocopy): # None of these!
             fn.__dict__[k] = copy(self.__dict__[k])
 
         if (not shallow) and self.args is not None:
@@ -119,6 +189,12 @@ class FunctionNode(object):
             a.parent = fn 
 
         return fn 
+
+    def __deepcopy__(self, memo):
+        """A deepcopy is a copy of the subtree below us, with its parents set, and our parent is not copied.
+        Following parents would copy much more than the tree, since subtrees that trees share (see
+        replace_subnode) keep their parents in other trees, whose shared subtrees do too, and so on."""
+        return copy(self)
         
     def is_nonfunction(self):
         """Returns True if the Node contains no function arguments, False otherwise."""
@@ -243,24 +319,32 @@ class FunctionNode(object):
         NOTE: We need to do thsi using fullstring instead of pystring in order to avoid the fact that pystring ignores
         returntypes and nodes whose name is ''
 
+        Since equal trees have equal structural hashes, we can skip fullstring whenever those differ.
+
         """
+        if self is other:
+            return True
+        if isFunctionNode(other) and self.structural_hash() != other.structural_hash():
+            return False
         return fullstring(self) == fullstring(other)
 
-    # TODO: overwrite these with something faster
-    # hash trees. This just converts to string -- maybe too slow?
     def __hash__(self):
-        # # An attempt to speed things up -- not so great!
-        # hsh = self.ruleid
-        # if self.args is not None:
-        #     for a in filter(isFunctionNode, self.args):
-        #         hsh = hsh ^ hash(a)
-        # return hsh
-        #
-        # # use a quicker string hash
-        # return hash(self.quickstring())
-
-        # normal string hash -- faster?
-        return hash(str(self))
+        return self.structural_hash()
+
+    def structural_hash(self):
+        """A hash of this tree that agrees with ==, so it is the same for alpha-equivalent trees (e.g.
+        lambda x: x and lambda y: y). This is built bottom-up and cached on each node (see invalidate),
+        so after the first call it is O(1), and after a change it only recomputes up from there.
+
+        Each node's hash is a closed part, which depends only on the structure below it, plus a sum of
+        coefficient*hash(name) for each bound variable that is free below it, where the coefficient
+        records the positions it is used in. At the lambda that binds a variable, its term is folded
+        into the closed part with a constant that depends only on the lambda's bv_prefix, so that
+        the name no longer matters. Everything is mod a prime and stable across processes.
+        """
+        if self.hash_cache is None:
+            self._fill(lambda x: x.hash_cache is not None, _compute_hash_cache)
+        return self.hash_cache[2]
 
 
     def __cmp__(self, x):
@@ -338,34 +422,45 @@ class FunctionNode(object):
 
         Note
         ----
-        * This will NOT work if you modify the tree. Then all goes to hell.
-        * If the tree must be modified, use self.subnodes().
+        * This iterates over preorder(), which is cached, so modifying the tree while iterating does not affect
+          which nodes are yielded.
 
         """
-        yield self
-
-        for a in self.argFunctionNodes():
-            for ssn in a:
-                yield ssn
+        return iter(self.preorder())
+
+    def preorder(self):
+        """A list of all subnodes in prefix order. This is cached on the node (see FunctionNode.Caches), so it
+        must not be modified, and is dropped when anything below changes (via setto or invalidate)."""
+        if self.preorder_cache is None:
+            out = []
+            stack = [self]
+            while stack:
+                x = stack.pop()
+                out.append(x)
+                if x.args is not None:
+                    stack.extend(a for a in reversed(x.args) if isFunctionNode(a))
+            self.preorder_cache = out
+        return self.preorder_cache
 
     def iterdepth(self):
         """Iterates subnodes, yielding node and depth."""
-        yield (self, 0)
-
-        if self.args is not None:
-            for a in self.argFunctionNodes():
-                for ssn, dd in a.iterdepth():
-                    yield (ssn, dd+1)
+        stack = [(self, 0)]
+        while stack:
+            x, d = stack.pop()
+            yield (x, d)
+            if x.args is not None:
+                stack.extend((a, d+1) for a in reversed(x.args) if isFunctionNode(a))
 
     def all_leaves(self):
         """Returns a generator for all leaves of the subtree rooted at the instantiated FunctionNode."""
-        if self.args is not None:
-            for i in range(len(self.args)):  # loop through kids
-                if isFunctionNode(self.args[i]):
-                    for ssn in self.args[i].all_leaves():
-                        yield ssn
-                else:
-                    yield self.args[i]
+        stack = [self]
+        while stack:
+            x = stack.pop()
+            if isFunctionNode(x):
+                if x.args is not None:
+                    stack.extend(reversed(x.args))
+            else:
+                yield x
 
     def string_below(self, sep=" "):
         """The string of terminals (leaves) below the current FunctionNode in the parse tree.
@@ -392,6 +487,7 @@ class FunctionNode(object):
         """Yield all nodes going up to "to". If "to" is None, we go until the root (default)."""
         ptr = self
         while (ptr is not to) and (ptr is not None):
+            assert not ptr.shared, "*** Can't go up from a node shared by a NodeStore, since it has no parent. Use NodeStore.thaw first"
             yield ptr
             ptr = ptr.parent
 
@@ -400,22 +496,47 @@ class FunctionNode(object):
         return self.count_subnodes(**kwargs)
 
     def count_subnodes(self, predicate=lambdaTrue):
-        """Returns the subnode count."""
+        """Returns the subnode count. With the default predicate, this is cached (see size_cache)."""
+        if predicate is lambdaTrue:
+            return self._sizes()[0]
         return len(list(filter(predicate, self)))
 
     def depth(self):
         """Returns the depth of the tree (how many embeddings below)."""
-        depths = [a.depth() for a in self.argFunctionNodes()]
-        depths.append(-1)  # for no function nodes (+1=0)
-        return max(depths)+1
+        return self._sizes()[1]
+
+    def _sizes(self):
+        if self.size_cache is None:
+            self._fill(lambda x: x.size_cache is not None, _compute_size_cache)
+        return self.size_cache
+
+    def _fill(self, done, compute):
+        """Call compute(x) on each node x below self, bottom-up, skipping any where done(x) (and everything
+        below those). This is how the cached values in FunctionNode.Caches are built without recursion."""
+        stack = [(self, False)]
+        while stack:
+            x, expanded = stack.pop()
+            if expanded:
+                compute(x)
+            elif not done(x):
+                stack.append((x, True))
+                for a in x.argFunctionNodes():
+                    if not done(a):
+                        stack.append((a, False))
 
     def sample_node_normalizer(self, resampleProbability=lambdaOne):
         """
         Compute Z to be the sum of all subnodes' value from resampleProbability.
         * resampleProbability -- a function that gives the resample probability (NOT log prob.) of each node.
         NOTE: We allow resampleProbability to return a boolean, for 0/1 probability.
+        NOTE: The sum below each node is cached on it (see weight_cache) for this resampleProbability, so this
+              assumes resampleProbability(x) only depends on x and what is below it.
         """
-        return sum([ 1.0*resampleProbability(x) for x in self])
+        cached = self.weight_cache
+        if cached is None or cached[0] is not resampleProbability:
+            self._fill(lambda x: x.weight_cache is not None and x.weight_cache[0] is resampleProbability,
+                       lambda x: _compute_weight_cache(x, resampleProbability))
+        return self.weight_cache[1]
 
     def sampling_log_probability(self,node,resampleProbability=lambdaOne):
         return nicelog(1.0*resampleProbability(node)) - nicelog(self.sample_node_normalizer(resampleProbability=resampleProbability))
@@ -426,19 +547,88 @@ class FunctionNode(object):
         We return a sampled tree and the log probability of sampling it
 
         """
-        Z = self.sample_node_normalizer(resampleProbability=resampleProbability) # the total probability
+        path, lp = self.sample_subnode_path(resampleProbability=resampleProbability)
+        return [path[-1], lp]
+
+    def sample_subnodes(self, n, resampleProbability=lambdaOne):
+        """Sample n subnodes (independently, with replacement), returning a list of [subnode, log probability]"""
+        Z = self.sample_node_normalizer(resampleProbability=resampleProbability)
+        if not (Z > 0.0):
+            raise NodeSamplingException
+
+        out = []
+        for _ in range(n):
+            path, w = self._descend(random() * Z, resampleProbability)
+            out.append([path[-1], log(w) - log(Z)])
+        return out
+
+    def sample_subnode_path(self, resampleProbability=lambdaOne):
+        """Like sample_subnode, but return the path to the sampled node (a list of nodes from self down to it)
+        instead of the node. This does not use parent pointers, so it works on trees that share subtrees.
+        """
+        Z = self.sample_node_normalizer(resampleProbability=resampleProbability)
         if not (Z > 0.0):
             raise NodeSamplingException
 
-        r = random() * Z # now select a random number (giving a random node)
+        path, w = self._descend(random() * Z, resampleProbability)
+        return [path, log(w) - log(Z)]
+
+    def _descend(self, r, resampleProbability):
+        """Find the node where the cumulative resampleProbability in prefix order passes r, going down from self
+        using the sums cached by sample_node_normalizer. This is O(depth) rather than O(size). Returns the path to
+        it and its resampleProbability."""
+        t = self
+        path = [t]
+        while True:
+            w = 1.0*resampleProbability(t)
+            r -= w
+            if r < 0:
+                return path, w
+
+            nxt = None
+            for a in t.argFunctionNodes():
+                za = a.weight_cache[1]
+                if za > 0:
+                    nxt = a
+                    if r < za:
+                        break
+                    r -= za
+
+            if nxt is None: # we can only get here by rounding, when t is the last node we could choose
+                assert w > 0
+                return path, w
+
+            t = nxt
+            path.append(t)
+
+    def copy_with_args(self, args):
+        """A shallow copy of this node whose args are args. Nothing's parent is changed, including args'."""
+        kids = list(self.argFunctionNodes())
+        parents = [a.parent for a in kids] # self, or None if they are shared (see NodeStore)
+        fn = self.__copy__(shallow=True)
+        for a, p in zip(kids, parents): # the shallow copy took these as its kids
+            a.parent = p
+        fn.args = args
+        return fn
 
-        for t in self:
-            trp = float(resampleProbability(t))
-            r -= trp
-            if r <= 0:
-                return [t, log(trp) - log(Z)]
+    def replace_subnode(self, path, new):
+        """Return a tree like self but with path[-1] replaced by new, where path is a list of nodes from self down
+        (e.g. from sample_subnode_path). self is not changed: only the nodes on path are copied, and the new tree
+        shares every other subtree with self.
 
-        assert False, "Should not get here"
+        The copied nodes and new have their parents set, but the shared subtrees keep their parents in self. So
+        code that works on trees from here should follow paths down from the root (as the proposers do) rather
+        than parent pointers up; copy() the result if you need parents everywhere.
+        """
+        assert path[0] is self
+
+        for x, old in zip(reversed(path[:-1]), reversed(path)):
+            x_new = x.copy_with_args([new if a is old else a for a in x.args])
+            new.parent = x_new
+            new = x_new
+
+        new.parent = self.parent
+        return new
 
     # get a description of the input and output types
     # if collapse_terminal then we just map non-FunctionNodes to "TERMINAL"
@@ -611,6 +801,8 @@ class FunctionNode(object):
         if remap is None:
             remap = dict()
 
+        self.invalidate(recurse_up=False) # names of free variables below us are changing
+
         if isinstance(self, BVAddFunctionNode):
             # TODO: MAKE THIS THE SAME FUNCTION AS USED IN GRAMMAR_RULE
             newbv = 'bv__'+uuid4().hex
@@ -701,6 +893,10 @@ class BVAddFunctionNode(FunctionNode):
         else:
             fn.args = self.args
 
+        if not shallow:
+            for k in FunctionNode.Caches.difference(FunctionNode.NodeCaches).intersection(self.__dict__.keys()):
+                fn.__dict__[k] = self.__dict__[k]
+
         for a in fn.argFunctionNodes():
             a.parent = fn
 
@@ -785,6 +981,10 @@ class BVUseFunctionNode(FunctionNode):
         else:
             fn.args = self.args
 
+        if not shallow:
+            for k in FunctionNode.Caches.difference(FunctionNode.NodeCaches).intersection(self.__dict__.keys()):
+                fn.__dict__[k] = self.__dict__[k]
+
         for a in fn.argFunctionNodes():
             a.parent = fn
 
@@ -793,6 +993,81 @@ class BVUseFunctionNode(FunctionNode):
 
 
 
+# ------------------------------------------------------------------------------------------------------------
+# Subtree sizes and weights (see FunctionNode._sizes and sample_node_normalizer)
+
+def _compute_size_cache(x):
+    kids = [a.size_cache for a in x.argFunctionNodes()]
+    x.size_cache = (1 + sum(k[0] for k in kids), 1 + max(k[1] for k in kids) if kids else 0)
+
+def _compute_weight_cache(x, resampleProbability):
+    x.weight_cache = (resampleProbability, 1.0*resampleProbability(x) + sum(a.weight_cache[1] for a in x.argFunctionNodes()))
+
+# ------------------------------------------------------------------------------------------------------------
+# Structural hashing (see FunctionNode.structural_hash)
+
+from hashlib import blake2b
+
+HASH_PRIME = (1 << 61) - 1
+_EMPTY = dict() # shared coefficients for nodes with no free variables -- never modified
+_labels = dict()
+
+def stable_hash(s):
+    """ A hash of the string s mod HASH_PRIME that is the same in every process (unlike hash()) """
+    return int.from_bytes(blake2b(s.encode('utf-8'), digest_size=8).digest(), 'little') % HASH_PRIME
+
+def _label(x):
+    """ A stable hash of everything about the node x itself (not its children). Bound variable names are left
+    out, since they are handled by the coefficients. """
+    if isinstance(x, BVUseFunctionNode):
+        key = ('use', x.returntype, None)
+    elif isinstance(x, BVAddFunctionNode):
+        key = ('add', x.returntype, x.name, x.added_rule.bv_prefix)
+    else:
+        key = ('fn', x.returntype, x.name)
+    if x.args is not None:
+        key = key + tuple(None if isFunctionNode(a) else a for a in x.args)
+    else:
+        key = key + ('<no args>',)
+
+    h = _labels.get(key)
+    if h is None:
+        h = _labels[key] = stable_hash(repr(key))
+    return h
+
+def _compute_hash_cache(x):
+    """ Set x.hash_cache from its children's, which must already be set """
+    label = _label(x)
+    kids = [a.hash_cache for a in x.argFunctionNodes()]
+
+    closed = hash((label,) + tuple(k[0] for k in kids)) % HASH_PRIME
+
+    coefficients = _EMPTY
+    for i, k in enumerate(kids):
+        if len(k[1]) > 0:
+            if coefficients is _EMPTY:
+                coefficients = dict()
+            # where this child is, so that paths are distinguished (NOTE: not negative, since hash(-1) == hash(-2))
+            m = (hash((label, i+1, k[0])) % HASH_PRIME) or 1
+            for v, c in k[1].items():
+                coefficients[v] = (coefficients.get(v, 0) + m*c) % HASH_PRIME
+
+    if isinstance(x, BVUseFunctionNode):
+        if coefficients is _EMPTY:
+            coefficients = dict()
+        coefficients[x.name] = (coefficients.get(x.name, 0) + 1) % HASH_PRIME
+    elif isinstance(x, BVAddFunctionNode) and x.added_rule.name in coefficients:
+        coefficients = dict(coefficients)
+        c = coefficients.pop(x.added_rule.name)
+        closed = (closed + c * stable_hash('bound '+x.added_rule.bv_prefix)) % HASH_PRIME
+
+    h = closed
+    for v, c in coefficients.items():
+        h = (h + c * stable_hash(v)) % HASH_PRIME
+
+    x.hash_cache = (closed, coefficients, h)
+
+
 # ------------------------------------------------------------------------------------------------------------
 # ------------------------------------------------------------------------------------------------------------
 #
@@ -854,30 +1129,29 @@ def fullstring(x, d=0, bv_names=None):
         if bv_names is None:
             bv_names = dict()
 
+        def enter(x, d):
+            # On a lambda, we must add the introduced bv, and then remove it again afterwards (in combine)
+            if isinstance(x, BVAddFunctionNode):
+                bv_names[x.added_rule.name] = x.added_rule.bv_prefix+str(d)
 
-        if isinstance(x, BVAddFunctionNode):
-            # On a lambda, we must add the introduced bv, and then remove it again afterwards
-
-            bvn = x.added_rule.bv_prefix+str(d)
-            bv_names[x.added_rule.name] = bvn
-
-            ret = '%s<%s> %s: %s' % ( x.name, x.returntype, bvn, [fullstring(xi, d=d+1, bv_names=bv_names) for xi in x.args] )
-
-            del bv_names[x.added_rule.name]
+        def combine(x, d, args):
+            args = None if args is None else [a if isinstance(a, str) else None for a in args]
 
-            return ret
-        else:
+            if isinstance(x, BVAddFunctionNode):
+                ret = '%s<%s> %s: %s' % ( x.name, x.returntype, bv_names[x.added_rule.name], args )
+                del bv_names[x.added_rule.name]
+                return ret
+            else:
+                name = x.name
+                if isinstance(x, BVUseFunctionNode):
+                    name = bv_names.get(x.name, x.name)
 
-            name = x.name
-            if isinstance(x, BVUseFunctionNode):
-                name = bv_names.get(x.name, x.name)
+                if args is None:
+                    return "%s<%s>"%(name, x.returntype)
+                else:
+                    return "%s<%s>(%s)" % (name, x.returntype, ', '.join(args))
 
-            if x.args is None:
-                return "%s<%s>"%(name, x.returntype)
-            else:
-                return "%s<%s>(%s)" % (name,
-                                       x.returntype,
-                                       ', '.join([fullstring(a, d=d+1, bv_names=bv_names) for a in x.args]))
+        return fold(x, combine, enter=enter, d=d)
 
 
 
@@ -896,46 +1170,52 @@ def pystring(x, d=0, bv_names=None):
         if bv_names is None:
             bv_names = dict()
 
-        bvn = '' # used when lambda but not BVAddFunctionNode
-        if isinstance(x, BVAddFunctionNode):
-            bvn = x.added_rule.bv_prefix+str(d)
-            bv_names[x.added_rule.name] = bvn
-            # assert len(x.args) == 1
+        def enter(x, d):
+            if isinstance(x, BVAddFunctionNode):
+                bv_names[x.added_rule.name] = x.added_rule.bv_prefix+str(d)
 
+        def combine(x, d, args):
+            args = None if args is None else [a if isinstance(a, str) else None for a in args]
 
-        # Now handle the name special cases
-        if x.args is None: # terminal
-            if isinstance(x, BVUseFunctionNode):
-                ret = bv_names.get(x.name, x.name)
-            else:
-                ret = x.name
-        elif x.name == '':
-            assert len(x.args) == 1, "Null names must have exactly 1 argument"
-            ret = pystring(x.args[0], d=d+1, bv_names=bv_names)
+            bvn = '' # used when lambda but not BVAddFunctionNode
+            if isinstance(x, BVAddFunctionNode):
+                bvn = bv_names[x.added_rule.name]
 
-        elif percent_s_regex.search(x.name): # If we match the python string substitution character %s, then format
-            ret = x.name % tuple([pystring(a, d=d+1, bv_names=bv_names) for a in x.args])
+            # Now handle the name special cases
+            if args is None: # terminal
+                if isinstance(x, BVUseFunctionNode):
+                    ret = bv_names.get(x.name, x.name)
+                else:
+                    ret = x.name
+            elif x.name == '':
+                assert len(args) == 1, "Null names must have exactly 1 argument"
+                ret = args[0]
 
-        elif x.name == 'lambda': # we are a lambda but NOT a BVAddFunctionNode -- a lambda thunk!
-                assert len(x.args) == 1
-                ret = 'lambda %s: %s' % (bvn, pystring(x.args[0], d=d+1, bv_names=bv_names))
-        else:
+            elif percent_s_regex.search(x.name): # If we match the python string substitution character %s, then format
+                ret = x.name % tuple(args)
 
-            name = x.name
-            if isinstance(x, BVUseFunctionNode): # handle bv functions
-                name = bv_names.get(x.name, x.name)
+            elif x.name == 'lambda': # we are a lambda but NOT a BVAddFunctionNode -- a lambda thunk!
+                    assert len(args) == 1
+                    ret = 'lambda %s: %s' % (bvn, args[0])
+            else:
 
-            ret = name+'('+', '.join([pystring(a, d=d+1, bv_names=bv_names) for a in x.args])+')'
+                name = x.name
+                if isinstance(x, BVUseFunctionNode): # handle bv functions
+                    name = bv_names.get(x.name, x.name)
 
-        # and if we have any bv matches, then insert the bv we introduce
-        if bv_regex.search(ret):
-            ret = bv_regex.sub(bvn, ret)
+                ret = name+'('+', '.join(args)+')'
 
-        # On a lambda, we must add the introduced bv, and then remove it again afterwards
-        if isinstance(x, BVAddFunctionNode):
-            del bv_names[x.added_rule.name]
+            # and if we have any bv matches, then insert the bv we introduce
+            if bv_regex.search(ret):
+                ret = bv_regex.sub(bvn, ret)
 
-        return ret
+            # On a lambda, we must add the introduced bv, and then remove it again afterwards
+            if isinstance(x, BVAddFunctionNode):
+                del bv_names[x.added_rule.name]
+
+            return ret
+
+        return fold(x, combine, enter=enter, d=d)
 
 
 
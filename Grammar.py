@@ -3,14 +3,27 @@
 #try: import numpy as np
 #except ImportError: import numpypy as np
 
+try: import scipy.sparse as sparse
+except ImportError: sparse = None # rule_count_matrix falls back to a dense numpy array
+
 from copy import copy
 from collections import defaultdict
+from uuid import uuid4
+from threading import get_ident
+import hashlib
+import pickle
 import itertools
 
 from LOTlib3.Miscellaneous import *
-from LOTlib3.GrammarRule import GrammarRule, BVAddGrammarRule
+from LOTlib3.GrammarRule import GrammarRule, BVAddGrammarRule, BVUseGrammarRule
 from LOTlib3.BVRuleContextManager import BVRuleContextManager
-from LOTlib3.FunctionNode import FunctionNode, BVAddFunctionNode
+from LOTlib3.FunctionNode import FunctionNode, BVAddFunctionNode, BVUseFunctionNode, isFunctionNode
+from LOTlib3.RuleIndex import RuleIndex
+from LOTlib3.BVScope import EMPTY_SCOPE
+from LOTlib3.EnumerationTable import EnumerationTable
+from LOTlib3.GrammarStatistics import GrammarStatistics
+from LOTlib3.SizeTable import SizeTable, scope_of
+from LOTlib3.ArrayTree import ArrayTable, ArrayTree
 
 
 # when we pack, we are allowed to use these characters, in this order
@@ -21,12 +34,81 @@ pack_string = '0123456789'+string.ascii_lowercase+string.ascii_uppercase
 class Grammar(CommonEqualityMixin):
     """
     A PCFG-ish class that can handle rules that introduce bound variables
+
+    Note
+    ----
+    Lookups and sampling go through a RuleIndex for each nonterminal, which is built lazily and thrown
+    away when the rules change. self.version is incremented whenever rules are added or their
+    probabilities change (add_rule, renormalize). If you change a rule's p by hand, call mark_changed().
+
+    log_probability caches its value on each FunctionNode, keyed by context_key(), which identifies this
+    grammar, its version, and the bound variables currently in scope. Copies and unpickled grammars get a new
+    uid, since their rules can change independently of the original's while their versions stay in step.
+
+    Trees made by generate carry the position of each node's rule (FunctionNode.rule_id), along with the
+    rule_key() it is valid for, so that rule_position does not need to match signatures. Other trees (e.g.
+    from pickles or other grammars) are matched by signature, and annotated the first time they are.
+
+    Bound variables are never added to self.rules. Instead, each thread has its own BVScope, an immutable
+    overlay of the bound variable rules that are in scope, which push_bv_rule and pop_bv_rule (and so
+    BVRuleContextManager) replace. This makes it safe to share one grammar between threads.
+
     """
+    NoCompare = {'_index', '_scopes', '_enumeration_table', '_packing', '_fingerprint', '_packing_fingerprint', '_statistics', '_size_table', '_array_table', '_rule_key', 'version', 'uid'} # not part of a grammar's identity
+
     def __init__(self, BV_P=10.0, start='START'):
         self_update(self,locals())
         self.rules = defaultdict(list)  # A dict from nonterminals to lists of GrammarRules.
         self.rule_count = 0
         self.bv_count = 0   # How many rules in the grammar introduce bound variables?
+        self.version = 0
+        self._index = dict()   # nonterminal -> RuleIndex for self.rules, built lazily by get_base_rule_index
+        self._scopes = dict()  # thread id -> its current BVScope (missing means EMPTY_SCOPE)
+        self.uid = uuid4().hex
+        self._enumeration_table = None
+        self._packing = None   # (context key, sig2idx, idx2rule, offsets), built lazily by get_packing_index
+        self._rule_key = None  # (uid, version), see rule_key
+        self._fingerprint = None # (version, fingerprint)
+        self._packing_fingerprint = None # (context key, fingerprint), see packing_fingerprint
+        self._statistics = None  # GrammarStatistics, built lazily by get_statistics
+        self._size_table = None  # SizeTable, built lazily by get_size_table
+        self._array_table = None # ArrayTable, built lazily by get_array_table
+
+    def __eq__(self, other):
+        return isinstance(other, self.__class__) and \
+            all(self.__dict__.get(k) == other.__dict__.get(k)
+                for k in set(self.__dict__.keys()).union(other.__dict__.keys()).difference(Grammar.NoCompare))
+
+    def __getstate__(self):
+        """ Don't pickle the compiled indices -- they get rebuilt when needed """
+        d = copy(self.__dict__)
+        d['_index'] = dict()
+        d['_scopes'] = dict()
+        d['_enumeration_table'] = None
+        d['_packing'] = None
+        d['_packing_fingerprint'] = None
+        d['_statistics'] = None
+        d['_size_table'] = None
+        d['_array_table'] = None
+        d['_rule_key'] = None
+        return d
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('version', 0)
+        self.__dict__.setdefault('_index', dict())
+        self.__dict__.setdefault('_scopes', dict())
+        self.uid = uuid4().hex # copy and deepcopy come through here too, and may diverge from the original
+        self.__dict__.setdefault('_enumeration_table', None)
+        self.__dict__.setdefault('_packing', None)
+        self.__dict__.setdefault('_fingerprint', None)
+        self.__dict__.setdefault('_packing_fingerprint', None)
+        self.__dict__.setdefault('_statistics', None)
+        self.__dict__.setdefault('_size_table', None)
+        self.__dict__.setdefault('_array_table', None)
+        self.__dict__.setdefault('_rule_key', None)
+        for k in ('_bv_stack', '_bv_names', '_context_key'): # from older versions
+            self.__dict__.pop(k, None)
 
     def __str__(self):
         """Display a grammar."""
@@ -39,9 +121,13 @@ class Grammar(CommonEqualityMixin):
 
     def get_rules(self, nt):
         """
-        The possible rules for any nonterminal
+        The possible rules for any nonterminal, including the bound variables in scope
         """
-        return self.rules[nt]
+        bv = self.get_scope().by_nt.get(nt)
+        if bv is None:
+            return self.rules.get(nt, []) # NOTE: .get so we don't add nt to self.rules
+        else:
+            return self.rules.get(nt, []) + list(bv)
 
     def get_all_rules(self):
         """
@@ -52,9 +138,9 @@ class Grammar(CommonEqualityMixin):
                 yield r
 
     def is_nonterminal(self, x):
-        """A nonterminal is just something that is a key for self.rules"""
+        """A nonterminal is just something that is a key for self.rules, or the type of a bound variable in scope"""
         # if x is a string  &&  if x is a key
-        return isinstance(x, str) and (x in self.rules)
+        return isinstance(x, str) and (x in self.rules or x in self.get_scope().by_nt)
 
     def display_rules(self):
         """Prints all the rules to the console."""
@@ -69,7 +155,7 @@ class Grammar(CommonEqualityMixin):
 
     def nonterminals(self):
         """Returns all non-terminals."""
-        return list(self.rules.keys())
+        return list(self.rules.keys()) + [nt for nt in self.get_scope().by_nt if nt not in self.rules]
 
     def get_rule_by_name(self, n, nt=None):
         if nt is None:
@@ -79,48 +165,190 @@ class Grammar(CommonEqualityMixin):
         assert len(matches)==1, "%s %s %s" % (n, nt, str(matches))
         return matches[0]
 
+    # --------------------------------------------------------------------------------------------------------
+    # Compiled rule indices
+    # --------------------------------------------------------------------------------------------------------
+
+    def get_rule_index(self, nt):
+        """
+        Return the RuleIndex for nt (including any bound variables in scope), building it if the rules for
+        nt have changed since it was last built.
+        """
+        scope = self.get_scope()
+        if nt in scope.by_nt:
+            return scope.get_rule_index(self, nt)
+        else:
+            return self.get_base_rule_index(nt)
+
+    def get_base_rule_index(self, nt):
+        """ The RuleIndex for nt's rules in self.rules, ignoring bound variables """
+        idx = self._index.get(nt)
+        if idx is None:
+            idx = RuleIndex(self.rules.get(nt, []), self.version) # NOTE: .get so we don't add nt to self.rules
+            self._index[nt] = idx
+        return idx
+
+    def mark_changed(self, nt=None):
+        """
+        Tell the grammar that the rules for nt (or all nonterminals, if nt is None) have changed, so that
+        any compiled indices are rebuilt. This is called by add_rule and renormalize.
+        """
+        self.version += 1
+        if nt is None:
+            self._index.clear()
+        else:
+            self._index.pop(nt, None)
+
+    def context_key(self):
+        """
+        A key for the current state of the grammar, including the bound variables that are in scope. Anything
+        computed in this context (like the log probability of a subtree) is valid as long as the key is equal.
+        """
+        return self.get_scope().context_key(self)
+
+    def get_scope(self):
+        """ The BVScope of bound variable rules that are in scope for the current thread """
+        return self._scopes.get(get_ident(), EMPTY_SCOPE)
+
+    def current_bv_rules(self):
+        """ The bound variable rules in scope, in the order they were pushed """
+        return self.get_scope().rules
+
+    def push_bv_rule(self, r):
+        """
+        Add a bound variable rule r to the current thread's scope. Pushes and pops should be nested, as
+        they are in BVRuleContextManager.
+        """
+        self._scopes[get_ident()] = self.get_scope().push(r)
+
+    def pop_bv_rule(self, r):
+        """
+        Remove a bound variable rule r that was added by push_bv_rule.
+        """
+        tid = get_ident()
+        scope = self.get_scope()
+        if scope.rule is r: # the usual case, since contexts are nested
+            scope = scope.parent
+        else:
+            scope = scope.remove(r)
+
+        if len(scope) == 0:
+            self._scopes.pop(tid, None)
+        else:
+            self._scopes[tid] = scope
+
+    def rule_key(self):
+        """
+        A key for this grammar and its version. The rule ids on FunctionNodes (see rule_position) are only used
+        while this is equal to the key they were made with. Unlike context_key, this ignores bound variables,
+        since rules for bound variables never get ids.
+        """
+        k = self._rule_key
+        if k is None or k[1] != self.version or k[0] != self.uid:
+            k = self._rule_key = (self.uid, self.version)
+        return k
+
+    def annotate(self, t, i):
+        """ Record on t that its rule is at position i of its nonterminal's rules (see rule_position) """
+        if not isinstance(t, BVUseFunctionNode): # their rules, and so their positions, depend on the scope
+            t.rule_id = i
+            t.rule_key = self.rule_key()
+
+    def rule_position(self, t, idx=None):
+        """
+        The position of t's rule in idx (default: the RuleIndex for t.returntype, with the bound variables in
+        scope), or None if there is no matching rule. This uses t.rule_id if it was made by this version of this
+        grammar, and otherwise matches t's signature (and sets t.rule_id for next time).
+
+        Rules from self.rules come before any bound variables in every RuleIndex for their nonterminal, so their
+        positions do not depend on the bound variables in scope.
+        """
+        if t.rule_key is not None and t.rule_key == self.rule_key():
+            return t.rule_id
+
+        if idx is None:
+            idx = self.get_rule_index(t.returntype)
+        i = idx.position(t.get_rule_signature())
+        if i is not None:
+            self.annotate(t, i)
+        return i
+
     def get_matching_rule(self, t):
         """
-        Get the rule matching t's signature. Note: We could probably speed this up with a hash table if need be.
+        Get the rule matching t's signature.
         """
-        rules = self.get_rules(t.returntype)
-        matching_rules = [r for r in rules if (r.get_rule_signature() == t.get_rule_signature())]
-        assert len(matching_rules) == 1, \
-            "Grammar Error: " + str(len(matching_rules)) + " matching rules for this FunctionNode! %s %s %s" % (t.get_rule_signature(), str(t), matching_rules)
-        return matching_rules[0]
+        idx = self.get_rule_index(t.returntype)
+        i = self.rule_position(t, idx)
+        assert i is not None, \
+            "Grammar Error: 0 matching rules for this FunctionNode! %s %s %s" % (t.get_rule_signature(), str(t), idx.rules)
+        return idx.rules[i]
 
     def single_probability(self, t):
         # in this tree, in its context (recursing up), what is the probability of this single expansion?
 
         with BVRuleContextManager(self, t, recurse_up=True):
-            z = log(sum([ r.p for r in self.get_rules(t.returntype) ]))
-            r = self.get_matching_rule(t)
-            return log(r.p)-z
+            idx = self.get_rule_index(t.returntype)
+            i = self.rule_position(t, idx)
+            assert i is not None, "Failed to find matching rule at %s" % t
+            return idx.log_probability(i)
 
     def log_probability(self, t):
         """
-        Returns the log probability of t, recomputing everything (as we do now)
+        Returns the log probability of t.
 
-        This is overall about half as fast, but it means we don't have to store generation_probability
+        Each subtree's log probability is cached on the subtree (see FunctionNode.lp_cache), keyed by
+        context_key(), so that after a change to one subtree (via setto), rescoring only recomputes
+        the nodes from that subtree up to the root. t may also be an ArrayTree.
         """
+        if isinstance(t, ArrayTree):
+            return t.log_probability()
         assert isinstance(t, FunctionNode)
 
-        z = log(sum([ r.p for r in self.get_rules(t.returntype) ]))
-
-        # Find the one that matches. While it may seem like we should store this, that is hard to make work
-        # with multiple grammar objects across loading/saving, because the objects will change. This way,
-        # we always look it up.
-        lp = -Infinity
-        r = self.get_matching_rule(t)
-        assert r is not None, "Failed to find matching rule at %s %s" % (t, r)
-
-        lp = log(r.p) - z
-
-        with BVRuleContextManager(self, t):
-            for a in t.argFunctionNodes():
-                lp += self.log_probability(a)
-
-        return lp
+        # This goes down the tree with an explicit stack (so that it works on trees of any depth), pushing
+        # each lambda's bound variable on the way down and popping it when that lambda's subtree is done.
+        lps = [] # log probabilities of the subtrees that are done
+        pushed = [] # the bound variable rules we have pushed, so we can pop them if something goes wrong
+        stack = [(t, None)]
+        try:
+            while stack:
+                x, post = stack.pop()
+                if post is not None: # all of x's kids are done (their lps are on top), so finish x
+                    key, lp, n = post
+                    for _ in range(n):
+                        lp += lps.pop()
+                    if x.added_rule is not None and x.args is not None:
+                        self.pop_bv_rule(pushed.pop())
+                    x.lp_cache = (key, lp)
+                    lps.append(lp)
+                    continue
+
+                scope = self.get_scope()
+                key = scope.context_key(self)
+                cached = x.lp_cache
+                if cached is not None and cached[0] == key:
+                    lps.append(cached[1])
+                    continue
+
+                # Find the one that matches. We can't store the rule itself, since that is hard to make work with
+                # multiple grammar objects across loading/saving, because the objects will change. Instead, x may
+                # have the position of its rule for this version of the grammar, and otherwise we look it up (but
+                # in a dict, via the RuleIndex).
+                nt = x.returntype
+                idx = scope.get_rule_index(self, nt) if nt in scope.by_nt else self.get_base_rule_index(nt)
+                i = self.rule_position(x, idx)
+                assert i is not None, "Failed to find matching rule at %s" % x
+
+                kids = list(x.argFunctionNodes())
+                stack.append((x, (key, idx.log_probability(i), len(kids))))
+                if x.args is not None and x.added_rule is not None:
+                    self.push_bv_rule(x.added_rule)
+                    pushed.append(x.added_rule)
+                stack.extend((a, None) for a in reversed(kids))
+        finally:
+            while pushed:
+                self.pop_bv_rule(pushed.pop())
+
+        return lps[0]
 
     def add_rule(self, nt, name, to, p, bv_type=None, bv_args=None, bv_prefix='y', bv_p=None):
         """Adds a rule and returns the added rule.
@@ -142,6 +370,7 @@ class Grammar(CommonEqualityMixin):
             newrule = GrammarRule(nt, name, to, p=p)
 
         self.rules[nt].append(newrule)
+        self.mark_changed(nt)
         return newrule
     
     def is_terminal_rule(self, r):
@@ -161,6 +390,10 @@ class Grammar(CommonEqualityMixin):
         Arguments:
             x (string): What we start from -- can be None and then we use Grammar.start.
 
+        Note:
+            Trees are built with an explicit stack (see generate_nonterminal), so deep trees do not run
+            into python's recursion limit.
+
         """
         # print "# Calling Grammar.generate", type(x), x
 
@@ -174,37 +407,11 @@ class Grammar(CommonEqualityMixin):
         if isinstance(x,list):            
             return [self.generate(x=xi) for xi in x]             # If we get a list, just map along it to generate.
         elif self.is_nonterminal(x):
-
-            # sample a grammar rule
-            rules = self.get_rules(x)
-            assert len(rules) > 0, "*** No rules in x=%s"%x
-
-            # sample the rule
-            r = weighted_sample(rules, probs=lambda x: x.p, log=False)
-
-            # Make a stub for this functionNode 
-            fn = r.make_FunctionNodeStub(self, None)
-
-            # Define a new context that is the grammar with the rule added
-            # Then, when we exit, it's still right.
-            with BVRuleContextManager(self, fn, recurse_up=False):      # not sure why we can't use with/as:
-                # Can't recurse on None or else we genreate from self.start
-                if fn.args is not None:
-                    # and generate below *in* this context (e.g. with the new rules added)
-                    try:
-                        fn.args = self.generate(fn.args)
-                    except RuntimeError as e:
-                        print("*** Runtime error in %s" % fn)
-                        raise e
-
-                # and set the parents
-                for a in fn.argFunctionNodes():
-                    a.parent = fn
-
-            return fn
+            return self.generate_nonterminal(x)
         elif isinstance(x, FunctionNode): # this will let us finish generation of a partial tree
 
             x.args = [ self.generate(a) for a in x.args]
+            x.invalidate()
 
             for a in x.argFunctionNodes():
                 a.parent = x
@@ -215,6 +422,113 @@ class Grammar(CommonEqualityMixin):
             assert isinstance(x, str), ("*** Terminal must be a string! x="+x)
             return x
 
+    def generate_many(self, n, nt=None):
+        """Yield n independent samples from nt (defaultly self.start).
+
+        This skips the dispatch in generate and keeps using the same compiled rule indices, so it is the
+        fastest way to draw lots of trees from the prior.
+        """
+        if nt is None:
+            nt = self.start
+        assert self.is_nonterminal(nt), "*** %s is not a nonterminal" % nt
+
+        for _ in range(n):
+            yield self.generate_nonterminal(nt)
+
+    def _sample_stub(self, nt, parent):
+        """ Sample a rule for nt and return its FunctionNode stub """
+        idx = self.get_rule_index(nt)
+        assert len(idx) > 0, "*** No rules in x=%s" % nt
+        i = idx.sample()
+        fn = idx.rules[i].make_FunctionNodeStub(self, parent)
+        self.annotate(fn, i)
+        return fn
+
+    def generate_nonterminal(self, nt):
+        """Generate a tree from the nonterminal nt.
+
+        This produces the same distribution (and, for a given random state, the same trees) as expanding
+        depth-first with recursion, but keeps the pending nodes on an explicit stack. Each bound variable
+        rule is pushed when its node is created and popped once everything below it has been generated.
+        """
+        return self._expand(nt, self._sample_stub)
+
+    def _expand(self, nt, make_stub):
+        """ Build a tree from nt depth-first, where make_stub(x, parent) chooses the rule for each nonterminal x """
+        root = make_stub(nt, None)
+
+        stack = [root] # nodes whose args are still being expanded
+        argi  = [0]    # for each node on the stack, the next arg to look at
+        if root.added_rule is not None:
+            self.push_bv_rule(root.added_rule)
+
+        try:
+            while stack:
+                fn, i = stack[-1], argi[-1]
+
+                if fn.args is None or i >= len(fn.args): # done with fn
+                    stack.pop()
+                    argi.pop()
+                    if fn.added_rule is not None:
+                        self.pop_bv_rule(fn.added_rule)
+                    continue
+
+                argi[-1] = i+1
+                a = fn.args[i]
+                if self.is_nonterminal(a):
+                    child = make_stub(a, fn)
+                    fn.args[i] = child
+                    if child.added_rule is not None:
+                        self.push_bv_rule(child.added_rule)
+                    stack.append(child)
+                    argi.append(0)
+        finally:
+            # if something went wrong, don't leave bound variables in the grammar
+            for fn in reversed(stack):
+                if fn.added_rule is not None:
+                    self.pop_bv_rule(fn.added_rule)
+
+        return root
+
+    def get_size_table(self, maxnodes):
+        """ A SizeTable for this grammar that goes up to at least maxnodes, rebuilt if the grammar has changed """
+        t = self._size_table
+        if t is None or t.version != self.version or t.maxnodes < maxnodes:
+            self._size_table = SizeTable(self, maxnodes)
+        return self._size_table
+
+    def get_array_table(self):
+        """ The ArrayTable for ArrayTrees from this grammar, rebuilt if the grammar has changed """
+        t = self._array_table
+        if t is None or t.version != self.version:
+            self._array_table = ArrayTable(self)
+        return self._array_table
+
+    def _size_scope(self):
+        """ The bound variable rules that are currently pushed, and their scope for SizeTable """
+        bv_rules = self.current_bv_rules()
+        return bv_rules, scope_of(bv_rules)
+
+    def generate_bounded(self, maxnodes, x=None):
+        """Generate a tree from x (default: self.start) with at most maxnodes nodes.
+
+        This samples exactly from the PCFG conditioned on the tree having at most maxnodes nodes (as counted by
+        FunctionNode.count_nodes), but never builds a tree that is too big (see SizeTable). Like generate,
+        this uses whatever bound variables are currently in the grammar.
+        """
+        if x is None:
+            x = self.start
+        assert self.is_nonterminal(x), "*** generate_bounded needs a nonterminal, not %s" % x
+
+        bv_rules, scope = self._size_scope()
+        return self.get_size_table(maxnodes).sample(x, maxnodes, bv_rules=bv_rules, scope=scope)
+
+    def log_probability_size_at_most(self, x, maxnodes):
+        """ The log probability that generate(x) makes a tree with at most maxnodes nodes, so that the log probability
+        of t under generate_bounded(maxnodes, x) is log_probability(t) minus this. """
+        _, scope = self._size_scope()
+        return self.get_size_table(maxnodes).log_probability_at_most(x, maxnodes, scope=scope)
+
     def enumerate(self, d=20, nt=None, leaves=True):
         """Enumerate all trees up to depth n.
 
@@ -254,7 +568,7 @@ class Grammar(CommonEqualityMixin):
             if d == 0:
                 if leaves:
                     # Note: can NOT use filter here, or else it doesn't include added rules
-                    for r in self.rules[nt]:
+                    for r in self.get_rules(nt):
                         if self.is_terminal_rule(r):
                             yield r.make_FunctionNodeStub(self, None)
                 else:
@@ -262,7 +576,7 @@ class Grammar(CommonEqualityMixin):
                     yield nt
             else:
                 # Note: can NOT use filter here, or else it doesn't include added rules. No sorting either!
-                for r in self.rules[nt]:
+                for r in self.get_rules(nt):
 
                     # No good since it won't be deep enough
                     if self.is_terminal_rule(r):
@@ -272,7 +586,10 @@ class Grammar(CommonEqualityMixin):
 
                     # The possible depths for the i'th child
                     # Here we just ensure that nonterminals vary up to d, and otherwise
-                    child_i_depths = lambda i: range(d) if self.is_nonterminal(fn.args[i]) else [0]
+                    # (in fn's context, since a bound variable's type may only be a nonterminal there)
+                    with BVRuleContextManager(self, fn, recurse_up=False):
+                        child_is_nonterminal = [self.is_nonterminal(a) for a in fn.args]
+                    child_i_depths = lambda i: range(d) if child_is_nonterminal[i] else [0]
 
                     # The depths of each kid
                     for cd in lazyproduct(list(map(child_i_depths, range(len(fn.args)))), child_i_depths):
@@ -305,6 +622,47 @@ class Grammar(CommonEqualityMixin):
                             # Catch this here so we continue in this loop over rules
                             pass
 
+    # --------------------------------------------------------------------------------------------------------
+    # Counting, ranking, and unranking trees (see EnumerationTable)
+    # --------------------------------------------------------------------------------------------------------
+
+    def get_enumeration_table(self):
+        """ The EnumerationTable for this grammar, rebuilt if the grammar has changed """
+        if self._enumeration_table is None or self._enumeration_table.version != self.version:
+            self._enumeration_table = EnumerationTable(self)
+        return self._enumeration_table
+
+    def count_at_depth(self, d, nt=None):
+        """ How many trees does enumerate_at_depth(d, nt) yield? """
+        if nt is None:
+            nt = self.start
+        return self.get_enumeration_table().count(nt, d)
+
+    def unrank(self, nt, d, k):
+        """ Return the k'th tree (counting from 0) that enumerate_at_depth(d, nt) would yield """
+        if nt is None:
+            nt = self.start
+        assert 0 <= k < self.count_at_depth(d, nt), "*** Index %s out of range at depth %s" % (k, d)
+        return self.get_enumeration_table().unrank(nt, d, k)
+
+    def rank(self, t):
+        """ Return (d, k) where t is the k'th tree that enumerate_at_depth(d, t.returntype) yields, so that
+        unrank(t.returntype, d, k) == t. """
+        return self.get_enumeration_table().rank(t)
+
+    def sample_at_depth(self, d, nt=None):
+        """ Sample uniformly from the trees at exactly depth d """
+        if nt is None:
+            nt = self.start
+        return self.get_enumeration_table().sample(nt, d)
+
+    def get_statistics(self):
+        """ The GrammarStatistics (min depth, expected size and its variance, and termination probability of
+        every nonterminal and rule) for this grammar, rebuilt if the grammar has changed """
+        if self._statistics is None or self._statistics.version != self.version:
+            self._statistics = GrammarStatistics(self)
+        return self._statistics
+
     def depth_to_terminal(self, x, openset=None, current_d=None):
         """
         Return a dictionary that maps both this grammar's rules and its nonterminals to a number,
@@ -350,6 +708,178 @@ class Grammar(CommonEqualityMixin):
             for r in self.get_rules(nt):
                 r.p = r.p / z
 
+        self.mark_changed()
+
+    # --------------------------------------------------------------------------------------------------------
+    # Scoring many trees at once
+    # A PCFG prior is just a dot product between how often each rule is used and each rule's log
+    # probability, so we can score lots of trees with one sparse matrix-vector product.
+    # --------------------------------------------------------------------------------------------------------
+
+    def log_rule_probabilities(self):
+        """
+        A numpy vector of each rule's log probability (normalized within its nonterminal), in the order
+        of sig2idx.
+        """
+        lps = []
+        for nt in self.nonterminals():
+            idx = self.get_rule_index(nt)
+            lps.extend([idx.log_probability(i) for i in range(len(idx))])
+        return np.array(lps, dtype=float)
+
+    def rule_count_matrix(self, trees, sig2idx=None):
+        """
+        Count how often each tree uses each rule.
+
+        Returns (M, fallback) where M has one row per tree and one column per rule (indexed by sig2idx),
+        and fallback is a list of the rows that could not be counted. M is a scipy.sparse csr_matrix if
+        scipy is installed, and a dense numpy array otherwise.
+
+        Note:
+            Trees with bound variables go in fallback (and get a row of zeros) because the rules a bound
+            variable adds change the normalizing constant for its nonterminal below the lambda, so their
+            probability is not a function of rule counts alone. Use log_probability for those.
+        """
+        offsets = None # if we use the packing index, we can use rule positions instead of matching signatures
+        if sig2idx is None:
+            sig2idx, offsets = self.get_packing_index()[0], self.get_packing_offsets()
+        key = self.rule_key()
+        rows, cols, fallback = [], [], []
+        for i, t in enumerate(trees):
+            if isinstance(t, ArrayTree): # its rules are already the indices from sig2idx()
+                if t.has_bound_variables():
+                    fallback.append(i)
+                else:
+                    rows.extend([i]*len(t))
+                    cols.extend(t.rule.tolist())
+                continue
+
+            tcols = []
+            for x in t:
+                if isinstance(x, (BVAddFunctionNode, BVUseFunctionNode)):
+                    fallback.append(i)
+                    break
+
+                if offsets is not None:
+                    j = x.rule_id if x.rule_key == key else self.rule_position(x)
+                    assert j is not None, "*** No rule matching %s in %s" % (str(x.get_rule_signature()), t)
+                    tcols.append(offsets[x.returntype] + j)
+                else:
+                    sig = x.get_rule_signature()
+                    assert sig in sig2idx, "*** No rule matching %s in %s" % (str(sig), t)
+                    tcols.append(sig2idx[sig])
+            else:
+                rows.extend([i]*len(tcols))
+                cols.extend(tcols)
+
+        shape = (len(trees), len(sig2idx))
+        if sparse is not None:
+            M = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=shape) # duplicates are summed
+        else:
+            M = np.zeros(shape)
+            np.add.at(M, (rows, cols), 1.0)
+
+        return M, fallback
+
+    def log_probabilities(self, trees):
+        """
+        Return a numpy array of the log probability of each tree in trees. This gives the same values as
+        calling log_probability on each, but scores every tree without bound variables in a single
+        matrix-vector product (see rule_count_matrix). Trees with bound variables fall back to log_probability.
+        """
+        trees = list(trees)
+        M, fallback = self.rule_count_matrix(trees)
+
+        lps = np.asarray(M.dot(self.log_rule_probabilities()), dtype=float).ravel()
+        for i in fallback:
+            lps[i] = self.log_probability(trees[i])
+
+        return lps
+
+    # --------------------------------------------------------------------------------------------------------
+    # Fingerprints and saving
+    # A grammar's fingerprint depends only on its content, so it is the same across processes and runs
+    # and can be used as the key for anything computed from the grammar (compiled functions, likelihoods,
+    # packed trees).
+    # --------------------------------------------------------------------------------------------------------
+
+    def dump_rules(self):
+        """
+        Return a tuple of python primitives that describes this grammar's content: start, BV_P, and each
+        rule (in order) as (nt, name, to, p, bv_type, bv_args, bv_prefix, bv_p), where bv_type is None for
+        ordinary rules. Bound variable rules that are currently pushed are not included.
+        """
+        rules = []
+        for nt in self.nonterminals():
+            for r in self.get_rules(nt):
+                if isinstance(r, BVAddGrammarRule):
+                    rules.append((r.nt, r.name, _tuple(r.to), r.p, r.bv_type, _tuple(r.bv_args), r.bv_prefix,
+                                  None if r.bv_p is None else float(r.bv_p)))
+                elif not isinstance(r, BVUseGrammarRule):
+                    rules.append((r.nt, r.name, _tuple(r.to), r.p, None, None, None, None))
+        return (self.start, float(self.BV_P), tuple(rules))
+
+    def fingerprint(self):
+        """
+        A hex string hash of dump_rules(), which is stable across processes. It is cached for each version,
+        so if you change a rule by hand, call mark_changed().
+        """
+        if self._fingerprint is None or self._fingerprint[0] != self.version:
+            self._fingerprint = (self.version, hashlib.sha256(repr(self.dump_rules()).encode('utf-8')).hexdigest())
+        return self._fingerprint[1]
+
+    def packing_fingerprint(self):
+        """
+        A hex string that is the same for grammars that pack trees the same way (see pack): a hash of each rule's
+        signature and bound variables, in order. Unlike fingerprint, this ignores rule probabilities. It is
+        cached, like get_packing_index, until the grammar (or the bound variables in scope) change.
+        """
+        key = self.context_key()
+        if self._packing_fingerprint is None or self._packing_fingerprint[0] != key:
+            idx2rule = self.get_packing_index()[1]
+            rules = [(r.get_rule_signature(), getattr(r, 'bv_type', None), getattr(r, 'bv_args', None),
+                      getattr(r, 'bv_prefix', None)) for _, r in sorted(idx2rule.items())]
+            self._packing_fingerprint = (key, hashlib.sha256(repr(rules).encode('utf-8')).hexdigest())
+        return self._packing_fingerprint[1]
+
+    @classmethod
+    def load_rules(cls, dump):
+        """ Make a grammar from dump_rules(), building the rules and their indices directly rather than via add_rule """
+        start, BV_P, rules = dump
+        g = cls(BV_P=BV_P, start=start)
+        for nt, name, to, p, bv_type, bv_args, bv_prefix, bv_p in rules:
+            to = None if to is None else list(to)
+            if bv_type is not None:
+                bv_args = None if bv_args is None else list(bv_args)
+                g.rules[nt].append(BVAddGrammarRule(nt, name, to, p=p, bv_type=bv_type, bv_args=bv_args, bv_prefix=bv_prefix, bv_p=bv_p))
+            else:
+                g.rules[nt].append(GrammarRule(nt, name, to, p=p))
+        g.rule_count = len(rules)
+        g.mark_changed()
+        for nt in g.nonterminals():
+            g.get_rule_index(nt)
+        return g
+
+    def dumps(self):
+        """ Serialize this grammar's content (see dump_rules) to bytes, along with its fingerprint """
+        return pickle.dumps((self.fingerprint(), self.dump_rules()), protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def loads(cls, b):
+        """ Make a grammar from dumps(), checking that it has the same fingerprint """
+        fp, dump = pickle.loads(b)
+        g = cls.load_rules(dump)
+        assert g.fingerprint() == fp, "*** Grammar fingerprint does not match its saved value"
+        return g
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.dumps())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls.loads(f.read())
 
     # --------------------------------------------------------------------------------------------------------
     # Packing and unpacking trees
@@ -357,36 +887,138 @@ class Grammar(CommonEqualityMixin):
     # pickling hypotheses
     # --------------------------------------------------------------------------------------------------------
 
+    def get_packing_index(self):
+        """
+        Return (sig2idx, idx2rule) for the current rules, which map each rule's signature to a unique index
+        and back. These are cached until the grammar (or the bound variables in scope) change, and must
+        not be modified -- use sig2idx() and idx2rule() for copies.
+        """
+        key = self.context_key()
+        if self._packing is None or self._packing[0] != key:
+            sig2idx, idx2rule, offsets = dict(), dict(), dict()
+            idx = 0 # store the rule index, making each unique. NOTE: we could make it unique for each nt, but that may mess with LZPrior
+            for nt in self.nonterminals():
+                offsets[nt] = idx
+                for r in self.get_rules(nt):
+                    sig2idx[r.get_rule_signature()] = idx
+                    idx2rule[idx] = r
+                    idx += 1
+            self._packing = (key, sig2idx, idx2rule, offsets)
+        return self._packing[1], self._packing[2]
+
+    def get_packing_offsets(self):
+        """
+        A dict from each nonterminal to the index (from get_packing_index) of its first rule, so that the index
+        of a node's rule is offsets[x.returntype] + rule_position(x), unless x is a BVUseFunctionNode.
+        """
+        self.get_packing_index()
+        return self._packing[3]
+
     def sig2idx(self):
         """
         Compute a dictionary from signatures to rule indices
         this is so that when we add rules for bound variables, we don't
         change all the rule indices.
-        NOTE: This step is slow and should be cached for a grammar
         """
-        d = dict()
-        idx = 0 # store the rule index, making each unique. NOTE: we could make it unique for each nt, but that may mess with LZPrior
-
-        for nt in self.nonterminals():
-            for r in self.get_rules(nt):
-                d[r.get_rule_signature()] = idx
-                idx += 1
-
-        return d
+        return dict(self.get_packing_index()[0])
 
     def idx2rule(self):
         """
         Compute a dictionary from idx to rules that matches sig2idx
         """
-        d = dict()
-        idx = 0 # store the rule index, making each unique. NOTE: we could make it unique for each nt, but that may mess with LZPrior
+        return dict(self.get_packing_index()[1])
 
-        for nt in self.nonterminals():
-            for r in self.get_rules(nt):
-                d[idx] = r
-                idx += 1
+    def pack(self, t):
+        """
+        Pack a tree into bytes. Each node is written in prefix order as the varint (LEB128) of its rule
+        index from get_packing_index; a bound variable is written as len(sig2idx) plus the depth of the
+        lambda that introduced it, counting from the outermost lambda at 0. Unlike pack_ascii, this works
+        for any number of rules, and since the packing of a tree ends where the tree does, packings
+        can simply be concatenated (see pack_many).
+        """
+        out = bytearray()
+        self._pack_into(t, out, self.get_packing_index()[0])
+        return bytes(out)
+
+    def pack_many(self, trees):
+        """ Pack a sequence of trees into a single bytes, which unpack_many reads back """
+        out = bytearray()
+        sig2idx = self.get_packing_index()[0]
+        for t in trees:
+            self._pack_into(t, out, sig2idx)
+        return bytes(out)
+
+    def _pack_into(self, t, out, sig2idx):
+        R = len(sig2idx)
+        offsets = self.get_packing_offsets()
+        scope = dict() # the signatures of bound variables currently in scope -> their index
+        stack = [t]    # nodes left to write, and the added rules to remove from scope once we're past them
+        while stack:
+            x = stack.pop()
+            if not isFunctionNode(x): # we're done with the lambda that added x
+                del scope[x.get_rule_signature()]
+                continue
+
+            if isinstance(x, BVUseFunctionNode):
+                sig = x.get_rule_signature()
+                i = scope[sig] if sig in scope else sig2idx[sig]
+            else:
+                i = offsets[x.returntype] + self.rule_position(x)
+            while i >= 0x80:
+                out.append((i & 0x7F) | 0x80)
+                i >>= 7
+            out.append(i)
+
+            if x.added_rule is not None:
+                stack.append(x.added_rule)
+                scope[x.added_rule.get_rule_signature()] = R + len(scope)
+            if x.args is not None:
+                stack.extend(a for a in reversed(x.args) if isFunctionNode(a))
+
+    def unpack(self, b, nt=None):
+        """ Unpack bytes from pack into a tree from nt (default: self.start) """
+        t, pos = self._unpack_from(b, 0, nt)
+        assert pos == len(b), "*** Extra bytes after packed tree"
+        return t
+
+    def unpack_many(self, b, nt=None):
+        """ Unpack everything in bytes from pack_many, returning a list of trees """
+        out, pos = [], 0
+        while pos < len(b):
+            t, pos = self._unpack_from(b, pos, nt)
+            out.append(t)
+        return out
+
+    def _unpack_from(self, b, pos, nt):
+        """ Read one tree from b starting at pos, returning the tree and the position after it """
+        if nt is None:
+            nt = self.start
+        idx2rule = self.get_packing_index()[1]
+        offsets = self.get_packing_offsets()
+        R = len(idx2rule)
+        base = len(self.current_bv_rules()) # bound variables pushed while we unpack start here
+        at = [pos]
+
+        def make_stub(x, parent):
+            p, i, shift = at[0], 0, 0
+            while True:
+                c = b[p]
+                p += 1
+                i |= (c & 0x7F) << shift
+                shift += 7
+                if c < 0x80:
+                    break
+            at[0] = p
+
+            r = idx2rule[i] if i < R else self.current_bv_rules()[base + i - R]
+            assert r.nt == x, "*** Packed rule %s does not expand %s" % (r, x)
+            fn = r.make_FunctionNodeStub(self, parent)
+            if i < R:
+                self.annotate(fn, i - offsets[x])
+            return fn
 
-        return d
+        t = self._expand(nt, make_stub)
+        return t, at[0]
 
     def pack_ascii(self, t, sig2idx=None):
         """
@@ -397,7 +1029,6 @@ class Grammar(CommonEqualityMixin):
         if sig2idx is None:
             sig2idx = self.sig2idx()
 
-
         # the output string (starts empty)
         s = ''
 
@@ -408,8 +1039,7 @@ class Grammar(CommonEqualityMixin):
         # add rule if we're adding a bound variable (i.e. a lambda)
         if isinstance(t, BVAddFunctionNode):
             r = t.added_rule
-            idx =  max(sig2idx.values())+1
-            sig2idx[r.get_rule_signature()] = idx
+            sig2idx[r.get_rule_signature()] = len(sig2idx) # indices are always 0...n-1
 
         # recurse
         for a in t.argFunctionNodes():
@@ -455,8 +1085,7 @@ class Grammar(CommonEqualityMixin):
 
                 # add rule (to idx2rule)
                 if isinstance(r, BVAddGrammarRule):
-                    idx = max(idx2rule.keys()) + 1
-                    idx2rule[idx] = fn.added_rule
+                    idx2rule[len(idx2rule)] = fn.added_rule # indices are always 0...n-1
 
                 # recurse
                 if fn.args is not None:
@@ -464,8 +1093,7 @@ class Grammar(CommonEqualityMixin):
 
                 # remove rule (as we now do in packing, too)
                 if isinstance(r, BVAddGrammarRule):
-                    idx = max(idx2rule.keys())
-                    del idx2rule[idx]
+                    del idx2rule[len(idx2rule)-1]
             
                 for a in fn.argFunctionNodes():
                     a.parent = fn
@@ -479,3 +1107,7 @@ class Grammar(CommonEqualityMixin):
     #    """a quick test for packing and unpacking"""
     #    one_test = lambda x: x == self.unpack_ascii(self.pack_ascii(x))
     #    return all([one_test(self.generate()) for _ in xrange(n)])
+
+
+def _tuple(x):
+    return None if x is None else tuple(x)
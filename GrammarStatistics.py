@@ -0,0 +1,128 @@
+"""
+        Whole-grammar statistics, computed at once for every nonterminal and rule.
+
+        Treating the grammar as a multi-type branching process, each nonterminal A expands to rule r with
+        probability q_r, and r has c_r[B] children of each nonterminal B. The mean matrix M[A,B] = sum_r q_r c_r[B]
+        then gives everything by solving linear systems or iterating to a fixed point:
+
+            expected size         s = 1 + M s
+            variance of size      v = w + M v,  where w_A = sum_r q_r s_r^2 - s_A^2
+            termination prob.     t_A = sum_r q_r prod_B t_B^c_r[B]   (the smallest fixed point, from t=0)
+            min depth             d_A = min_r 1 + max_B d_B           (as in Grammar.depth_to_terminal)
+
+        The expected size is finite only if the spectral radius of M is below 1. If it is not, the expected
+        size and variance are inf, and the termination probability may be below 1 (the grammar can generate
+        infinite trees).
+
+        Sizes count FunctionNodes, as FunctionNode.count_nodes does.
+
+"""
+import numpy as np
+
+from LOTlib3.GrammarRule import BVAddGrammarRule, BVUseGrammarRule
+from LOTlib3.Miscellaneous import Infinity
+
+
+class GrammarStatistics(object):
+    """
+    Statistics about a single version of a grammar. This is built and cached by Grammar.get_statistics.
+
+    Attributes
+    ----------
+    min_depth, expected_size, size_variance, termination_probability : dict
+        Maps each nonterminal, and each rule's signature, to its value.
+    spectral_radius : float
+        The spectral radius of the mean matrix. The expected size is finite iff this is less than 1.
+
+    Note
+    ----
+    Bound variables are treated as though one of each bv_type is always in scope, expanding to bv_args with
+    probability proportional to the rule's bv_p (or the grammar's BV_P). This is exact for grammars where a
+    bound variable's type is only used below the lambda that introduces it, with one such lambda in scope.
+
+    """
+    def __init__(self, grammar, tolerance=1e-12, max_iterations=100000):
+        self.version = grammar.version
+
+        # each rule as (nt, p, signature, to); bound variables get one rule for each rule that introduces them
+        rules = []
+        for nt in grammar.nonterminals():
+            for r in grammar.get_rules(nt):
+                if isinstance(r, BVUseGrammarRule):
+                    continue # pushed bound variables are handled below
+                rules.append((r.nt, r.p, r.get_rule_signature(), r.to))
+                if isinstance(r, BVAddGrammarRule):
+                    bv_p = r.bv_p if r.bv_p is not None else grammar.BV_P
+                    rules.append((r.bv_type, bv_p, None, r.bv_args))
+
+        self.nonterminals = []
+        for nt, _, _, _ in rules:
+            if nt not in self.nonterminals:
+                self.nonterminals.append(nt)
+        ntidx = {nt: i for i, nt in enumerate(self.nonterminals)}
+        N, R = len(self.nonterminals), len(rules)
+
+        # Q[A,r] is the probability that A expands to r; C[r,B] counts r's children of type B
+        Q = np.zeros((N, R))
+        C = np.zeros((R, N))
+        has_args = np.zeros(R, dtype=bool)
+        for j, (nt, p, _, to) in enumerate(rules):
+            Q[ntidx[nt], j] = p
+            has_args[j] = to is not None and len(to) > 0
+            for a in (to or []):
+                if a in ntidx:
+                    C[j, ntidx[a]] += 1
+        Q = Q / Q.sum(axis=1, keepdims=True)
+        M = Q.dot(C)
+
+        self.spectral_radius = float(max(abs(np.linalg.eigvals(M)))) if N > 0 else 0.0
+
+        # min depth: Bellman-Ford style, which converges in at most N rounds
+        occurs = C > 0
+        d = np.full(N, Infinity)
+        for _ in range(N+1):
+            rule_d = np.where(has_args, 1 + np.where(occurs, d[np.newaxis, :], 0).max(axis=1, initial=0), 0)
+            new_d = np.where(Q > 0, rule_d[np.newaxis, :], Infinity).min(axis=1)
+            if np.array_equal(new_d, d):
+                break
+            d = new_d
+        rule_d = np.where(has_args, 1 + np.where(occurs, d[np.newaxis, :], 0).max(axis=1, initial=0), 0)
+
+        # expected size and variance
+        if self.spectral_radius < 1.0:
+            I = np.eye(N)
+            s = np.linalg.solve(I - M, np.ones(N))
+            rule_s = 1 + C.dot(s)
+            v = np.linalg.solve(I - M, Q.dot(rule_s**2) - s**2)
+            rule_v = C.dot(v)
+        else:
+            s, v = np.full(N, Infinity), np.full(N, Infinity)
+            rule_s, rule_v = np.where(C.sum(axis=1) > 0, Infinity, 1.0), np.where(C.sum(axis=1) > 0, Infinity, 0.0)
+
+        # termination probability: iterate up from 0 to the smallest fixed point
+        t = np.zeros(N)
+        for _ in range(max_iterations):
+            rule_t = (t[np.newaxis, :] ** C).prod(axis=1)
+            new_t = Q.dot(rule_t)
+            if np.max(np.abs(new_t - t), initial=0.0) < tolerance:
+                t = new_t
+                break
+            t = new_t
+        rule_t = (t[np.newaxis, :] ** C).prod(axis=1)
+
+        self.min_depth, self.expected_size, self.size_variance, self.termination_probability = dict(), dict(), dict(), dict()
+        for nt, i in ntidx.items():
+            self.min_depth[nt] = float(d[i])
+            self.expected_size[nt] = float(s[i])
+            self.size_variance[nt] = float(v[i])
+            self.termination_probability[nt] = float(t[i])
+        for j, (_, _, sig, _) in enumerate(rules):
+            if sig is not None:
+                self.min_depth[sig] = float(rule_d[j])
+                self.expected_size[sig] = float(rule_s[j])
+                self.size_variance[sig] = float(rule_v[j])
+                self.termination_probability[sig] = float(rule_t[j])
+
+    def is_finite(self):
+        """ Is the expected size of a tree finite? """
+        return self.spectral_radius < 1.0
@@ -1,11 +1,12 @@
 """
         A special type of hypothesis whose value is a function.
-        The function is automatically eval-ed when we set_value, and is automatically hidden and unhidden when we pickle
+        The function is automatically eval-ed when we set_value (or, if lazy, the first time we are called), and is
+        automatically hidden when we pickle and recompiled when next called
         This can also be called like a function, as in fh(data)!
 """
 
 from .Hypothesis import Hypothesis
-from copy import copy
+from copy import copy, deepcopy
 
 class FunctionHypothesis(Hypothesis):
     """
@@ -14,6 +15,10 @@ class FunctionHypothesis(Hypothesis):
             This can also be called like a function, as in fh(data)!
     """
 
+    lazy = False # if True, don't compile in set_value, but when we are first called (see __init__)
+    copy_without_init = False # if True, __copy__ skips __init__ and may share our function (see __copy__)
+    likelihood_parameters = () # see Hypothesis
+
     def __init__(self, value=None, f=None, display="lambda x: %s", **kwargs):
         """
                 *value* - the value of this hypothesis
@@ -21,6 +26,10 @@ class FunctionHypothesis(Hypothesis):
                 *f* - defaultly None, in which case this uses self.value2function
 
                 *args* - the arguments to the function
+
+                *lazy* - if True, compile the function the first time we are called instead of in set_value.
+                    This saves compiling hypotheses that are never called, like MH proposals that are rejected
+                    from their prior alone.
         """
         # this initializes prior and likleihood variables, so keep it here!
         # However, don't give it value, since then it calls set_value with no f argument!
@@ -35,6 +44,9 @@ class FunctionHypothesis(Hypothesis):
         #assert not any([isinstance(x, FunctionData) for x in vals]), "*** Probably you mean to pass FunctionData.input instead of FunctionData?"
         #assert callable(self.fvalue)
 
+        if self.fvalue is None: # not compiled yet (if lazy, or unpickled)
+            self.fvalue = self.compile_function()
+
         return self.fvalue(*vals)
 
 
@@ -57,11 +69,29 @@ class FunctionHypothesis(Hypothesis):
 
         if f is not None:
             self.fvalue = f
-        elif value is None:
-            self.fvalue = None
+        elif value is None or self.lazy:
+            self.fvalue = None # if lazy, __call__ compiles it
         else:
             self.fvalue =  self.compile_function() # now that the value is set
 
+    def __copy__(self, value=None):
+        """Returns a copy, as in Hypothesis.__copy__. Classes that set copy_without_init don't call __init__
+        (which for LOTHypotheses makes and compiles a value, only for it to be replaced), and if the value is
+        unchanged and we have compiled our function, the copy shares it. So only set it if __init__ does nothing
+        but set attributes, and compile_function depends only on the value (and attributes copies share)."""
+        if not self.copy_without_init:
+            return Hypothesis.__copy__(self, value=value)
+
+        thecopy = type(self).__new__(type(self))
+        thecopy.__dict__.update(self.__dict__)
+
+        if value is None or value is self.value:
+            thecopy.set_value(deepcopy(self.value) if value is None else value, f=self.fvalue)
+        else:
+            thecopy.set_value(value)
+
+        return thecopy
+
     def force_function(self, f):
         """
         Sets the function to f, ignoring value.
@@ -88,7 +118,6 @@ class FunctionHypothesis(Hypothesis):
 
     def __setstate__(self, state):
         """
-                sets the state of the hypothesis (when we unpickle)
+                sets the state of the hypothesis (when we unpickle). The function is compiled when we are next called
         """
         self.__dict__.update(state)
-        self.set_value(self.value) # just re-set the value so that we re-compute the function
@@ -18,7 +18,17 @@ class Hypothesis(object):
         prior_temperature: Temperature used when running compute_prior.
         likelihood_temperature: Temperature used when running compute_likelihood.
 
+    Attributes:
+        prior_parameters, likelihood_parameters: The names of the attributes that this class's compute_prior
+          (and compute_posterior) and compute_likelihood (and compute_single_likelihood, __call__ and
+          compile_function) depend on. Score caches use these to tell hypotheses apart, and don't cache
+          classes whose methods don't declare them, so subclasses that override these methods should declare
+          their own (see LOTlib3.PosteriorCache.declared_parameters).
+
     """
+    prior_parameters = ()
+    likelihood_parameters = ('likelihood_temperature',)
+
     def __init__(self, value=None, prior_temperature=1.0, likelihood_temperature=1.0, display="%s", **kwargs):
         """
         :param value:  - the value of teh hypothesis
@@ -1,7 +1,9 @@
+from LOTlib3.ArrayTree import ArrayTree
 from LOTlib3.Eval import * # Necessary for compile_function eval below
+from LOTlib3.FunctionCache import FUNCTION_CACHE
 from LOTlib3.Hypotheses.FunctionHypothesis import FunctionHypothesis
 from LOTlib3.Hypotheses.Proposers import ProposalFailedException
-from LOTlib3.Miscellaneous import self_update
+from LOTlib3.Miscellaneous import self_update, attrmem, Infinity
 from LOTlib3.Primitives import *
 from .Priors.PCFGPrior import PCFGPrior
 from .Proposers import regeneration_proposal
@@ -14,7 +16,7 @@ class LOTHypothesis(PCFGPrior, FunctionHypothesis):
     grammar : LOTlib3.Grammar
         The grammar for the hypothesis.
     value : FunctionNode
-        The value for the hypothesis.
+        The value for the hypothesis. This may also be an ArrayTree, which takes much less memory.
     maxnodes : int
         The maximum amount of nodes that the grammar can have
     args : list
@@ -22,12 +24,31 @@ class LOTHypothesis(PCFGPrior, FunctionHypothesis):
 
     Attributes
     ----------
+    function_cache : LOTlib3.FunctionCache.FunctionCache
+        Where compile_function keeps the functions it compiles (see function_key), shared by all hypotheses that
+        use it. By default this is every LOTHypothesis in the process; give one model its own cache (and size) by
+        setting this in a subclass or passing function_cache=FunctionCache(...) to __init__. Set it to None to
+        always eval.
+    copy_without_init : bool
+        True, so that copies (e.g. proposals) don't generate and compile a value in __init__ only to replace it,
+        and share the function if the value is unchanged (see FunctionHypothesis.__copy__). Set this to False in
+        subclasses whose __init__ does more than set attributes, or whose compile_function depends on more than
+        the value and display.
+    likelihood_cache : LOTlib3.LikelihoodCache.LikelihoodCache
+        If not None, compute_likelihood looks up likelihoods in this file-backed cache, shared across runs and
+        processes, and stores the ones it computes (for classes that declare likelihood_parameters, see
+        Hypothesis). Close it at the end of a run, to write what it has not written yet. Default None.
     grammar_vector : np.ndarray
         This is a vector of
     prior_vector : np.ndarray
 
     """
 
+    function_cache = FUNCTION_CACHE
+    copy_without_init = True
+    likelihood_parameters = ('maxnodes',) # since bigger trees raise TooBigException (see Hypothesis)
+    likelihood_cache = None
+
     def __init__(self, grammar=None, value=None, f=None, maxnodes=25, **kwargs):
 
         if 'args' in kwargs:
@@ -36,7 +57,7 @@ class LOTHypothesis(PCFGPrior, FunctionHypothesis):
         # Save all of our keywords
         self_update(self, locals())
         if value is None and grammar is not None:
-            value = grammar.generate()
+            value = grammar.generate_bounded(maxnodes) if maxnodes is not None and maxnodes < Infinity else grammar.generate()
 
         FunctionHypothesis.__init__(self, value=value, f=f, **kwargs)
 
@@ -63,24 +84,58 @@ class LOTHypothesis(PCFGPrior, FunctionHypothesis):
             return lambda *args: raise_exception(TooBigException)
         else:
             try:
-                return eval(str(self)) # evaluate_expression(str(self))
+                if self.function_cache is None:
+                    return self.make_function()
+                else:
+                    return self.function_cache.get(self.function_key(), lambda k: self.make_function())
             except Exception as e:
                 print("# Warning: failed to execute evaluate_expression on [" + str(self)+"]")
                 print("# ", e)
                 return lambda *args: raise_exception(EvaluationException)
 
+    def function_key(self):
+        """What our function depends on, which is exactly the source that make_function compiles, str(self)."""
+        return str(self)
+
+    def make_function(self):
+        """The function for our value: eval(str(self)), here where the primitives are in scope."""
+        return eval(str(self)) # evaluate_expression(str(self))
+
+    @attrmem('likelihood')
+    def compute_likelihood(self, data, shortcut=-Infinity, **kwargs):
+        """As in Hypothesis.compute_likelihood, but using likelihood_cache if we have one."""
+        key = None
+        if self.likelihood_cache is not None and not kwargs:
+            key = self.likelihood_cache.key(self, data)
+            if key is not None:
+                ll = self.likelihood_cache.get(key)
+                if ll is not None:
+                    return ll
+
+        ll = FunctionHypothesis.compute_likelihood(self, data, shortcut=shortcut, **kwargs)
+
+        if key is not None and (shortcut == -Infinity or ll > -Infinity): # a shortcut -inf is only a bound
+            self.likelihood_cache.put(key, ll)
+        return ll
+
     def compute_single_likelihood(self, datum):
         raise NotImplementedError
 
     def propose(self, **kwargs):
+        # proposals work on FunctionNodes, so an ArrayTree value is converted and the proposal converted back
+        value = self.value.to_tree() if isinstance(self.value, ArrayTree) else self.value
+
         ret_value, fb = None, None
         while True: # keep trying to propose
             try:
-                ret_value, fb = regeneration_proposal(self.grammar, self.value, **kwargs)
+                ret_value, fb = regeneration_proposal(self.grammar, value, maxnodes=self.maxnodes, **kwargs)
                 break
             except ProposalFailedException:
                 pass
 
+        if isinstance(self.value, ArrayTree):
+            ret_value = ArrayTree.from_tree(self.grammar, ret_value)
+
         ret = self.__copy__(value=ret_value)
 
         return ret, fb
@@ -5,6 +5,8 @@ from LOTlib3.Miscellaneous import Infinity
 
 class BinaryLikelihood(object):
 
+    likelihood_parameters = () # alpha is on the data (see Hypothesis)
+
     def compute_single_likelihood(self, datum):
         try:
             return log(datum.alpha * (self(*datum.input) == datum.output) + (1.0-datum.alpha) / 2.0)
@@ -4,6 +4,8 @@ from math import isnan
 
 class GaussianLikelihood(object):
 
+    likelihood_parameters = () # ll_sd is on the data (see Hypothesis)
+
     def compute_single_likelihood(self, datum):
         """ Compute the likelihood with a Gaussian. Wraps to avoid nan"""
 
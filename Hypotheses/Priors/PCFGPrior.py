@@ -5,6 +5,8 @@ from LOTlib3.Miscellaneous import attrmem, Infinity
 
 class PCFGPrior(object):
 
+    prior_parameters = ('maxnodes', 'prior_temperature') # see Hypothesis
+
     @attrmem('prior')
     def compute_prior(self):
         """Compute the log of the prior probability.
@@ -18,3 +20,29 @@ class PCFGPrior(object):
 
             # Compute the grammar's probability
             return self.grammar.log_probability(self.value) / self.prior_temperature
+
+
+def compute_priors(hypotheses):
+    """Compute and store the PCFG prior for a list of hypotheses, using Grammar.log_probabilities to score all
+    of their values at once (e.g. to rescore a big TopN after changing rule probabilities). This matches
+    PCFGPrior.compute_prior, including maxnodes and prior_temperature, so it should not be used for
+    hypotheses that override compute_prior. Returns the list of priors.
+    """
+    hypotheses = list(hypotheses)
+    if len(hypotheses) == 0:
+        return []
+
+    grammar = hypotheses[0].grammar
+    assert all(h.grammar is grammar for h in hypotheses), "*** compute_priors requires a single grammar"
+
+    lps = grammar.log_probabilities([h.value for h in hypotheses])
+
+    priors = []
+    for h, lp in zip(hypotheses, lps):
+        if h.value.count_subnodes() > getattr(h, 'maxnodes', Infinity):
+            h.prior = -Infinity
+        else:
+            h.prior = lp / h.prior_temperature
+        priors.append(h.prior)
+
+    return priors
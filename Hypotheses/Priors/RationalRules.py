@@ -14,18 +14,18 @@ def get_rule_counts(grammar, t):
                     it is simple!
     """
 
-    counts = defaultdict(int) # a count for each hash type
+    counts = defaultdict(int) # a count for each (nt, position of the rule in grammar.rules[nt])
 
     for x in t:
         if type(x) != FunctionNode:
             raise NotImplementedError("Rational rules not implemented for bound variables")
         
-        counts[x.get_rule_signature()] += 1
+        counts[(x.returntype, grammar.rule_position(x))] += 1
 
     # and convert into a list of vectors (with the right zero counts)
     out = []
     for nt in list(grammar.rules.keys()):
-        v = numpy.array([ counts.get(r.get_rule_signature(),0) for r in grammar.rules[nt] ])
+        v = numpy.array([ counts.get((nt, i),0) for i in range(len(grammar.rules[nt])) ])
         out.append(v)
     return out
 
@@ -55,6 +55,8 @@ class RationaRulesPrior(object):
 
     """
 
+    prior_parameters = ('maxnodes', 'prior_temperature', 'rrAlpha') # see Hypothesis
+
     @attrmem('prior')
     def compute_prior(self):
         """
@@ -17,19 +17,19 @@ class Proposer(object):
         ret = self.__copy__(value=ret_value)
         return ret, fb
 
-    def proposal_content(self, grammar, tree, resampleProbability=lambdaOne):
-        t = self.propose_tree(grammar,tree,resampleProbability)
-        fb = self.compute_fb(grammar,tree,t,resampleProbability)
+    def proposal_content(self, grammar, tree, resampleProbability=lambdaOne, **kwargs):
+        t = self.propose_tree(grammar,tree,resampleProbability,**kwargs)
+        fb = self.compute_fb(grammar,tree,t,resampleProbability,**kwargs)
         return t,fb
 
-    def compute_fb(self, grammar, t1, t2, resampleProbability=lambdaOne):
-        return (self.compute_proposal_probability(grammar,t1,t2,resampleProbability) -
-                self.compute_proposal_probability(grammar,t2,t1,resampleProbability))
+    def compute_fb(self, grammar, t1, t2, resampleProbability=lambdaOne, **kwargs):
+        return (self.compute_proposal_probability(grammar,t1,t2,resampleProbability,**kwargs) -
+                self.compute_proposal_probability(grammar,t2,t1,resampleProbability,**kwargs))
 
-    def propose_tree(self, grammar,tree,resampleProbability=lambdaOne):
+    def propose_tree(self, grammar,tree,resampleProbability=lambdaOne, **kwargs):
         raise NotImplementedError
 
-    def compute_proposal_probability(self, grammar, t1, t2, resampleProbability=lambdaOne, recurse=True):
+    def compute_proposal_probability(self, grammar, t1, t2, resampleProbability=lambdaOne, recurse=True, **kwargs):
         raise NotImplementedError
 
 
@@ -1,57 +1,112 @@
 """
     Regeneration Proposer - choose a node of type X and replace it with
     a newly sampled value of type X.
+
+    If maxnodes is given (and the tree is not already too big), the new value is sampled with
+    Grammar.generate_bounded so that the proposal never has more than maxnodes nodes. Since the rest of
+    the tree is the same in both directions, so is the bound, and the proposal probability just divides
+    by the probability of fitting within it.
 """
 
-from LOTlib3.BVRuleContextManager import BVRuleContextManager
+from LOTlib3.BVRuleContextManager import BVPathContextManager
 from LOTlib3.FunctionNode import NodeSamplingException
 from LOTlib3.Hypotheses.Proposers.Proposer import *
-from LOTlib3.Miscellaneous import lambdaOne, logsumexp
-from LOTlib3.Subtrees import least_common_difference
-from copy import copy
+from LOTlib3.Miscellaneous import lambdaOne, logsumexp, Infinity
+from LOTlib3.Subtrees import least_common_difference_path
 from math import log
 
 class RegenerationProposer(Proposer):
 
-    def propose_tree(self, grammar, t, resampleProbability=lambdaOne):
-        """Propose, returning the new tree"""
-        new_t = copy(t)
-    
+    def propose_tree(self, grammar, t, resampleProbability=lambdaOne, maxnodes=None):
+        """Propose, returning the new tree. Only the nodes above the one we regenerate are copied, and the
+        rest is shared with t (see FunctionNode.replace_subnode), so t is never changed."""
         try: # to sample a subnode
-            n, lp = new_t.sample_subnode(resampleProbability=resampleProbability)
+            path, lp = t.sample_subnode_path(resampleProbability=resampleProbability)
         except NodeSamplingException: # when no nodes can be sampled
             raise ProposalFailedException
-    
+        n = path[-1]
+
+        size = t.count_nodes() if is_bounded(maxnodes) else None
+
         # In the context of the parent, resample n according to the
-        # grammar. recurse_up in order to add all the parent's rules
-        with BVRuleContextManager(grammar, n.parent, recurse_up=True):
-            n.setto(grammar.generate(n.returntype))
-        return new_t
+        # grammar, adding all the rules above it
+        with BVPathContextManager(grammar, path[:-1]):
+            if size is not None and size <= maxnodes:
+                new = grammar.generate_bounded(maxnodes - size + n.count_nodes(), n.returntype)
+            else:
+                new = grammar.generate(n.returntype)
+        return t.replace_subnode(path, new)
     
-    def compute_proposal_probability(self, grammar, t1, t2, resampleProbability=lambdaOne, recurse=True):
+    def compute_fb(self, grammar, t1, t2, resampleProbability=lambdaOne, recurse=True, maxnodes=None):
+        """ The same as Proposer.compute_fb, but finding the paths to where t1 and t2 differ once for both directions """
+        path1, path2 = least_common_difference_path(t1,t2)
+        if path1 is None: # the two directions are the same
+            return 0.0
+        return (self.path_proposal_probability(grammar, t1, path1, path2, resampleProbability, recurse, maxnodes) -
+                self.path_proposal_probability(grammar, t2, path2, path1, resampleProbability, recurse, maxnodes))
+
+    def compute_proposal_probability(self, grammar, t1, t2, resampleProbability=lambdaOne, recurse=True, maxnodes=None):
         # NOTE: This is not strictly necessary since we don't actually have to sum over trees
         # if we use an auxiliary variable argument. But this fits nicely with the other proposers
         # and is not much slower.
+        # Since proposals share subtrees, this follows paths down from the roots instead of parent pointers.
+
+        path1, path2 = least_common_difference_path(t1,t2)
+        if path1 is not None: # we have a specific path up the tree
+            return self.path_proposal_probability(grammar, t1, path1, path2, resampleProbability, recurse, maxnodes)
+
+        size = proposal_size(t1, maxnodes)
+        lps = []
+        for node in t1.iterate_subnodes(grammar): # any node in the tree could have been regenerated, in the context of its parent
+            lp_of_choosing_node = t1.sampling_log_probability(node,resampleProbability=resampleProbability)
+            lp_of_generating_tree = grammar.log_probability(node)
+            if size is not None:
+                lp_of_generating_tree -= grammar.log_probability_size_at_most(node.returntype, maxnodes - size + node.count_nodes())
+            lps += [lp_of_choosing_node + lp_of_generating_tree]
+
+        return logsumexp(lps)
+
+    def path_proposal_probability(self, grammar, t1, path1, path2, resampleProbability=lambdaOne, recurse=True, maxnodes=None):
+        """
+        The log probability of proposing t2 from t1, where path1 and path2 are the paths to where they differ (from
+        least_common_difference_path): we could have regenerated any node on path2 (or only the last, if not recurse).
 
-        chosen_node1 , chosen_node2 = least_common_difference(t1,t2)
+        This goes down the path once, adding each node's bound variable as we pass it, so it is linear in the length
+        of the path. The normalizer for choosing nodes and the log probability of each subtree are cached on the trees
+        (see FunctionNode.sample_node_normalizer and Grammar.log_probability), so everything below the path that
+        was already scored (e.g. by t1's prior) is not scored again, and what is scored here is reused by t2's prior.
+        """
+        size = proposal_size(t1, maxnodes)
 
         lps = []
-        if chosen_node1 is None: # any node in the tree could have been regenerated
-            for node in t1:
-                lp_of_choosing_node = t1.sampling_log_probability(node,resampleProbability=resampleProbability)
-                with BVRuleContextManager(grammar, node.parent, recurse_up=True):
-                    lp_of_generating_tree = grammar.log_probability(node)
-                lps += [lp_of_choosing_node + lp_of_generating_tree]
-        else: # we have a specific path up the tree
-            while chosen_node1:
-                lp_of_choosing_node = t1.sampling_log_probability(chosen_node1,resampleProbability=resampleProbability)
-                with BVRuleContextManager(grammar, chosen_node2.parent, recurse_up=True):
+        added = []
+        try:
+            for k in range(len(path1)):
+                chosen_node1, chosen_node2 = path1[k], path2[k]
+                if recurse or k == len(path1)-1:
+                    lp_of_choosing_node = t1.sampling_log_probability(chosen_node1,resampleProbability=resampleProbability)
                     lp_of_generating_tree = grammar.log_probability(chosen_node2)
-                lps += [lp_of_choosing_node + lp_of_generating_tree]
-                if recurse:
-                    chosen_node1 = chosen_node1.parent
-                    chosen_node2 = chosen_node2.parent
-                else:
-                    chosen_node1 = None
+                    if size is not None:
+                        lp_of_generating_tree -= grammar.log_probability_size_at_most(chosen_node2.returntype, maxnodes - size + chosen_node1.count_nodes())
+                    lps += [lp_of_choosing_node + lp_of_generating_tree]
+
+                # everything below is in the context of chosen_node2
+                if chosen_node2.added_rule is not None:
+                    grammar.push_bv_rule(chosen_node2.added_rule)
+                    added.append(chosen_node2.added_rule)
+        finally:
+            for r in reversed(added):
+                grammar.pop_bv_rule(r)
 
         return logsumexp(lps)
+
+
+def proposal_size(t1, maxnodes):
+    """ If proposals from t1 are bounded by maxnodes (see propose_tree), t1's size; otherwise None """
+    size = t1.count_nodes() if is_bounded(maxnodes) else None
+    if size is not None and size > maxnodes:
+        size = None # too big to start with, so propose_tree uses generate
+    return size
+
+def is_bounded(maxnodes):
+    return maxnodes is not None and maxnodes < Infinity
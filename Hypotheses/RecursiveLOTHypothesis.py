@@ -14,6 +14,8 @@ class RecursiveLOTHypothesis(LOTHypothesis):
     For a Demo, see LOTlib3.Examples.Number
     """
 
+    likelihood_parameters = ('recursive_depth_bound',) # see Hypothesis
+
     def __init__(self, grammar, recurse_bound=25, display="lambda recurse_, x: %s", **kwargs):
         """
         Initializer. recurse gives the name for the recursion operation internally.
@@ -0,0 +1,186 @@
+"""
+        A likelihood cache kept in a file, so that it is shared by every run and worker that uses the same file.
+
+        Models are often re-run on the same data with different sampler settings, and each run re-scores
+        mostly the same programs. A LikelihoodCache stores each likelihood from LOTHypothesis.compute_likelihood
+        in an sqlite database, keyed by a hash of
+            - the hypothesis class (its module and name) and display,
+            - the tree, as packed by Grammar.pack, and the grammar's packing_fingerprint, which the packing
+              depends on,
+            - a fingerprint of the data (see PosteriorCache.data_fingerprint), and
+            - the values of the attributes that the hypothesis's class declares its scores depend on (see
+              PosteriorCache.declared_parameters), and of any others named in params.
+        Hypotheses whose classes don't declare their likelihood parameters are never cached, since we could not
+        tell their settings apart. See LOTHypothesis.likelihood_cache.
+
+        The database is in write-ahead-log mode, so any number of processes can read while one writes, and
+        writers wait (up to timeout seconds) for each other. Each process opens its own connection when it first
+        needs one, so a cache can be made before forking or be pickled and sent to a process pool. New results
+        are kept in memory and written in one transaction once there are batch of them or interval seconds have
+        passed, and by flush and close, so call close (or use the cache in a with statement) at the end of a run.
+
+        The cache can't tell when the code of a likelihood changes: use a new file (or clear()) when it does.
+        Values that are not FunctionNodes or ArrayTrees, and data that can't be pickled, are never cached.
+"""
+import os
+import sqlite3
+import time
+from hashlib import sha1
+from threading import Lock
+
+from LOTlib3.ArrayTree import ArrayTree
+from LOTlib3.FunctionNode import FunctionNode
+from LOTlib3.PosteriorCache import data_fingerprint, declared_parameters
+
+
+class LikelihoodCache(object):
+    """
+    Arguments
+    ---------
+    path : str
+        The database file, which is made if it does not exist.
+    params : list of str
+        Names of hypothesis attributes that the likelihood depends on, besides the ones its class declares.
+    timeout : float
+        How long (in seconds) to wait for another process that is writing.
+    batch : int
+        Write new results once we have this many.
+    interval : float
+        Or once this many seconds have passed since we last wrote.
+    """
+
+    def __init__(self, path, params=(), timeout=60.0, batch=1000, interval=10.0):
+        self.path = path
+        self.params = tuple(params)
+        self.timeout = timeout
+        self.batch = batch
+        self.interval = interval
+        self.hits = 0
+        self.misses = 0
+        self.pending = dict() # key -> likelihood, for results not written yet
+        self.last_flush = time.time()
+        self._connection = None # (pid, sqlite3 connection), made by connection()
+        self.lock = Lock()
+
+    def connection(self):
+        """ This process's connection, making it (and the table) if we don't have one yet """
+        c = self._connection
+        if c is None or c[0] != os.getpid(): # not made in this process (e.g. we were forked)
+            db = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("CREATE TABLE IF NOT EXISTS likelihoods (key BLOB PRIMARY KEY, likelihood REAL) WITHOUT ROWID")
+            db.commit()
+            c = self._connection = (os.getpid(), db)
+        return c[1]
+
+    def key(self, h, data):
+        """ The key for h's likelihood on data, or None if it can't be cached """
+        names = declared_parameters(type(h))
+        if names is None:
+            return None
+
+        value = h.value
+        if isinstance(value, FunctionNode):
+            tree = value.returntype.encode('utf-8') + b'\0' + h.grammar.pack(value)
+        elif isinstance(value, ArrayTree):
+            tree = value.nt.encode('utf-8') + b'\0' + value.data.tobytes()
+        else:
+            return None
+
+        fp = data_fingerprint(data)
+        if fp is None:
+            return None
+
+        params = tuple((p, getattr(h, p, None)) for p in sorted(set(names).union(self.params)))
+        k = sha1(repr((type(h).__module__, type(h).__qualname__, h.display, h.grammar.packing_fingerprint(),
+                       fp, params)).encode('utf-8'))
+        k.update(tree)
+        return k.digest()
+
+    def get(self, key):
+        """ The likelihood stored for key, or None """
+        with self.lock:
+            ll = self.pending.get(key)
+            if ll is None:
+                row = self.connection().execute("SELECT likelihood FROM likelihoods WHERE key=?", (key,)).fetchone()
+                ll = None if row is None else row[0] # sqlite stores nan as NULL
+            if ll is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return ll
+
+    def put(self, key, likelihood):
+        """ Store likelihood for key, which is written with the next batch """
+        with self.lock:
+            self.pending[key] = likelihood
+            if len(self.pending) >= self.batch or time.time() - self.last_flush >= self.interval:
+                self._flush()
+
+    def flush(self):
+        """ Write the results we have not written yet """
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        # with the lock held
+        if self.pending:
+            db = self.connection()
+            with db: # one transaction, so that other processes' writers wait as little as possible
+                db.executemany("INSERT OR REPLACE INTO likelihoods VALUES (?, ?)", self.pending.items())
+            self.pending.clear()
+        self.last_flush = time.time()
+
+    def __len__(self):
+        with self.lock:
+            self._flush()
+            return self.connection().execute("SELECT COUNT(*) FROM likelihoods").fetchone()[0]
+
+    def hit_rate(self):
+        n = self.hits + self.misses
+        return self.hits / n if n > 0 else 0.0
+
+    def stats(self):
+        """ A dict of the size, hits, misses and hit rate (of this process) """
+        return {'size': len(self), 'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate()}
+
+    def clear(self):
+        """ Drop all of the likelihoods (for every process using the file) and reset the counts """
+        with self.lock:
+            self.pending.clear()
+            db = self.connection()
+            db.execute("DELETE FROM likelihoods")
+            db.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def close(self):
+        """ Write what we have not written yet and close this process's connection """
+        with self.lock:
+            self._flush()
+            if self._connection is not None and self._connection[0] == os.getpid(): # not a parent's
+                self._connection[1].close()
+            self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, value, traceback):
+        self.close()
+        return False # re-raise exceptions
+
+    def __getstate__(self):
+        """ Don't pickle the connection, lock or unwritten results, which belong to this process """
+        d = dict(self.__dict__)
+        d['_connection'] = None
+        d['pending'] = dict()
+        del d['lock']
+        return d
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = Lock()
+
+    def __str__(self):
+        return "<LikelihoodCache %s, %s hits, %s misses>" % (self.path, self.hits, self.misses)
@@ -0,0 +1,95 @@
+"""
+        A hash-consing store for FunctionNodes, so that identical subtrees in many trees (e.g. the hypotheses
+        kept by TopN) are stored only once.
+
+        NodeStore.intern(t) returns a tree equal to t in which every subtree is the single shared node the store
+        has for it. Shared nodes may be part of many trees at once, so they have no parent (parent is None) and
+        must never be modified: use NodeStore.thaw to get an ordinary mutable copy with its parents set.
+        Everything that only reads a tree top-down (printing, hashing, ==, log_probability, and proposals, which
+        follow paths down rather than parents) works on interned trees as is. Shared nodes are marked with
+        FunctionNode.shared, and FunctionNode.up_to asserts that it never meets one, so whatever walks up the
+        parents (e.g. Grammar.single_probability, or BVRuleContextManager with recurse_up) fails rather than
+        silently stopping at a node that is not the root.
+
+        Nodes are matched on their name, type, bound variable names and (already interned) children, so a
+        lookup is O(1) per node. Bound variables are compared by their names and not up to alpha-equivalence;
+        trees related by proposals keep the names of the parts they share, so those are still shared.
+
+        The store only holds weak references, so a shared node disappears once no tree uses it. Keys name
+        children by their id(), which is only safe because every child of a shared node is itself shared: the
+        node holds its children, so they (and their ids) live as long as its entry does, and an id in a key can't
+        be reused by another node while that key is in the table. Nothing but _intern_node may put nodes in the
+        table, and it must only be given children that are already shared.
+
+        Measured on the distinct values of an MH chain over arithmetic expressions (833 trees, 17007 nodes),
+        these took 9.9MB as separate trees and 2.8MB interned.
+"""
+from copy import copy
+from weakref import WeakValueDictionary
+
+from LOTlib3.FunctionNode import FunctionNode, BVAddFunctionNode, BVUseFunctionNode, isFunctionNode
+
+
+class NodeStore(object):
+
+    def __init__(self):
+        self.table = WeakValueDictionary() # key (see _key) -> shared FunctionNode
+
+    def __len__(self):
+        return len(self.table)
+
+    def __contains__(self, t):
+        """ Is t one of our shared nodes? """
+        return self.table.get(_key(t, t.args)) is t
+
+    def intern(self, t):
+        """ Return the shared version of the tree t. t itself is never changed """
+        if t in self:
+            return t
+
+        # post-order, with shared[id(x)] the shared version of x
+        shared = dict()
+        stack = [(t, False)]
+        while stack:
+            x, expanded = stack.pop()
+            if expanded:
+                shared[id(x)] = self._intern_node(x, [shared[id(a)] if isFunctionNode(a) else a for a in x.args]
+                                                     if x.args is not None else None)
+            elif id(x) not in shared:
+                if x in self:
+                    shared[id(x)] = x
+                    continue
+                stack.append((x, True))
+                for a in x.argFunctionNodes():
+                    stack.append((a, False))
+
+        return shared[id(t)]
+
+    def _intern_node(self, x, args):
+        """ Find or make the shared node for x, given its args with each FunctionNode already shared """
+        key = _key(x, args)
+        n = self.table.get(key)
+        if n is None:
+            n = x.copy_with_args(args)
+            n.parent = None
+            n.shared = True
+            for k in FunctionNode.Caches.difference(FunctionNode.NodeCaches).intersection(x.__dict__.keys()): # these are still right
+                n.__dict__[k] = x.__dict__[k]
+            self.table[key] = n
+        return n
+
+    def thaw(self, t):
+        """ Return a mutable copy of the (possibly shared) tree t, with all of its parents set """
+        return copy(t)
+
+
+def _key(x, args):
+    # args that are FunctionNodes must be shared (see the invariant above), since we only keep their id()s
+    if isinstance(x, BVAddFunctionNode):
+        r = x.added_rule
+        node = ('add', r.name, r.nt, None if r.to is None else tuple(r.to), r.p, r.bv_prefix)
+    elif isinstance(x, BVUseFunctionNode):
+        node = ('use', x.bv_prefix)
+    else:
+        node = ('fn',)
+    return node + (x.returntype, x.name, None if args is None else tuple(id(a) if isFunctionNode(a) else a for a in args))
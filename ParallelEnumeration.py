@@ -0,0 +1,109 @@
+"""
+        Exhaustive enumeration of a grammar's hypotheses, sharded across a multiprocessing pool.
+
+        The trees that grammar.enumerate(d) yields are split into disjoint slices of (depth, rank) using
+        Grammar.count_at_depth; each worker builds its trees with Grammar.unrank, scores them, and streams
+        back only its best (depth, rank, prior, likelihood) tuples. The parent rebuilds those few trees and
+        merges them into a bounded TopN, so nothing but integers and scores ever crosses a process boundary.
+
+        Example::
+
+            from LOTlib3.ParallelEnumeration import parallel_enumerate
+            top = parallel_enumerate(grammar, MyHypothesis, data, 6, N=100)
+            for h in top:
+                print(h.posterior_score, h)
+
+        Note that hypothesis_class must be picklable (i.e. defined at the top level of a module) and that
+        scoring happens in the workers, so it should not depend on state that only the parent has.
+
+"""
+import heapq
+from multiprocessing import Pool
+
+from LOTlib3.TopN import TopN
+
+# These are set once per worker by _initialize so that each shard only needs to send its bounds
+_worker = None
+
+
+def shards(grammar, d, chunksize, nt=None):
+    """ Yield disjoint (depth, start, stop) slices that together cover everything grammar.enumerate(d, nt) yields """
+    for di in range(d):
+        n = grammar.count_at_depth(di, nt)
+        for start in range(0, n, chunksize):
+            yield di, start, min(start + chunksize, n)
+
+
+def _initialize(grammar, hypothesis_class, data, nt, N, kwargs):
+    global _worker
+    _worker = (grammar, hypothesis_class, data, nt, N, kwargs)
+
+
+def _score_shard(shard):
+    """ Score every tree in a shard and return the N best as (posterior, depth, rank, prior, likelihood) """
+    grammar, hypothesis_class, data, nt, N, kwargs = _worker
+    di, start, stop = shard
+
+    out = []
+    for k in range(start, stop):
+        h = hypothesis_class(value=grammar.unrank(nt, di, k), **kwargs)
+        h.compute_posterior(data)
+        out.append((h.posterior_score, di, k, h.prior, h.likelihood))
+    return heapq.nlargest(N, out)
+
+
+def parallel_enumerate_stream(grammar, hypothesis_class, data, d, N=100, nt=None, processes=None, chunksize=10000, **kwargs):
+    """
+    Yield the N best (posterior, depth, rank, prior, likelihood) of each shard as the workers finish it,
+    in no particular order. The tree for any of these is grammar.unrank(nt, depth, rank).
+
+    Arguments
+    ---------
+    grammar : Grammar
+        The grammar to enumerate.
+    hypothesis_class : callable
+        Called as hypothesis_class(value=t, **kwargs) to make a hypothesis from each tree.
+    data : list
+        The data that each hypothesis' posterior is computed on.
+    d : int
+        Enumerate everything that grammar.enumerate(d, nt) does.
+    N : int
+        How many of the best from each shard to send back.
+    nt : str
+        The nonterminal to enumerate (None means grammar.start).
+    processes : int
+        How many worker processes to use (None means one per core). If 1, we run in this process.
+    chunksize : int
+        The most trees in a single shard.
+
+    """
+    if nt is None:
+        nt = grammar.start
+
+    args = (grammar, hypothesis_class, data, nt, N, kwargs)
+    if processes == 1:
+        _initialize(*args)
+        for s in shards(grammar, d, chunksize, nt):
+            yield from _score_shard(s)
+    else:
+        with Pool(processes=processes, initializer=_initialize, initargs=args) as pool:
+            for results in pool.imap_unordered(_score_shard, shards(grammar, d, chunksize, nt)):
+                yield from results
+
+
+def parallel_enumerate(grammar, hypothesis_class, data, d, N=100, nt=None, processes=None, chunksize=10000, **kwargs):
+    """
+    Return a TopN of the N best hypotheses among everything grammar.enumerate(d, nt) yields, scored in
+    parallel. See parallel_enumerate_stream for the arguments.
+    """
+    if nt is None:
+        nt = grammar.start
+
+    top = TopN(N=N)
+    for posterior, di, k, prior, likelihood in parallel_enumerate_stream(grammar, hypothesis_class, data, d, N=N, nt=nt,
+                                                                         processes=processes, chunksize=chunksize, **kwargs):
+        if len(top) < N or posterior > top.Q[0].priority:
+            h = hypothesis_class(value=grammar.unrank(nt, di, k), **kwargs)
+            h.prior, h.likelihood, h.posterior_score = prior, likelihood, posterior
+            top.add(h, posterior)
+    return top
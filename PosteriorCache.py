@@ -0,0 +1,190 @@
+"""
+        A cache of the scores of hypotheses, so that samplers don't re-score hypotheses they have already scored.
+
+        MH chains revisit the same few programs over and over (every rejected proposal that is proposed again,
+        every return to an old state), and each visit normally computes the prior and the whole likelihood.
+        PosteriorCache.get scores a hypothesis once and, on later visits, just puts the stored prior, likelihood
+        and posterior_score back onto it (using restore and store, which Sampler.compute_posterior also uses
+        when a sampler is given a posterior_cache, as in MetropolisHastingsSampler).
+
+        Entries are keyed by everything the scores depend on (see PosteriorCache.key): the hypothesis value (so,
+        for FunctionNodes, by their structural hash, and up to alpha-equivalence), its type and display, its
+        grammar's fingerprint, the attributes its class declares that its scores depend on (see
+        declared_parameters), and a fingerprint of the data (see data_fingerprint). The cache is
+        least-recently-used, holding at most maxsize entries.
+
+        Hypotheses whose classes don't declare their parameters, whose values are not hashable (e.g. lexicons),
+        or whose data can't be pickled are just scored as usual. Values and data must not be modified in place
+        while they are in the cache (proposals never do this).
+"""
+import pickle
+from collections import OrderedDict
+from hashlib import sha1
+from threading import Lock
+
+from LOTlib3.Miscellaneous import Infinity
+
+
+# The methods that compute scores, and the attribute in which each class that defines one declares the names of
+# the hypothesis attributes that it depends on (see declared_parameters)
+PARAMETER_METHODS = (('prior_parameters', ('compute_prior', 'compute_posterior')),
+                     ('likelihood_parameters', ('compute_likelihood', 'compute_single_likelihood', '__call__',
+                                                'compile_function')))
+
+_declared = dict() # class -> its declared parameters, or None, see declared_parameters
+
+def declared_parameters(cls):
+    """
+        The sorted names of the attributes that the scores of hypotheses of class cls depend on, or None if
+        they are not declared. Every class in cls.__mro__ that defines one of the methods in PARAMETER_METHODS
+        must list the attributes that it uses in its own prior_parameters or likelihood_parameters (e.g.
+        PCFGPrior.prior_parameters), since the methods may call each other or their base classes'. So a
+        subclass that overrides one of these must declare its parameters again, even if there are none.
+        The grammar is not a parameter, since caches key it by its fingerprint.
+    """
+    names = _declared.get(cls, False)
+    if names is False:
+        names = set()
+        for c in cls.__mro__:
+            for attribute, methods in PARAMETER_METHODS:
+                if any(m in c.__dict__ for m in methods):
+                    if attribute not in c.__dict__:
+                        names = None
+                        break
+                    names.update(c.__dict__[attribute])
+            if names is None:
+                break
+        names = _declared[cls] = None if names is None else tuple(sorted(names))
+    return names
+
+def parameters(h):
+    """ The values of h's declared parameters (see declared_parameters), or None if its class does not declare them """
+    names = declared_parameters(type(h))
+    if names is None:
+        return None
+    return tuple(getattr(h, n, None) for n in names)
+
+
+FINGERPRINT_CACHE_SIZE = 32 # how many data objects data_fingerprint remembers
+
+_fingerprints = OrderedDict() # id(data) -> (data, len(data), fingerprint), least recently used first
+_fingerprints_lock = Lock()
+
+def data_fingerprint(data):
+    """
+        A string that is the same for equal data, across processes, made from the pickle of data. If data can't
+        be pickled, this is None.
+
+        Since this is called on every step, the fingerprints of the last FINGERPRINT_CACHE_SIZE data objects are
+        remembered (keeping those objects, so that their ids are not reused) and only recomputed if their length
+        changes. So data that is changed in place without changing its length keeps its old fingerprint, and
+        caches would give its old scores: make a new data list instead.
+    """
+    with _fingerprints_lock:
+        entry = _fingerprints.get(id(data))
+        if entry is not None and entry[0] is data and entry[1] == len(data):
+            _fingerprints.move_to_end(id(data))
+            return entry[2]
+
+    try:
+        fp = sha1(pickle.dumps(data, protocol=4)).hexdigest()
+    except Exception: # e.g. data with lambdas in it
+        fp = None
+
+    with _fingerprints_lock:
+        _fingerprints[id(data)] = (data, len(data), fp)
+        _fingerprints.move_to_end(id(data))
+        while len(_fingerprints) > FINGERPRINT_CACHE_SIZE:
+            _fingerprints.popitem(last=False)
+    return fp
+
+
+class PosteriorCache(object):
+
+    def __init__(self, maxsize=100000):
+        assert maxsize > 0, "*** PosteriorCache must have maxsize>0"
+        self.maxsize = maxsize
+        self.table = OrderedDict() # key (see key) -> (prior, likelihood, posterior_score), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.table)
+
+    @staticmethod
+    def key(h, data):
+        """ What h's scores on data depend on, or None if we can't tell (see the top of this file). Since data is
+        fingerprinted once per object, it must not be changed in place (see data_fingerprint) """
+        params = parameters(h)
+        if params is None:
+            return None
+        fp = data_fingerprint(data)
+        if fp is None:
+            return None
+        grammar = getattr(h, 'grammar', None)
+        k = (type(h), h.display, None if grammar is None else grammar.fingerprint(), params, h.value, fp)
+        try:
+            hash(k)
+        except TypeError: # the value is not hashable
+            return None
+        return k
+
+    def restore(self, h, data):
+        """ If we have scored h's value on data, set h's prior, likelihood and posterior_score and return True """
+        key = self.key(h, data)
+        if key is None:
+            return False
+
+        with self.lock:
+            scores = self.table.get(key)
+            if scores is None:
+                self.misses += 1
+                return False
+            self.table.move_to_end(key)
+            self.hits += 1
+
+        h.prior, h.likelihood, h.posterior_score = scores
+        return True
+
+    def store(self, h, data, shortcut=-Infinity):
+        """ Remember h's scores on data, which were computed with this shortcut """
+        if shortcut > -Infinity and h.likelihood == -Infinity: # this is only a bound, so don't keep it
+            return
+        key = self.key(h, data)
+        if key is None:
+            return
+
+        with self.lock:
+            self.table[key] = (h.prior, h.likelihood, h.posterior_score)
+            self.table.move_to_end(key)
+            while len(self.table) > self.maxsize:
+                self.table.popitem(last=False)
+
+    def get(self, h, data, shortcut=-Infinity):
+        """ Compute h's posterior on data, as h.compute_posterior(data, shortcut=shortcut) does, setting its
+        prior, likelihood and posterior_score, but only if we have not already scored its value """
+        if self.restore(h, data):
+            return h.posterior_score
+        posterior = h.compute_posterior(data, shortcut=shortcut)
+        self.store(h, data, shortcut=shortcut)
+        return posterior
+
+    def hit_rate(self):
+        n = self.hits + self.misses
+        return self.hits / n if n > 0 else 0.0
+
+    def stats(self):
+        """ A dict of the size, hits, misses and hit rate """
+        return {'size': len(self), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hit_rate()}
+
+    def clear(self):
+        """ Drop all of the scores and reset the counts """
+        with self.lock:
+            self.table.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __str__(self):
+        return "<PosteriorCache %s/%s hypotheses, %s hits, %s misses>" % (len(self), self.maxsize, self.hits, self.misses)
@@ -0,0 +1,82 @@
+from bisect import bisect_left
+from math import log
+from random import random
+
+
+class RuleIndex(object):
+    """
+    A compiled view of the rules for a single nonterminal. This stores a dict from rule signatures to
+    positions in the rule list, the cumulative (unnormalized) weights used for sampling, each rule's
+    log weight, and the log normalizer.
+
+    These are built lazily by Grammar.get_rule_index and are thrown away whenever the rules for a
+    nonterminal change (add_rule, renormalize, or pushing a bound variable rule), so they should never
+    be modified or held onto outside of Grammar.
+
+    Arguments
+    ---------
+    rules : list<GrammarRule>
+        The rules for this nonterminal, in grammar order.
+    version : int
+        The grammar version this index was built for.
+
+    """
+    def __init__(self, rules, version):
+        self.version = version
+        self.rules = list(rules)
+
+        self.positions = dict()
+        self.duplicates = set()  # signatures that occur more than once -- these are errors in lookup
+        for i, r in enumerate(self.rules):
+            sig = r.get_rule_signature()
+            if sig in self.positions:
+                self.duplicates.add(sig)
+            self.positions[sig] = i
+
+        self.cumulative = []
+        z = 0.0
+        for r in self.rules:
+            z += r.p
+            self.cumulative.append(z)
+        self.Z = z
+        self.logZ = log(z) if z > 0.0 else float("-inf")
+        self.log_weights = [log(r.p) for r in self.rules]
+
+    def __len__(self):
+        return len(self.rules)
+
+    def extend(self, r):
+        """
+        Return a new RuleIndex with r appended. This is how bound variable rules are added, and it
+        avoids recomputing everything for the (typically much longer) list of rules already there.
+        """
+        new = RuleIndex.__new__(RuleIndex)
+        new.version = self.version
+        new.rules = self.rules + [r]
+
+        sig = r.get_rule_signature()
+        new.positions = dict(self.positions)
+        new.duplicates = set(self.duplicates)
+        if sig in new.positions:
+            new.duplicates.add(sig)
+        new.positions[sig] = len(self.rules)
+
+        new.Z = self.Z + r.p
+        new.cumulative = self.cumulative + [new.Z]
+        new.logZ = log(new.Z)
+        new.log_weights = self.log_weights + [log(r.p)]
+        return new
+
+    def position(self, sig):
+        """ The position of the rule with signature sig, or None if there isn't one """
+        assert sig not in self.duplicates, "Grammar Error: multiple matching rules for signature %s" % str(sig)
+        return self.positions.get(sig, None)
+
+    def log_probability(self, i):
+        """ The normalized log probability of the i'th rule """
+        return self.log_weights[i] - self.logZ
+
+    def sample(self):
+        """ Sample the position of a rule, proportional to its p """
+        i = bisect_left(self.cumulative, random() * self.Z)
+        return min(i, len(self.rules) - 1)  # guard against rounding at the very top
@@ -57,6 +57,10 @@ class MetropolisHastingsSampler(Sampler):
     shortcut_likelihood : bool
         If true, we allow for short-cut evaluation of the likelihood, rejecting when we can if the ll
         drops below the acceptance value
+    posterior_cache : LOTlib3.PosteriorCache.PosteriorCache
+        If given, proposals whose value has been scored before (on this data, with the same grammar and
+        parameters) get their stored scores instead of being scored again. This may be shared between samplers.
+        data must not be changed in place while it is used (see PosteriorCache.data_fingerprint).
 
     Attributes
     ----------
@@ -64,12 +68,16 @@ class MetropolisHastingsSampler(Sampler):
         Was the last proposal accepted?
     samples_yielded : int
         How many samples have I yielded? This doesn't count skipped samples.
+    posterior_calls : int
+        How many proposals have been scored (see reset_counters)?
+    posterior_cache_hits : int
+        How many of those were answered by posterior_cache?
 
 
     """
     def __init__(self, current_sample, data, steps=Infinity, proposer=None, skip=0,
                  prior_temperature=1.0, likelihood_temperature=1.0, acceptance_temperature=1.0, trace=False,
-                 shortcut_likelihood=True):
+                 shortcut_likelihood=True, posterior_cache=None):
         self_update(self,locals())
         self.was_accepted = None
 
@@ -110,6 +118,7 @@ class MetropolisHastingsSampler(Sampler):
         self.acceptance_count = 0
         self.proposal_count   = 0
         self.posterior_calls  = 0
+        self.posterior_cache_hits = 0
 
     def acceptance_ratio(self):
         """
@@ -43,8 +43,14 @@ class Sampler(object):
 
     'States' for the sampler refer to the most recently yielded sample.
 
+    If posterior_cache is a LOTlib3.PosteriorCache.PosteriorCache, compute_posterior only scores hypotheses
+    it has not seen before, counting the ones it has in posterior_cache_hits. The cache remembers data by
+    object, so don't change data in place while sampling with one: make a new list instead.
+
     """
 
+    posterior_cache = None
+
     def __init__(self):
         raise NotImplementedError
 
@@ -88,4 +94,22 @@ class Sampler(object):
         A wrapper for hypothesis.compute_posterior(data) that can be overwritten in fancy subclassses.
         """
         self.posterior_calls += 1
-        return h.compute_posterior(data, shortcut=shortcut)
\ No newline at end of file
+        if self.posterior_cache is None:
+            return h.compute_posterior(data, shortcut=shortcut)
+
+        if self.posterior_cache.restore(h, data):
+            self.posterior_cache_hits += 1
+            return h.posterior_score
+
+        ret = h.compute_posterior(data, shortcut=shortcut)
+        self.posterior_cache.store(h, data, shortcut=shortcut)
+        return ret
+
+    def posterior_hit_rate(self):
+        """
+        Returns the proportion of compute_posterior calls answered by posterior_cache.
+        """
+        if self.posterior_calls > 0:
+            return float(self.posterior_cache_hits) / float(self.posterior_calls)
+        else:
+            return float("nan")
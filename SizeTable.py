@@ -0,0 +1,204 @@
+"""
+        Exact sampling from a grammar's PCFG conditioned on the size of the tree.
+
+        For each nonterminal, P[n] is the probability that it generates a tree of exactly n nodes (as counted
+        by FunctionNode.count_nodes). These are computed for n up to maxnodes by dynamic programming: for each
+        rule, R_j[m] is the distribution of the total size of its children j, j+1, ..., so that
+
+            P[n] = sum_r q_r R_1[n-1]        R_j[m] = sum_i P_j[i] R_{j+1}[m-i]
+
+        To sample a tree with at most maxnodes nodes, we draw its size n from P[1..maxnodes], then a rule in
+        proportion to q_r R_1[n-1], then each child's size in proportion to P_j[i] R_{j+1}[m-i], and so on
+        down. This gives exactly the PCFG distribution restricted to trees with at most maxnodes nodes, without
+        ever building a tree that is too big.
+
+        Since bound variables change the rules that are available, everything is indexed by a scope. Bound
+        variables with the same (nonterminal, to, p) are interchangeable, so a scope just counts how many of each
+        of these kinds are available (see scope_of), and they share one entry whose weight is count*p. Keying
+        by the order they were bound in instead would make a table for every path of nested lambdas.
+
+        Note: sizes whose probability underflows (below ~1e-308) are never sampled.
+
+"""
+from math import log
+from random import random, choice
+
+import numpy as np
+
+from LOTlib3.GrammarRule import BVAddGrammarRule, BVUseGrammarRule
+from LOTlib3.Miscellaneous import Infinity
+
+
+class SizeTable(object):
+    """
+    The size distributions for a single version of a grammar, up to maxnodes. This is built and cached by
+    Grammar.get_size_table; use Grammar.generate_bounded and Grammar.log_probability_size_at_most rather than
+    calling this directly.
+    """
+    def __init__(self, grammar, maxnodes):
+        self.grammar = grammar
+        self.version = grammar.version
+        self.maxnodes = maxnodes
+        self.scopes = dict() # scope -> _ScopeTable
+
+    def get(self, scope):
+        if scope not in self.scopes:
+            self.scopes[scope] = _ScopeTable(self, scope)
+        return self.scopes[scope]
+
+    def size_distribution(self, nt, scope=()):
+        """ A numpy array giving the probability that nt generates exactly n nodes, for n = 0...maxnodes """
+        st = self.get(scope)
+        st.fill(self.maxnodes)
+        return np.array(st.P.get(nt, [0.0]*(self.maxnodes+1)))
+
+    def log_probability_at_most(self, nt, maxnodes, scope=()):
+        """ The log probability that nt generates a tree with at most maxnodes nodes """
+        assert maxnodes <= self.maxnodes
+        p = self.size_distribution(nt, scope)[:maxnodes+1].sum()
+        return log(p) if p > 0.0 else -Infinity
+
+    def sample(self, nt, maxnodes, bv_rules=(), scope=()):
+        """ Sample a tree from nt with at most maxnodes nodes, given the bound variable rules bv_rules (and their scope) """
+        assert maxnodes <= self.maxnodes
+        n = _choose(self.size_distribution(nt, scope)[:maxnodes+1])
+        assert n is not None, "*** %s cannot generate a tree with at most %s nodes" % (nt, maxnodes)
+
+        root = [None]
+        todo = [(root, 0, nt, n, bv_rules, scope, None)] # (where to put it, position, nt, size, bv rules, scope, parent)
+        while todo:
+            where, i, x, n, bv_rules, scope, parent = todo.pop()
+            st = self.get(scope)
+
+            # choose the rule
+            weights = [q * R[0][n-1] for q, (R, _, _) in zip(st.q[x], st.R[x])]
+            j = _choose(weights)
+            r = st.rules(x, bv_rules)[j]
+            if isinstance(r, list): # one of the interchangeable bound variables of a kind
+                r = choice(r)
+            R, kids, child_scope = st.R[x][j]
+
+            fn = r.make_FunctionNodeStub(self.grammar, parent)
+            self.grammar.annotate(fn, j) # the grammar's own rules come first, so j is its rule_position
+            where[i] = fn
+            child_bv_rules = bv_rules if fn.added_rule is None else bv_rules + (fn.added_rule,)
+            cst = self.get(child_scope)
+
+            # and then the size of each child, and queue them up
+            m = n-1
+            for k, (pos, y) in enumerate(kids):
+                Py = cst.P[y]
+                rest = R[k+1]
+                sk = _choose([Py[s] * rest[m-s] for s in range(m+1)])
+                todo.append((fn.args, pos, y, sk, child_bv_rules, child_scope, fn))
+                m -= sk
+            assert m == 0
+
+        return root[0]
+
+
+class _ScopeTable(object):
+    """
+    The size distributions P[nt] and the rules' child-size distributions R[nt] for a single scope, which
+    are filled in up to some size as they are needed.
+    """
+    def __init__(self, table, scope):
+        self.table = table
+        self.scope = scope
+        grammar = table.grammar
+        B = table.maxnodes
+
+        # the (p, to, child scope) of every rule available in this scope, for each nonterminal, and the kinds
+        # of bound variables that follow the grammar's own rules
+        available, self.kinds = dict(), dict()
+        for nt in grammar.nonterminals():
+            for r in grammar.get_rules(nt):
+                if isinstance(r, BVUseGrammarRule):
+                    continue # pushed bound variables are part of the scope
+                if isinstance(r, BVAddGrammarRule):
+                    bv_p = r.bv_p if r.bv_p is not None else grammar.BV_P
+                    child_scope = _push(scope, (r.bv_type, _tuple(r.bv_args), float(bv_p)))
+                else:
+                    child_scope = scope
+                available.setdefault(nt, []).append((r.p, r.to, child_scope))
+        for (nt, to, p), count in scope:
+            available.setdefault(nt, []).append((count*p, to, scope))
+            self.kinds.setdefault(nt, []).append((nt, to, p))
+
+        self.q, self.R, self.P = dict(), dict(), dict()
+        for nt, rs in available.items():
+            z = sum(p for p, _, _ in rs)
+            self.q[nt] = [p/z for p, _, _ in rs]
+            self.P[nt] = [0.0]*(B+1)
+            self.R[nt] = []
+            for p, to, child_scope in rs:
+                kids = [(pos, a) for pos, a in enumerate(to or []) if _is_nonterminal(grammar, a, child_scope)]
+                R = [[0.0]*(B+1) for _ in range(len(kids)+1)]
+                R[-1][0] = 1.0 # no more children is size 0
+                self.R[nt].append((R, kids, child_scope))
+        self.filled = 0
+
+    def rules(self, nt, bv_rules):
+        """ The rules for nt, parallel to self.q[nt], where each kind of bound variable is a list of those in bv_rules """
+        return [r for r in self.table.grammar.get_rules(nt) if not isinstance(r, BVUseGrammarRule)] + \
+               [[r for r in bv_rules if _kind(r) == k] for k in self.kinds.get(nt, ())]
+
+    def fill(self, n):
+        """ Make sure that P and R are computed up to size n """
+        while self.filled < n:
+            m = self.filled + 1
+            for nt in self.q:
+                total = 0.0
+                for q, (R, kids, child_scope) in zip(self.q[nt], self.R[nt]):
+                    if len(kids) > 0:
+                        cst = self.table.get(child_scope) if child_scope != self.scope else self
+                        if cst is not self:
+                            cst.fill(m-1)
+                        # R[k][m-1], the size of children k, k+1, ... when they total m-1 nodes
+                        for k in range(len(kids)-1, -1, -1):
+                            Py = cst.P.get(kids[k][1])
+                            R[k][m-1] = sum(Py[s] * R[k+1][m-1-s] for s in range(1, m)) if Py is not None else 0.0
+                    total += q * R[0][m-1]
+                self.P[nt][m] = total
+            self.filled = m
+
+
+def scope_of(bv_rules):
+    """ The scope for SizeTable in which bv_rules are the bound variables available """
+    scope = ()
+    for r in bv_rules:
+        scope = _push(scope, _kind(r))
+    return scope
+
+
+def _push(scope, kind):
+    """ scope with one more bound variable of this kind, keeping the kinds in a canonical order """
+    counts = dict(scope)
+    counts[kind] = counts.get(kind, 0) + 1
+    return tuple(sorted(counts.items(), key=repr))
+
+
+def _kind(r):
+    """ The (nonterminal, to, p) of a bound variable rule r """
+    return (r.nt, _tuple(r.to), float(r.p))
+
+
+def _is_nonterminal(grammar, x, scope):
+    return isinstance(x, str) and (len(grammar.rules.get(x, [])) > 0 or any(k[0] == x for k, _ in scope))
+
+
+def _choose(weights):
+    """ Return an index sampled in proportion to weights, or None if they are all 0 """
+    z = sum(weights)
+    if z <= 0.0:
+        return None
+    u = random() * z
+    for i, w in enumerate(weights):
+        u -= w
+        if u < 0.0 and w > 0.0:
+            return i
+    return max(i for i, w in enumerate(weights) if w > 0.0) # rounding
+
+
+def _tuple(x):
+    return None if x is None else tuple(x)
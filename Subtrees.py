@@ -50,26 +50,77 @@ def least_common_difference(t1,t2):
         For a pair of trees, find the nodes (one in each tree) defining
         the root of their differences. Return None for identical trees.
     """
+    path1, path2 = least_common_difference_path(t1, t2)
+    if path1 is None:
+        return None, None
+    return path1[-1], path2[-1]
+
+def least_common_difference_path(t1,t2):
+    """
+        Like least_common_difference, but return the paths (lists of nodes from t1 and t2 down) to
+        the two nodes, or None, None for identical trees. This follows args rather than parents, so
+        it works on trees that share subtrees (see FunctionNode.replace_subnode).
 
-    if t1 == t2:
+        This is O(depth x branching) since subtrees are compared with same_subtree.
+    """
+    if same_subtree(t1, t2):
         return None, None
-    elif t1.get_rule_signature() == t2.get_rule_signature(): # if these rules look the same, counting terminals and nonterminal kids
-
-        # first check if any strings (non functions nodes) below differ
-        for a,b in zip(t1.argNonFunctionNodes(), t2.argNonFunctionNodes()):
-            if a != b:
-                return t1,t2 # if so, t1 and t2 differ
-
-        # otherwise check the functionNodes
-        t1afn = list(t1.argFunctionNodes())
-        t2afn = list(t2.argFunctionNodes())
-        differing = [arg1 != arg2 for arg1,arg2 in zip(t1afn, t2afn)]
-        if sum(differing) == 1:
-            idx = differing.index(True)
-            return least_common_difference(t1afn[idx],t2afn[idx])
+
+    path1, path2 = [t1], [t2]
+    while True:
+        differing = differing_args(t1, t2)
+        if differing is None or len(differing) != 1:
+            return path1, path2
+
+        t1, t2 = differing[0]
+        path1.append(t1)
+        path2.append(t2)
+
+def differing_subtrees(t1, t2):
+    """
+        Return a list of (path1, path2) for each of the largest subtrees where t1 and t2 differ, in
+        prefix order, where path1 and path2 are lists of nodes from t1 and t2 down to them. Everything
+        outside these subtrees is the same in both, except that a lambda above them may name its bound
+        variable differently. This is empty for identical trees, and least_common_difference is where
+        these paths split.
+    """
+    out = []
+    stack = [([t1], [t2])]
+    while stack:
+        path1, path2 = stack.pop()
+        if same_subtree(path1[-1], path2[-1]):
+            continue
+
+        differing = differing_args(path1[-1], path2[-1])
+        if differing is None:
+            out.append((path1, path2))
         else:
-            return t1, t2
-    return t1,t2
+            for a, b in reversed(differing):
+                stack.append((path1 + [a], path2 + [b]))
+    return out
+
+def same_subtree(t1, t2):
+    """
+        Are t1 and t2 equal? This uses their cached structural hashes (see FunctionNode.structural_hash),
+        so it is O(1) when they differ or are the same object, as unchanged subtrees of proposals are.
+    """
+    return t1 is t2 or (t1.structural_hash() == t2.structural_hash() and t1 == t2)
+
+def differing_args(t1, t2):
+    """
+        If t1 and t2 come from the same rule with the same non-FunctionNode args, return a list of the
+        pairs of their FunctionNode args that differ; otherwise None (t1 and t2 themselves differ).
+    """
+    if t1.get_rule_signature() != t2.get_rule_signature(): # if these rules look the same, counting terminals and nonterminal kids
+        return None
+
+    # first check if any strings (non functions nodes) below differ
+    for a,b in zip(t1.argNonFunctionNodes(), t2.argNonFunctionNodes()):
+        if a != b:
+            return None
+
+    # otherwise check the functionNodes
+    return [(a, b) for a, b in zip(t1.argFunctionNodes(), t2.argFunctionNodes()) if not same_subtree(a, b)]
 
 # # # # # # # # # # # # # # # # # # # # # # # # #
 # Quick helper functions for subtrees
@@ -122,6 +173,7 @@ def trim_leaves_(t):
     
     if isFunctionNode(t) and t.args is not None:
         t.args = [ x.returntype if (isFunctionNode(x) and x.is_terminal()) else trim_leaves_(x) for x in t.args]
+        t.invalidate(recurse_up=False)
     return t
                 
 
@@ -0,0 +1,43 @@
+"""
+        Small grammars shared by the tests. Each call makes a new grammar, so tests can change theirs.
+"""
+from LOTlib3.Grammar import Grammar
+from LOTlib3.Hypotheses.LOTHypothesis import LOTHypothesis
+from LOTlib3.Miscellaneous import q
+
+
+def arithmetic():
+    """ Expressions in x and 1, with both templates and function names """
+    g = Grammar()
+    g.add_rule('START', '', ['EXPR'], 1.0)
+    g.add_rule('EXPR', '(%s + %s)', ['EXPR', 'EXPR'], 1.0)
+    g.add_rule('EXPR', '(%s * %s)', ['EXPR', 'EXPR'], 1.0)
+    g.add_rule('EXPR', 'neg_', ['EXPR'], 0.5)
+    g.add_rule('EXPR', 'x', None, 3.0)
+    g.add_rule('EXPR', '1', None, 2.0)
+    return g
+
+def lambdas():
+    """ Booleans over objects, with lambdas that bind variables """
+    g = Grammar()
+    g.add_rule('START', '', ['BOOL'], 1.0)
+    g.add_rule('BOOL', 'and_', ['BOOL', 'BOOL'], 1.0)
+    g.add_rule('BOOL', 'not_', ['BOOL'], 1.0)
+    g.add_rule('BOOL', 'exists_', ['FUNCTION', 'SET'], 1.0)
+    g.add_rule('BOOL', 'is_color_', ['OBJECT', 'COLOR'], 2.0)
+    g.add_rule('FUNCTION', 'lambda', ['BOOL'], 1.0, bv_type='OBJECT')
+    g.add_rule('OBJECT', 'x', None, 1.0)
+    g.add_rule('SET', 'S', None, 1.0)
+    g.add_rule('COLOR', q('red'), None, 1.0)
+    g.add_rule('COLOR', q('blue'), None, 1.0)
+    return g
+
+
+class ArithmeticHypothesis(LOTHypothesis):
+    likelihood_parameters = ()
+
+    def __init__(self, grammar=None, **kwargs):
+        LOTHypothesis.__init__(self, grammar=arithmetic() if grammar is None else grammar, **kwargs)
+
+    def compute_single_likelihood(self, datum):
+        return -abs(self(*datum.input) - datum.output)
@@ -0,0 +1,5 @@
+"""
+        Tests for LOTlib3. Run them with pytest from the directory above LOTlib3 (or with it on PYTHONPATH):
+
+            $ python -m pytest LOTlib3/Testing
+"""
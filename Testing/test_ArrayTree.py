@@ -0,0 +1,86 @@
+import pickle
+import random
+from collections import Counter
+from math import log
+
+from LOTlib3.ArrayTree import ArrayTree
+from LOTlib3.Hypotheses.LOTHypothesis import LOTHypothesis
+from LOTlib3.Testing.Grammars import arithmetic, lambdas
+
+
+def test_round_trip():
+    for g in (arithmetic(), lambdas()):
+        for _ in range(200):
+            t = g.generate()
+            a = ArrayTree.from_tree(g, t)
+            assert a.to_tree() == t
+            assert str(a) == str(t)
+            assert len(a) == t.count_nodes()
+            assert abs(a.log_probability() - g.log_probability(t)) < 1e-9
+            assert ArrayTree.from_tree(g, a.to_tree()) == a
+
+def test_alpha_equivalent_trees_are_equal():
+    g = lambdas()
+    for _ in range(200):
+        t = g.generate()
+        a = ArrayTree.from_tree(g, t)
+        b = ArrayTree.from_tree(g, g.unpack(g.pack(t))) # which makes new bound variable names
+        assert a == b and hash(a) == hash(b)
+
+def test_subtree_sizes():
+    g = lambdas()
+    for _ in range(100):
+        t = g.generate()
+        a = ArrayTree.from_tree(g, t)
+        assert [len(a.subtree(i)) for i in range(len(a))] == [n.count_nodes() for n in t]
+
+def test_pickle():
+    g = arithmetic()
+    a = ArrayTree.from_tree(g, g.generate())
+    b = pickle.loads(pickle.dumps(a))
+    assert b.data.tolist() == a.data.tolist() and str(b) == str(a)
+
+def test_sample_subnode_uniform():
+    g = arithmetic()
+    a = ArrayTree.from_tree(g, g.generate())
+    for _ in range(100):
+        i, lp = a.sample_subnode()
+        assert 0 <= i < len(a) and abs(lp + log(len(a))) < 1e-9
+
+def test_sample_subnode_with_resample_probability():
+    g = arithmetic()
+    random.seed(3)
+    t = g.generate()
+    while t.count_nodes() < 5:
+        t = g.generate()
+    a = ArrayTree.from_tree(g, t)
+    nodes = list(a.to_tree())
+
+    terminals = lambda n: 1.0 if n.args is None else 0.0
+    counts = Counter()
+    for _ in range(2000):
+        i, lp = a.sample_subnode(resampleProbability=terminals)
+        assert nodes[i].args is None
+        assert abs(lp + log(sum(terminals(n) for n in nodes))) < 1e-9
+        counts[i] += 1
+    assert set(counts) == {i for i, n in enumerate(nodes) if n.args is None}
+
+    # the same distribution as FunctionNode.sample_subnode
+    weight = lambda n: 2.0 if n.name == 'x' else 0.5
+    t_lps = dict()
+    for _ in range(500):
+        s, lp = t.sample_subnode(resampleProbability=weight)
+        t_lps[str(s)] = lp
+    for _ in range(500):
+        i, lp = a.sample_subnode(resampleProbability=weight)
+        assert abs(t_lps.get(str(nodes[i]), lp) - lp) < 1e-9
+
+def test_hypothesis_with_arraytree_value():
+    g = arithmetic()
+    random.seed(1)
+    h = LOTHypothesis(grammar=g, value=ArrayTree.from_tree(g, g.generate()))
+    for _ in range(50):
+        p, fb = h.propose()
+        assert isinstance(p.value, ArrayTree)
+        assert p(2) == eval('lambda x: ' + str(p.value.to_tree()), {'neg_': lambda x: -x})(2)
+        h = p
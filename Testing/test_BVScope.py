@@ -0,0 +1,98 @@
+import random
+import threading
+
+from LOTlib3.BVRuleContextManager import BVRuleContextManager
+from LOTlib3.GrammarRule import BVUseGrammarRule
+from LOTlib3.Testing.Grammars import lambdas
+
+
+def snapshot(g):
+    return {nt: list(rules) for nt, rules in g.rules.items()}
+
+
+def test_generation_leaves_the_rules_alone():
+    random.seed(11)
+    g = lambdas()
+    before = snapshot(g)
+    for _ in range(200):
+        t = g.generate()
+        g.log_probability(t)
+        assert snapshot(g) == before and len(g.current_bv_rules()) == 0
+
+def test_scopes_are_immutable():
+    g = lambdas()
+    r1, r2 = BVUseGrammarRule('OBJECT', None, 1.0), BVUseGrammarRule('THING', None, 1.0)
+    g.push_bv_rule(r1)
+    s1 = g.get_scope()
+    g.push_bv_rule(r2)
+    assert g.current_bv_rules() == (r1, r2) and s1.rules == (r1,)
+    assert g.get_rules('OBJECT')[-1] is r1 and g.get_rules('THING') == [r2]
+    assert g.is_nonterminal('THING') and 'THING' in g.nonterminals() and 'THING' not in g.rules
+    g.pop_bv_rule(r2)
+    assert g.get_scope() is s1 and not g.is_nonterminal('THING')
+    g.pop_bv_rule(r1)
+    assert g.current_bv_rules() == () and r1 not in g.get_rules('OBJECT')
+
+def test_pops_out_of_order():
+    g = lambdas()
+    r1, r2 = BVUseGrammarRule('OBJECT', None, 1.0), BVUseGrammarRule('OBJECT', None, 1.0)
+    g.push_bv_rule(r1)
+    g.push_bv_rule(r2)
+    g.pop_bv_rule(r1)
+    assert g.current_bv_rules() == (r2,) and g.get_rule_index('OBJECT').rules[-1] is r2
+    g.pop_bv_rule(r2)
+    assert g.get_rule_index('OBJECT').rules == g.rules['OBJECT']
+
+def test_context_manager():
+    random.seed(12)
+    g = lambdas()
+    for _ in range(100):
+        for x in g.generate():
+            if x.added_rule is not None:
+                with BVRuleContextManager(g, x):
+                    assert g.current_bv_rules() == (x.added_rule,)
+                    assert x.added_rule in g.get_rules(x.added_rule.nt)
+                assert g.current_bv_rules() == ()
+
+def test_scopes_are_per_thread():
+    g = lambdas()
+    r = BVUseGrammarRule('OBJECT', None, 1.0)
+    pushed, done = threading.Event(), threading.Event()
+
+    def other():
+        g.push_bv_rule(r)
+        pushed.set()
+        done.wait()
+        g.pop_bv_rule(r)
+
+    th = threading.Thread(target=other)
+    th.start()
+    pushed.wait()
+    try:
+        assert g.current_bv_rules() == () and r not in g.get_rules('OBJECT')
+    finally:
+        done.set()
+        th.join()
+
+def test_threads_share_a_grammar():
+    g = lambdas()
+    results, errors = [], []
+
+    def chain():
+        try:
+            for _ in range(200):
+                t = g.generate()
+                results.append((t, g.log_probability(t)))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=chain) for _ in range(4)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    assert errors == [] and len(results) == 800
+    for t, lp in results:
+        for x in t:
+            x.invalidate(recurse_up=False)
+        assert abs(g.log_probability(t) - lp) < 1e-9
@@ -0,0 +1,22 @@
+import builtins
+import random
+
+from LOTlib3.Eval import register_primitive
+from LOTlib3.Hypotheses.LOTHypothesis import LOTHypothesis
+from LOTlib3.Primitives.Arithmetic import neg_
+from LOTlib3.Testing.Grammars import arithmetic
+
+
+def test_functions_agree_with_eval():
+    g = arithmetic()
+    random.seed(4)
+    for _ in range(200):
+        h = LOTHypothesis(grammar=g, function_cache=None)
+        for x in range(3):
+            assert h(x) == eval(str(h), {'neg_': neg_})(x)
+
+def test_register_primitive_with_a_name():
+    register_primitive(lambda x: 2*x, name='test_eval_double_')
+    assert builtins.test_eval_double_(3) == 6
+    h = LOTHypothesis(grammar=arithmetic(), value=arithmetic().generate(), display='lambda x: test_eval_double_(%s)')
+    assert h(1) == 2*eval(str(h.value), {'neg_': neg_, 'x': 1})
@@ -0,0 +1,88 @@
+import random
+from copy import copy
+
+from LOTlib3.FunctionCache import FunctionCache
+from LOTlib3.Grammar import Grammar
+from LOTlib3.Hypotheses.LOTHypothesis import LOTHypothesis
+from LOTlib3.Primitives import apply_
+from LOTlib3.Testing.Grammars import arithmetic, lambdas
+
+
+def test_lru():
+    c = FunctionCache(maxsize=2)
+    made = []
+    make = lambda k: made.append(k) or k
+    for k in 'abab':
+        c.get(k, make)
+    assert made == ['a', 'b'] and c.hits == 2 and c.misses == 2
+    c.get('c', make) # drops a, the least recently used
+    assert 'a' not in c and 'b' in c and 'c' in c and len(c) == 2
+
+def test_cached_functions_agree_with_eval():
+    g = arithmetic()
+    c = FunctionCache()
+    random.seed(2)
+    for _ in range(300):
+        h = LOTHypothesis(grammar=g, function_cache=c)
+        for x in range(3):
+            assert h(x) == eval(str(h), {"neg_": lambda y: -y})(x)
+    assert c.hits > 0
+
+def test_key_is_the_source():
+    g = arithmetic()
+    c = FunctionCache()
+    h = LOTHypothesis(grammar=g, function_cache=c)
+    assert h.function_key() == str(h) and list(c.table.keys()) == [str(h)]
+    h2 = h.__copy__(value=copy(h.value))
+    assert h2.function_key() == h.function_key() and h2.fvalue is h.fvalue
+
+def test_trees_with_swapped_bound_variables_get_their_own_functions():
+    g = Grammar()
+    g.add_rule('START', '', ['EXPR'], 1.0)
+    g.add_rule('EXPR', '(%s - %s)', ['EXPR', 'EXPR'], 1.0)
+    g.add_rule('EXPR', 'apply_', ['FUNCTION', 'EXPR'], 2.0)
+    g.add_rule('FUNCTION', 'lambda', ['EXPR'], 1.0, bv_type='EXPR', bv_p=5.0)
+    g.add_rule('EXPR', '1', None, 1.0)
+    g.add_rule('EXPR', '2', None, 1.0)
+    c = FunctionCache()
+    random.seed(4)
+    n = 0
+    while n < 50:
+        t = g.generate()
+        for x in t:
+            if x.name == '(%s - %s)' and x.args[0] != x.args[1]:
+                u = copy(t)
+                y = list(u)[list(t).index(x)]
+                y.args = [y.args[1], y.args[0]]
+                y.invalidate()
+                h, k = [LOTHypothesis(grammar=g, value=v, display='lambda: %s', maxnodes=1000, function_cache=c) for v in (t, u)]
+                assert h.fvalue is not k.fvalue and h() == eval(str(h))() and k() == eval(str(k))()
+                n += 1
+
+def test_alpha_equivalent_values_share():
+    g = lambdas()
+    c = FunctionCache()
+    for _ in range(200):
+        t = g.generate()
+        u = g.unpack(g.pack(t)) # the same tree, with new bound variable names
+        h = LOTHypothesis(grammar=g, value=t, display='lambda x, S: %s', maxnodes=1000, function_cache=c)
+        k = LOTHypothesis(grammar=g, value=u, display='lambda x, S: %s', maxnodes=1000, function_cache=c)
+        assert h.function_key() == k.function_key() and h.fvalue is k.fvalue
+
+def test_display_is_part_of_the_key():
+    g = arithmetic()
+    c = FunctionCache()
+    t = g.generate()
+    h = LOTHypothesis(grammar=g, value=t, function_cache=c)
+    k = LOTHypothesis(grammar=g, value=copy(t), display='lambda x, y: %s', function_cache=c)
+    assert h.fvalue is not k.fvalue and len(c) == 2
+
+def test_models_can_have_their_own_cache():
+    g = arithmetic()
+    mine = FunctionCache(maxsize=5)
+    h = LOTHypothesis(grammar=g, function_cache=mine)
+    assert h.function_cache is mine and h.function_key() in mine
+    assert h.__copy__().function_cache is mine and LOTHypothesis(grammar=g).function_cache is not mine
+    for _ in range(50):
+        LOTHypothesis(grammar=g, function_cache=mine)
+    assert len(mine) <= 5
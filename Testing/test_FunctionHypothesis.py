@@ -0,0 +1,56 @@
+import pickle
+import random
+from copy import copy
+
+from LOTlib3.Hypotheses.FunctionHypothesis import FunctionHypothesis
+from LOTlib3.Hypotheses.LOTHypothesis import LOTHypothesis
+from LOTlib3.Testing.Grammars import arithmetic
+
+
+class Counted(FunctionHypothesis):
+    """ Counts its __init__s and compiles """
+    inits = 0
+    compiles = 0
+
+    def __init__(self, value='1', **kwargs):
+        Counted.inits += 1
+        FunctionHypothesis.__init__(self, value=value, **kwargs)
+
+    def compile_function(self):
+        Counted.compiles += 1
+        return eval('lambda x: ' + self.value)
+
+
+def test_copies_call_init_by_default():
+    h = Counted(value='x+1')
+    inits, compiles = Counted.inits, Counted.compiles
+    k = copy(h)
+    assert Counted.inits == inits+1 and Counted.compiles > compiles
+    assert k(1) == 2 and k.fvalue is not h.fvalue
+
+def test_lothypothesis_copies_skip_init():
+    g = arithmetic()
+    h = LOTHypothesis(grammar=g)
+    random.seed(5)
+    k = h.__copy__(value=h.value)
+    assert random.random() == (random.seed(5), random.random())[1] # __init__ would have generated a value
+    assert k.fvalue is h.fvalue and k.value is h.value
+
+def test_lothypothesis_copy_with_new_value():
+    g = arithmetic()
+    h = LOTHypothesis(grammar=g)
+    for _ in range(20):
+        p, _ = h.propose()
+        assert p.value is not h.value and p(3) == LOTHypothesis(grammar=g, value=p.value)(3)
+
+def test_lazy():
+    Counted.compiles = 0
+    h = Counted(value='x*2', lazy=True)
+    assert h.fvalue is None and Counted.compiles == 0
+    assert h(2) == 4 and h(3) == 6 and Counted.compiles == 1
+
+def test_pickle_recompiles_when_called():
+    g = arithmetic()
+    h = LOTHypothesis(grammar=g)
+    k = pickle.loads(pickle.dumps(h))
+    assert k.fvalue is None and k(2) == h(2)
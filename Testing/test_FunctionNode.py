@@ -0,0 +1,216 @@
+import pickle
+import random
+from collections import Counter
+from copy import copy
+from math import exp, log
+
+from LOTlib3.FunctionNode import FunctionNode, fold
+from LOTlib3.Grammar import Grammar
+from LOTlib3.Testing.Grammars import arithmetic, lambdas, ArithmeticHypothesis
+
+
+def bv_names(t):
+    return {x.added_rule.name for x in t if x.added_rule is not None}
+
+
+def test_equal_trees_hash_equally():
+    random.seed(13)
+    for g in (arithmetic(), lambdas()):
+        for _ in range(200):
+            t = g.generate()
+            c = copy(t)
+            for x in c:
+                x.invalidate(recurse_up=False)
+            assert c == t and c.structural_hash() == t.structural_hash() == hash(t)
+
+def test_renamed_bound_variables_hash_equally():
+    random.seed(14)
+    g = lambdas()
+    n = 0
+    while n < 50:
+        t = g.generate()
+        if 'lambda' in str(t):
+            c = copy(t)
+            c.uniquify_bv()
+            assert bv_names(c).isdisjoint(bv_names(t))
+            assert c == t and hash(c) == hash(t)
+            n += 1
+
+def test_equal_hashes_are_equal_trees():
+    for g, d in ((arithmetic(), 4), (lambdas(), 5)):
+        seen = dict()
+        for t in g.enumerate(d):
+            other = seen.setdefault(hash(t), t)
+            assert other is t or other == t
+
+def test_hash_follows_changes():
+    random.seed(15)
+    g = arithmetic()
+    for _ in range(200):
+        t = g.generate()
+        hash(t)
+        x = random.choice([x for x in t if x.parent is not None])
+        x.setto(g.generate(x.returntype))
+        c = copy(t)
+        for y in c:
+            y.invalidate(recurse_up=False)
+        assert hash(t) == hash(c)
+
+def applications():
+    """ Nested lambdas whose bound variables can be the arguments of a non-commutative primitive """
+    g = Grammar()
+    g.add_rule('START', '', ['EXPR'], 1.0)
+    g.add_rule('EXPR', '(%s - %s)', ['EXPR', 'EXPR'], 1.0)
+    g.add_rule('EXPR', 'apply_', ['FUNCTION', 'EXPR'], 2.0)
+    g.add_rule('FUNCTION', 'lambda', ['EXPR'], 1.0, bv_type='EXPR', bv_p=5.0)
+    g.add_rule('EXPR', '1', None, 1.0)
+    g.add_rule('EXPR', '2', None, 1.0)
+    return g
+
+def swapped_copies(t):
+    """ For each node of t with two different args, a copy of t where they are swapped """
+    for i, x in enumerate(t):
+        if x.args is not None and len(x.args) == 2 and x.args[0] != x.args[1]:
+            c = copy(t)
+            y = list(c)[i]
+            y.args = [y.args[1], y.args[0]]
+            y.invalidate()
+            yield c
+
+
+def test_swapped_args_hash_differently():
+    random.seed(22)
+    n = 0
+    for g in (arithmetic(), applications()):
+        for _ in range(500):
+            t = g.generate()
+            for c in swapped_copies(t):
+                assert c != t and hash(c) != hash(t)
+                n += 1
+    assert n > 500
+
+def test_swapped_bound_variables_hash_differently():
+    random.seed(23)
+    g, n = applications(), 0
+    while n < 100:
+        t = g.generate()
+        for c in swapped_copies(t):
+            if any(x.name == '(%s - %s)' and all(a.name.startswith('bv__') for a in x.args) for x in c):
+                assert c != t and hash(c) != hash(t)
+                n += 1
+
+def test_equal_hashes_are_equal_trees_with_nested_lambdas():
+    random.seed(24)
+    g, seen = applications(), dict()
+    for _ in range(5000):
+        t = g.generate()
+        other = seen.setdefault(hash(t), t)
+        assert other == t
+
+
+def naive_sizes(t):
+    """ (number of nodes, depth) of t, straight from the tree """
+    kids = [naive_sizes(a) for a in t.argFunctionNodes()]
+    return 1 + sum(k[0] for k in kids), 1 + max(k[1] for k in kids) if kids else 0
+
+def heavy_x(x):
+    return 5.0 if x.name == 'x' else 1.0
+
+
+def test_sizes_are_cached():
+    random.seed(16)
+    for g in (arithmetic(), lambdas()):
+        for _ in range(200):
+            t = g.generate()
+            assert (t.count_nodes(), t.depth()) == naive_sizes(t) and t.size_cache == naive_sizes(t)
+            x = random.choice(list(t))
+            assert (x.count_nodes(), x.depth()) == naive_sizes(x)
+
+def test_sizes_follow_changes():
+    random.seed(17)
+    g = arithmetic()
+    for _ in range(200):
+        t = g.generate()
+        t.count_nodes()
+        t.sample_node_normalizer(heavy_x)
+        x = random.choice([x for x in t if x.parent is not None])
+        x.setto(g.generate(x.returntype))
+        assert (t.count_nodes(), t.depth()) == naive_sizes(t)
+        assert abs(t.sample_node_normalizer(heavy_x) - sum(heavy_x(y) for y in t)) < 1e-9
+
+def test_sample_subnode_distribution():
+    random.seed(18)
+    g, n = arithmetic(), 20000
+    t = max((g.generate() for _ in range(100)), key=lambda t: t.count_nodes())
+    nodes = list(t)
+    for rp in (None, heavy_x):
+        kwargs = dict() if rp is None else dict(resampleProbability=rp)
+        Z = t.sample_node_normalizer(**kwargs)
+        assert abs(Z - sum((1.0 if rp is None else rp(x)) for x in nodes)) < 1e-9
+        counts = Counter()
+        for _ in range(n):
+            x, lp = t.sample_subnode(**kwargs)
+            assert abs(lp - t.sampling_log_probability(x, **kwargs)) < 1e-9
+            counts[id(x)] += 1
+        for x in nodes:
+            p = exp(t.sampling_log_probability(x, **kwargs))
+            assert abs(counts[id(x)]/n - p) < 4*(p*(1-p)/n)**0.5 + 1e-3
+
+def test_sample_subnodes():
+    random.seed(19)
+    t = lambdas().generate()
+    nodes = {id(x) for x in t}
+    for x, lp in t.sample_subnodes(100, resampleProbability=heavy_x):
+        assert id(x) in nodes and abs(lp - t.sampling_log_probability(x, resampleProbability=heavy_x)) < 1e-9
+    path, lp = t.sample_subnode_path()
+    assert path[0] is t and all(b.parent is a for a, b in zip(path, path[1:]))
+
+def test_pickling_after_sampling():
+    random.seed(20)
+    g = lambdas()
+    for _ in range(50):
+        t = g.generate()
+        t.sample_subnode(resampleProbability=lambda x: 1.0 + (x.name == 'x'))
+        c = pickle.loads(pickle.dumps(t))
+        assert c == t and c.count_nodes() == t.count_nodes() and c.weight_cache is None
+        assert c.sample_node_normalizer() == t.count_nodes()
+
+def test_pickled_hypotheses_compute_the_same_function():
+    random.seed(21)
+    for _ in range(50):
+        h = ArithmeticHypothesis()
+        h.value.sample_subnode(resampleProbability=lambda x: 1.0)
+        c = pickle.loads(pickle.dumps(h))
+        assert c.value == h.value and [c(x) for x in range(5)] == [h(x) for x in range(5)]
+
+def deep_chain(n, p=0.5):
+    """ A grammar whose trees are chains of f_, and one of its trees with n of them (deeper than the recursion limit) """
+    g = Grammar()
+    g.add_rule('START', '', ['EXPR'], 1.0)
+    g.add_rule('EXPR', 'f_', ['EXPR'], p)
+    g.add_rule('EXPR', 'x', None, 1.0-p)
+    t = FunctionNode(None, 'EXPR', 'x', None)
+    for _ in range(n):
+        t = FunctionNode(None, 'EXPR', 'f_', [t])
+        t.args[0].parent = t
+    root = FunctionNode(None, 'START', '', [t])
+    t.parent = root
+    return g, root
+
+
+def test_deep_trees_without_recursion():
+    n = 20000
+    g, t = deep_chain(n)
+    assert str(t) == 'f_('*n + 'x' + ')'*n
+    assert t.count_nodes() == n+2 and t.depth() == n+1 and len(list(t)) == n+2
+    assert [d for _, d in t.iterdepth()] == list(range(n+2))
+    assert list(t)[-1].name == 'x' and list(t.all_leaves()) == []
+    assert abs(g.log_probability(t) - (n*log(0.5) + log(0.5))) < 1e-6
+    assert t == deep_chain(n)[1] and t != deep_chain(n+1)[1]
+
+def test_fold():
+    _, t = deep_chain(3)
+    assert fold(t, lambda x, d, args: 1 + sum(args or [])) == 5
+    entered = []
+    fold(t, lambda x, d, args: None, enter=lambda x, d: entered.append(d))
+    assert entered == [0, 1, 2, 3, 4]
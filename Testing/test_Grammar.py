@@ -0,0 +1,287 @@
+import pytest
+import pickle
+import random
+from copy import copy, deepcopy
+from math import log
+
+import LOTlib3.Grammar
+from LOTlib3.Grammar import Grammar
+from LOTlib3.GrammarRule import GrammarRule
+from LOTlib3.Testing.Grammars import arithmetic, lambdas
+
+
+def rule_log_probability(g, t):
+    """ The log probability of a tree without bound variables, straight from the rules """
+    lp = 0.0
+    for x in t:
+        rules = g.rules[x.returntype]
+        r, = [r for r in rules if r.get_rule_signature() == x.get_rule_signature()]
+        lp += log(r.p / sum(q.p for q in rules))
+    return lp
+
+def uncached_log_probability(g, t):
+    t = copy(t)
+    for x in t:
+        x.invalidate(recurse_up=False)
+    return g.log_probability(t)
+
+
+def test_log_probability_is_cached():
+    random.seed(3)
+    g = arithmetic()
+    for _ in range(200):
+        t = g.generate()
+        lp = g.log_probability(t)
+        assert abs(lp - rule_log_probability(g, t)) < 1e-9
+        assert t.lp_cache is not None and t.lp_cache[1] == lp and g.log_probability(t) == lp
+
+def test_cache_follows_changes_to_the_grammar():
+    random.seed(4)
+    g = arithmetic()
+    trees = [g.generate() for _ in range(50)]
+    for t in trees:
+        g.log_probability(t)
+    g.add_rule('EXPR', '2', None, 5.0)
+    for t in trees:
+        assert abs(g.log_probability(t) - rule_log_probability(g, t)) < 1e-9
+
+def test_cache_is_not_shared_between_grammars():
+    random.seed(5)
+    g, h = arithmetic(), arithmetic()
+    h.rules['EXPR'][0].p = 5.0
+    h.mark_changed()
+    g.mark_changed() # so both are at the same version
+    for _ in range(50):
+        t = g.generate()
+        g.log_probability(t)
+        assert abs(h.log_probability(t) - rule_log_probability(h, t)) < 1e-9
+
+def test_cache_is_not_shared_with_copies():
+    random.seed(5)
+    for make in (deepcopy, lambda g: pickle.loads(pickle.dumps(g))):
+        g = arithmetic()
+        h = make(g)
+        assert h == g and h.uid != g.uid
+        h.add_rule('EXPR', '2', None, 1.0)
+        g.add_rule('EXPR', '3', None, 50.0) # so both are at the same version, with different rules
+        assert h.version == g.version
+        for t in arithmetic().generate_many(50): # trees that both can score
+            g.log_probability(t)
+            assert abs(h.log_probability(t) - rule_log_probability(h, t)) < 1e-9
+            assert abs(g.log_probability(t) - rule_log_probability(g, t)) < 1e-9
+
+def test_cache_follows_changes_to_the_tree():
+    random.seed(6)
+    for g in (arithmetic(), lambdas()):
+        for _ in range(100):
+            t = g.generate()
+            g.log_probability(t)
+            n = random.choice([x for x in t if x.parent is not None and x.returntype in g.rules])
+            n.setto(g.generate(n.returntype))
+            assert abs(g.log_probability(t) - uncached_log_probability(g, t)) < 1e-9
+
+def test_cache_depends_on_bound_variables():
+    random.seed(7)
+    g = lambdas()
+    for _ in range(200):
+        t = g.generate()
+        lp = g.log_probability(t)
+        assert lp == g.log_probability(t) and abs(lp - uncached_log_probability(g, t)) < 1e-9
+        for x in t: # the body of a lambda was scored with its bound variable, so its cache is no good without it
+            if x.added_rule is not None and any(y.name == x.added_rule.name for y in x):
+                body = copy(x.args[0])
+                body.parent = None
+                assert body.lp_cache is not None
+                with pytest.raises(AssertionError):
+                    g.log_probability(body)
+
+def chain(p):
+    """ A grammar whose trees are chains of f_, with expected length p/(1-p) """
+    g = Grammar()
+    g.add_rule('START', '', ['EXPR'], 1.0)
+    g.add_rule('EXPR', 'f_', ['EXPR'], p)
+    g.add_rule('EXPR', 'x', None, 1.0-p)
+    return g
+
+def walk(t):
+    """ The nodes of t in prefix order, checking their parents, without recursion """
+    out, stack = [], [t]
+    while stack:
+        x = stack.pop()
+        out.append(x)
+        kids = list(x.argFunctionNodes())
+        assert all(a.parent is x for a in kids)
+        stack.extend(reversed(kids))
+    return out
+
+
+def test_generate_many():
+    for g in (arithmetic(), lambdas()):
+        random.seed(8)
+        trees = list(g.generate_many(100))
+        random.seed(8)
+        assert trees == [g.generate() for _ in range(100)]
+        assert all(t.returntype == g.start and t.parent is None for t in trees)
+    assert all(t.returntype == 'BOOL' for t in lambdas().generate_many(20, nt='BOOL'))
+
+def test_generated_trees_are_complete():
+    random.seed(9)
+    for g in (arithmetic(), lambdas()):
+        nrules = g.nrules()
+        for t in g.generate_many(200):
+            assert all(not isinstance(a, str) or not g.is_nonterminal(a) for x in walk(t) for a in (x.args or []))
+            assert g.log_probability(t) > -float('inf')
+        assert g.nrules() == nrules # bound variables were all removed
+
+def test_deep_trees():
+    random.seed(10)
+    g = chain(0.9999)
+    lengths = [len(walk(g.generate())) for _ in range(5)]
+    assert max(lengths) > 5000 # deeper than python's recursion limit
+
+def test_log_probabilities():
+    random.seed(11)
+    for g in (arithmetic(), lambdas()):
+        trees = [g.generate() for _ in range(300)]
+        lps = g.log_probabilities(trees)
+        assert len(lps) == len(trees)
+        for t, lp in zip(trees, lps):
+            assert abs(lp - g.log_probability(t)) < 1e-9
+
+def test_rule_count_matrix(monkeypatch):
+    random.seed(12)
+    g = arithmetic()
+    trees = [g.generate() for _ in range(100)]
+    M, fallback = g.rule_count_matrix(trees)
+    assert fallback == [] and M.shape == (100, g.nrules())
+    assert list(M.sum(axis=1).flat) == [t.count_nodes() for t in trees]
+
+    monkeypatch.setattr(LOTlib3.Grammar, 'sparse', None) # as if scipy were not installed
+    D, _ = g.rule_count_matrix(trees)
+    assert (D == M.toarray()).all()
+    assert all(abs(a - g.log_probability(t)) < 1e-9 for a, t in zip(g.log_probabilities(trees), trees))
+
+def test_log_probabilities_with_bound_variables():
+    random.seed(13)
+    g = lambdas()
+    trees = [g.generate() for _ in range(100)]
+    M, fallback = g.rule_count_matrix(trees)
+    assert fallback == [i for i, t in enumerate(trees) if 'lambda' in str(t)]
+
+def test_count_at_depth_matches_enumeration():
+    for g, D, nt in ((arithmetic(), 4, 'EXPR'), (lambdas(), 5, 'BOOL')):
+        for d in range(1, D):
+            assert g.count_at_depth(d) == len(list(g.enumerate_at_depth(d)))
+            assert g.count_at_depth(d-1, nt) == len(list(g.enumerate_at_depth(d-1, nt=nt))) # the same trees below START
+
+def test_rank_and_unrank_follow_enumeration():
+    for g, D in ((arithmetic(), 4), (lambdas(), 5)):
+        for d in range(D):
+            for k, t in enumerate(g.enumerate_at_depth(d)):
+                u = g.unrank(None, d, k)
+                assert u == t and str(u) == str(t)
+                assert g.rank(t) == (d, k)
+                assert g.rank(u) == (d, k)
+
+def test_unranked_trees_are_complete():
+    g = lambdas()
+    for k in range(g.count_at_depth(4)):
+        t = g.unrank(None, 4, k)
+        assert g.log_probability(t) > -float('inf')
+        assert all(x.parent is p for p in t for x in p.argFunctionNodes())
+
+def test_counts_are_rebuilt_when_the_grammar_changes():
+    g = arithmetic()
+    n = g.count_at_depth(2)
+    g.add_rule('EXPR', '2', None, 1.0)
+    assert g.count_at_depth(2) == len(list(g.enumerate_at_depth(2))) != n
+
+def test_sample_at_depth():
+    random.seed(1)
+    g = lambdas()
+    seen = set(str(g.sample_at_depth(4)) for _ in range(1000))
+    assert seen == set(str(t) for t in g.enumerate_at_depth(4))
+
+def test_unpack_pack():
+    for g in (arithmetic(), lambdas()):
+        for _ in range(200):
+            t = g.generate()
+            b = g.pack(t)
+            assert isinstance(b, bytes) and len(b) == t.count_nodes() # fewer than 128 rules, so a byte per node
+            u = g.unpack(b)
+            assert u == t and g.pack(u) == b
+            assert abs(g.log_probability(u) - g.log_probability(t)) < 1e-9
+
+def test_pack_many():
+    for g in (arithmetic(), lambdas()):
+        trees = [g.generate() for _ in range(50)]
+        assert g.unpack_many(g.pack_many(trees)) == trees
+        assert g.pack_many(trees) == b''.join(g.pack(t) for t in trees)
+        assert g.unpack_many(b'') == []
+
+def test_pack_with_many_rules():
+    g = arithmetic()
+    for i in range(300): # so that rule indices take more than one byte
+        g.add_rule('EXPR', 'c%s' % i, None, 0.01)
+    for _ in range(200):
+        t = g.generate()
+        assert g.unpack(g.pack(t)) == t
+    t = g.unpack(g.pack(g.unrank('EXPR', 0, 301)), nt='EXPR')
+    assert t.name == 'c299'
+
+def test_fingerprints():
+    assert arithmetic().fingerprint() == arithmetic().fingerprint()
+    assert arithmetic().fingerprint() != lambdas().fingerprint()
+
+    g = arithmetic()
+    fp = g.fingerprint()
+    g.add_rule('EXPR', '2', None, 1.0)
+    assert g.fingerprint() != fp
+
+    g = arithmetic()
+    g.rules['EXPR'][0].p = 7.0 # by hand, so we have to say so
+    g.mark_changed()
+    assert g.fingerprint() != fp
+
+def test_dumps_and_loads():
+    for g in (arithmetic(), lambdas()):
+        h = type(g).loads(g.dumps())
+        assert h == g and h.fingerprint() == g.fingerprint()
+        for _ in range(100):
+            t = g.generate()
+            u = h.unpack(g.pack(t))
+            assert u == t and abs(h.log_probability(u) - g.log_probability(t)) < 1e-9
+
+def test_save_and_load(tmp_path):
+    g = lambdas()
+    g.save(str(tmp_path / "grammar.bin"))
+    h = type(g).load(str(tmp_path / "grammar.bin"))
+    assert h == g and h.fingerprint() == g.fingerprint()
+    assert [str(t) for t in h.enumerate(4)] == [str(t) for t in g.enumerate(4)]
+
+def test_rule_positions():
+    random.seed(29)
+    for g in (arithmetic(), lambdas()):
+        for t in g.generate_many(100):
+            for x in t:
+                if x.rule_id is not None:
+                    assert x.rule_key == g.rule_key()
+                    assert g.rule_position(x) == g.get_base_rule_index(x.returntype).position(x.get_rule_signature())
+        t = g.generate()
+        g.rules[g.start].insert(0, GrammarRule(g.start, 'other', None, 1.0)) # so t's rule moves to position 1
+        g.mark_changed()
+        assert t.rule_key != g.rule_key() and g.rule_position(t) == 1 and t.rule_key == g.rule_key()
+
+def test_rule_positions_are_not_shared_with_copies():
+    random.seed(30)
+    for make in (deepcopy, lambda g: pickle.loads(pickle.dumps(g))):
+        g = arithmetic()
+        h = make(g)
+        h.add_rule('EXPR', 'two', None, 1.0)
+        g.add_rule('EXPR', 'three', None, 50.0) # so the new rules have the same position and version
+        t = next(t for t in h.generate_many(1000) if 'two' in str(t))
+        with pytest.raises(AssertionError): # g has no rule for 'two'
+            g.log_probability(t)
+        t = next(t for t in g.generate_many(1000) if 'three' in str(t))
+        with pytest.raises(AssertionError):
+            h.log_probability(t)
@@ -0,0 +1,54 @@
+import random
+
+from LOTlib3.Grammar import Grammar
+from LOTlib3.Testing.Grammars import arithmetic, lambdas
+
+
+def moments(g, n=20000):
+    sizes = [t.count_nodes() for t in (g.generate() for _ in range(n))]
+    mean = sum(sizes)/n
+    return mean, sum((s-mean)**2 for s in sizes)/(n-1)
+
+
+def test_expected_size():
+    g = arithmetic()
+    s = g.get_statistics()
+    # EXPR has 0.6 children on average, so 1/(1-0.6) nodes
+    assert abs(s.expected_size['EXPR'] - 2.5) < 1e-9 and abs(s.expected_size['START'] - 3.5) < 1e-9
+    assert abs(s.spectral_radius - 0.6) < 1e-9 and s.is_finite()
+    plus = g.rules['EXPR'][0].get_rule_signature()
+    assert abs(s.expected_size[plus] - 6.0) < 1e-9
+
+def test_size_moments_match_samples():
+    random.seed(15)
+    for g in (arithmetic(), lambdas()):
+        s = g.get_statistics()
+        mean, variance = moments(g)
+        assert abs(mean - s.expected_size[g.start]) < 0.05*s.expected_size[g.start]
+        assert abs(variance - s.size_variance[g.start]) < 0.15*s.size_variance[g.start]
+        assert abs(s.termination_probability[g.start] - 1.0) < 1e-9
+
+def test_min_depth():
+    g = arithmetic()
+    s = g.get_statistics()
+    assert s.min_depth['START'] == 1
+    assert s.min_depth['EXPR'] == 0
+    assert [s.min_depth[r.get_rule_signature()] for r in g.rules['EXPR']] == [1, 1, 1, 0, 0]
+    assert lambdas().get_statistics().min_depth['START'] == 2 # START -> is_color_(x, COLOR) -> 'red'
+
+def test_infinite_grammars():
+    g = Grammar()
+    g.add_rule('START', '', ['EXPR'], 1.0)
+    g.add_rule('EXPR', '(%s + %s)', ['EXPR', 'EXPR'], 3.0)
+    g.add_rule('EXPR', 'x', None, 1.0)
+    s = g.get_statistics()
+    assert not s.is_finite() and s.expected_size['EXPR'] == float('inf')
+    # t = 1/4 + 3/4 t^2, whose smallest solution is 1/3
+    assert abs(s.termination_probability['EXPR'] - 1.0/3) < 1e-6
+
+def test_statistics_follow_the_grammar():
+    g = arithmetic()
+    s = g.get_statistics()
+    assert g.get_statistics() is s
+    g.add_rule('EXPR', '(%s - %s)', ['EXPR', 'EXPR'], 1.0)
+    assert g.get_statistics() is not s and g.get_statistics().expected_size['EXPR'] > s.expected_size['EXPR']
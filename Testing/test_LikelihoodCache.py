@@ -0,0 +1,113 @@
+import multiprocessing
+import os
+import pickle
+from copy import copy
+
+from LOTlib3.DataAndObjects import FunctionData
+from LOTlib3.LikelihoodCache import LikelihoodCache
+from LOTlib3.Testing.Grammars import arithmetic, ArithmeticHypothesis
+
+
+def make_data():
+    return [FunctionData(input=[x], output=x*x+1, alpha=0.9) for x in range(4)]
+
+def cached(cache, **kwargs):
+    """ An ArithmeticHypothesis class that uses cache """
+    return type('Cached', (ArithmeticHypothesis,), dict(likelihood_cache=cache, **kwargs))
+
+def likelihood_in(path, value):
+    with LikelihoodCache(path) as cache:
+        h = cached(cache)(value=value)
+        h.compute_likelihood(make_data())
+        return cache.hits
+
+
+def test_hits_across_caches(tmp_path):
+    path = str(tmp_path / "ll.db")
+    data = make_data()
+    with LikelihoodCache(path) as cache:
+        h = cached(cache)()
+        ll = h.compute_likelihood(data)
+        assert cache.misses == 1 and len(cache) == 1
+
+    with LikelihoodCache(path) as cache:
+        k = cached(cache)(value=copy(h.value))
+        assert k.compute_likelihood(data) == ll and cache.hits == 1
+
+def test_hits_across_processes(tmp_path):
+    path = str(tmp_path / "ll.db")
+    with LikelihoodCache(path) as cache:
+        h = cached(cache)()
+        h.compute_likelihood(make_data())
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        assert pool.apply(likelihood_in, (path, h.value)) == 1
+
+def test_not_served_after_the_grammar_changes(tmp_path):
+    data = make_data()
+    with LikelihoodCache(str(tmp_path / "ll.db")) as cache:
+        g = arithmetic()
+        h = cached(cache)(grammar=g)
+        h.compute_likelihood(data)
+        g.add_rule('EXPR', '2', None, 1.0)
+        k = cached(cache)(grammar=g, value=copy(h.value))
+        k.compute_likelihood(data)
+        assert cache.hits == 0 and cache.misses == 2
+
+def test_parameters_are_part_of_the_key(tmp_path):
+    data = make_data()
+    with LikelihoodCache(str(tmp_path / "ll.db"), params=['extra']) as cache:
+        h = cached(cache)()
+        h.compute_likelihood(data)
+        for kwargs in (dict(maxnodes=3), dict(likelihood_temperature=2.0), dict(extra=1)):
+            k = cached(cache)(value=copy(h.value), **kwargs)
+            assert cache.key(k, data) != cache.key(h, data)
+        assert cache.key(h, data) != cache.key(h, data[:2])
+
+def test_undeclared_classes_are_not_cached(tmp_path):
+    def compute_single_likelihood(self, datum):
+        return -self.ll_sd * abs(self(*datum.input) - datum.output)
+
+    with LikelihoodCache(str(tmp_path / "ll.db")) as cache:
+        h = cached(cache, compute_single_likelihood=compute_single_likelihood)(ll_sd=1.0)
+        assert cache.key(h, make_data()) is None
+        h.compute_likelihood(make_data())
+        assert len(cache) == 0
+
+def test_puts_are_batched(tmp_path):
+    path = str(tmp_path / "ll.db")
+    data = make_data()
+    cache = LikelihoodCache(path, batch=3, interval=1e9)
+    C = cached(cache)
+    g = arithmetic()
+    hs = [C(grammar=g, value=v) for v in set(g.enumerate_at_depth(2, 'EXPR'))][:3]
+
+    for h in hs[:2]:
+        h.compute_likelihood(data)
+    with LikelihoodCache(path) as other: # another process's view
+        assert len(other) == 0
+    assert len(cache.pending) == 2
+    assert cache.get(cache.key(hs[0], data)) == hs[0].likelihood # served before it is written
+
+    hs[2].compute_likelihood(data)
+    assert len(cache.pending) == 0
+    with LikelihoodCache(path) as other:
+        assert len(other) == 3
+    cache.close()
+
+def test_close_writes(tmp_path):
+    path = str(tmp_path / "ll.db")
+    with LikelihoodCache(path) as cache:
+        cached(cache)().compute_likelihood(make_data())
+        assert len(cache.pending) == 1
+    with LikelihoodCache(path) as other:
+        assert len(other) == 1
+
+def test_pickles(tmp_path):
+    cache = LikelihoodCache(str(tmp_path / "ll.db"))
+    h = cached(cache)()
+    h.compute_likelihood(make_data())
+    c = pickle.loads(pickle.dumps(cache))
+    assert c.pending == {} and c._connection is None
+    cache.close()
+    assert c.get(cache.key(h, make_data())) == h.likelihood
+    c.close()
@@ -0,0 +1,120 @@
+import pytest
+import random
+from copy import copy
+
+from LOTlib3.BVRuleContextManager import BVRuleContextManager
+from LOTlib3.Hypotheses.Proposers import regeneration_proposal
+from LOTlib3.Hypotheses.RecursiveLOTHypothesis import RecursiveLOTHypothesis
+from LOTlib3.NodeStore import NodeStore
+from LOTlib3.TopN import TopN
+from LOTlib3.Testing.Grammars import arithmetic, lambdas, ArithmeticHypothesis
+
+
+def test_intern_is_equal_and_shared():
+    g = lambdas()
+    store = NodeStore()
+    for _ in range(200):
+        t = g.generate()
+        s = store.intern(t)
+        assert s == t and str(s) == str(t)
+        assert store.intern(copy(t)) is s
+        assert s in store
+        assert all(n in store for n in s) # every subtree is shared too
+
+def test_intern_does_not_change_its_argument():
+    g = arithmetic()
+    store = NodeStore()
+    t = g.generate()
+    before = str(t), [id(n) for n in t]
+    store.intern(t)
+    assert (str(t), [id(n) for n in t]) == before
+    assert all(a.parent is n for n in t for a in n.argFunctionNodes())
+
+def test_thaw():
+    g = arithmetic()
+    store = NodeStore()
+    s = store.intern(g.generate())
+    t = store.thaw(s)
+    assert t == s and t is not s
+    assert all(a.parent is n for n in t for a in n.argFunctionNodes())
+
+def test_shared_nodes_have_no_parents_to_walk():
+    random.seed(8)
+    g = lambdas()
+    store = NodeStore()
+    for _ in range(100):
+        s = store.intern(g.generate())
+        assert all(n.shared and n.parent is None for n in s)
+        x = random.choice(list(s))
+        with pytest.raises(AssertionError):
+            g.single_probability(x)
+        with pytest.raises(AssertionError):
+            with BVRuleContextManager(g, x, recurse_up=True):
+                pass
+        t = store.thaw(s)
+        assert not any(n.shared for n in t)
+        y = list(t)[list(s).index(x)] # the same node in the thawed copy
+        assert g.single_probability(y) > -float('inf')
+
+def test_proposals_from_shared_trees():
+    random.seed(9)
+    g = lambdas()
+    store = NodeStore()
+    for _ in range(100):
+        s = store.intern(g.generate())
+        p, fb = regeneration_proposal(g, s)
+        assert all(n.parent is None for n in s)
+        assert abs(g.log_probability(p) - g.log_probability(copy(p))) < 1e-9
+        assert all(not n.shared for n in copy(p))
+
+def test_store_only_keeps_what_is_used():
+    g = arithmetic()
+    store = NodeStore()
+    s = store.intern(g.generate())
+    assert len(store) > 0
+    del s
+    assert len(store) == 0
+
+def test_topn_store_keeps_equal_hypotheses():
+    g = arithmetic()
+    top = TopN(N=5, store=NodeStore())
+    hs = [ArithmeticHypothesis(grammar=g) for _ in range(50)]
+    for i, h in enumerate(hs):
+        top.add(h, i)
+    for h in top:
+        assert h.value in top.store
+        assert h in hs
+        assert h(2) == hs[hs.index(h)](2)
+
+def test_topn_store_with_required_constructor_arguments():
+    g = arithmetic()
+    top = TopN(N=3, store=NodeStore())
+    h = RecursiveLOTHypothesis(g)
+    top.add(h, 0.0)
+    assert top.best() == h and top.best().value in top.store
+
+def test_topn_store_does_not_use_the_random_stream():
+    g = arithmetic()
+    hs = [ArithmeticHypothesis(grammar=g) for _ in range(20)]
+    draws = []
+    for store in (None, NodeStore()):
+        random.seed(7)
+        top = TopN(N=5, store=store)
+        for i, h in enumerate(hs):
+            top.add(h, i)
+        draws.append(random.random())
+    assert draws[0] == draws[1]
+
+def test_keys_stay_valid_as_trees_come_and_go():
+    # shared nodes are keyed by the ids of their children, so make sure dead ones never match new ones
+    g = lambdas()
+    store = NodeStore()
+    kept = []
+    for i in range(500):
+        t = g.generate()
+        s = store.intern(t)
+        assert s == t
+        if i % 3 == 0:
+            kept.append((t, s))
+    for t, s in kept:
+        assert store.intern(copy(t)) is s
@@ -0,0 +1,19 @@
+import random
+
+from LOTlib3.Hypotheses.Priors.PCFGPrior import compute_priors
+from LOTlib3.Miscellaneous import Infinity
+from LOTlib3.Testing.Grammars import arithmetic, ArithmeticHypothesis
+
+
+def test_compute_priors_matches_compute_prior():
+    random.seed(14)
+    g = arithmetic()
+    hs = [ArithmeticHypothesis(grammar=g, value=g.generate(), maxnodes=m, prior_temperature=T)
+          for m, T in zip([10, 1000]*50, [1.0, 1.0, 2.0, 0.5]*25)]
+    priors = compute_priors(hs)
+    assert priors == [h.prior for h in hs]
+    for h, p in zip(hs, priors):
+        h.prior = None
+        assert p == h.compute_prior() or abs(p - h.compute_prior()) < 1e-9
+    assert -Infinity in priors # some were too big
+    assert compute_priors([]) == []
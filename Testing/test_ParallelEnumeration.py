@@ -0,0 +1,39 @@
+from LOTlib3.DataAndObjects import FunctionData
+from LOTlib3.ParallelEnumeration import parallel_enumerate, parallel_enumerate_stream, shards
+from LOTlib3.Testing.Grammars import arithmetic, ArithmeticHypothesis
+from LOTlib3.TopN import TopN
+
+
+def make_data():
+    return [FunctionData(input=[x], output=x*x+1, alpha=0.9) for x in range(4)]
+
+def serial(d, N):
+    g = arithmetic()
+    top = TopN(N=N)
+    for t in g.enumerate(d):
+        h = ArithmeticHypothesis(grammar=g, value=t)
+        top.add(h, h.compute_posterior(make_data()))
+    return top
+
+def scores(top):
+    return sorted(h.posterior_score for h in top)
+
+
+def test_shards_cover_the_enumeration():
+    g = arithmetic()
+    covered = [(d, k) for d, start, stop in shards(g, 4, 7) for k in range(start, stop)]
+    assert len(covered) == len(set(covered)) == sum(1 for _ in g.enumerate(4))
+
+def test_stream_scores_everything():
+    g = arithmetic()
+    out = list(parallel_enumerate_stream(g, ArithmeticHypothesis, make_data(), 3, N=1000, processes=1, chunksize=5))
+    assert sorted((d, k) for _, d, k, _, _ in out) == [(d, k) for d, start, stop in shards(g, 3, 5) for k in range(start, stop)]
+
+def test_matches_serial_enumeration():
+    expected = serial(4, 20)
+    for processes in (1, 2):
+        top = parallel_enumerate(arithmetic(), ArithmeticHypothesis, make_data(), 4, N=20, processes=processes, chunksize=50)
+        assert len(top) == 20
+        assert scores(top) == scores(expected)
+        for h in top: # the trees are rebuilt with the scores they were given
+            assert h.posterior_score == h.compute_posterior(make_data())
@@ -0,0 +1,104 @@
+import random
+from copy import copy
+
+from LOTlib3 import PosteriorCache as pc
+from LOTlib3.DataAndObjects import FunctionData
+from LOTlib3.Hypotheses.LOTHypothesis import LOTHypothesis
+from LOTlib3.PosteriorCache import PosteriorCache, data_fingerprint, declared_parameters
+from LOTlib3.Samplers.MetropolisHastings import MetropolisHastingsSampler
+from LOTlib3.Testing.Grammars import arithmetic, ArithmeticHypothesis
+
+
+def make_data():
+    return [FunctionData(input=[x], output=x*x+1, alpha=0.9) for x in range(4)]
+
+def scores(h):
+    return h.prior, h.likelihood, h.posterior_score
+
+
+def test_restores_what_was_computed():
+    g = arithmetic()
+    data = make_data()
+    cache = PosteriorCache()
+    h = ArithmeticHypothesis(grammar=g)
+    cache.get(h, data)
+    k = h.__copy__(value=copy(h.value))
+    k.prior = k.likelihood = k.posterior_score = None
+    assert cache.restore(k, data) and scores(k) == scores(h)
+    assert cache.hits == 1 and cache.misses == 1
+
+def test_not_served_after_the_grammar_changes():
+    g = arithmetic()
+    data = make_data()
+    cache = PosteriorCache()
+    h = ArithmeticHypothesis(grammar=g)
+    cache.get(h, data)
+    old = h.prior
+
+    g.add_rule('EXPR', '2', None, 5.0) # so every other rule is less likely
+    k = h.__copy__(value=copy(h.value))
+    assert not cache.restore(k, data)
+    assert cache.get(k, data) == k.posterior_score and k.prior < old
+
+def test_grammars_and_parameters_are_part_of_the_key():
+    data = make_data()
+    cache = PosteriorCache()
+    g = arithmetic()
+    h = ArithmeticHypothesis(grammar=g)
+    cache.get(h, data)
+
+    other = arithmetic()
+    other.add_rule('EXPR', '2', None, 5.0)
+    assert not cache.restore(ArithmeticHypothesis(grammar=other, value=copy(h.value)), data)
+    assert cache.restore(ArithmeticHypothesis(grammar=arithmetic(), value=copy(h.value)), data) # equal grammars share
+    assert not cache.restore(ArithmeticHypothesis(grammar=g, value=copy(h.value), maxnodes=3), data)
+    assert not cache.restore(ArithmeticHypothesis(grammar=g, value=copy(h.value), likelihood_temperature=2.0), data)
+    assert not cache.restore(h.__copy__(value=copy(h.value)), make_data()[:2])
+
+def test_undeclared_classes_are_not_cached():
+    class Undeclared(ArithmeticHypothesis):
+        def compute_prior(self):
+            return self.extra
+    assert declared_parameters(ArithmeticHypothesis) is not None
+    assert declared_parameters(Undeclared) is None
+
+    cache = PosteriorCache()
+    h = Undeclared()
+    h.extra = -1.0
+    cache.get(h, make_data())
+    assert len(cache) == 0 and PosteriorCache.key(h, make_data()) is None
+
+def test_data_fingerprints():
+    data = make_data()
+    assert data_fingerprint(data) == data_fingerprint(make_data())
+    data.append(FunctionData(input=[9], output=82, alpha=0.9))
+    assert data_fingerprint(data) != data_fingerprint(make_data())
+    assert data_fingerprint([lambda x: x]) is None
+
+def test_data_fingerprints_are_bounded():
+    for _ in range(3*pc.FINGERPRINT_CACHE_SIZE):
+        data_fingerprint(make_data())
+    assert len(pc._fingerprints) <= pc.FINGERPRINT_CACHE_SIZE
+
+def test_unpicklable_data_is_not_cached():
+    cache = PosteriorCache()
+    data = make_data() + [lambda x: x]
+    h = ArithmeticHypothesis()
+    assert PosteriorCache.key(h, data) is None and not cache.restore(h, data)
+
+def test_lru():
+    data = make_data()
+    cache = PosteriorCache(maxsize=3)
+    g = arithmetic()
+    for _ in range(20):
+        cache.get(ArithmeticHypothesis(grammar=g), data)
+    assert len(cache) <= 3
+
+def test_sampler_with_a_cache_makes_the_same_chain():
+    data = make_data()
+    chains = []
+    for cache in (None, PosteriorCache()):
+        random.seed(10)
+        chains.append([(str(h), h.posterior_score) for h in
+                       MetropolisHastingsSampler(ArithmeticHypothesis(), data, steps=500, posterior_cache=cache)])
+    assert chains[0] == chains[1]
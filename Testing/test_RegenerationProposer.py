@@ -0,0 +1,104 @@
+import random
+from collections import Counter
+from copy import copy, deepcopy
+from math import exp, log
+
+from LOTlib3.DataAndObjects import FunctionData
+from LOTlib3.Hypotheses.Proposers import regeneration_proposal
+from LOTlib3.Hypotheses.Proposers.RegenerationProposer import RegenerationProposer
+from LOTlib3.Miscellaneous import logsumexp
+from LOTlib3.Samplers.MetropolisHastings import MetropolisHastingsSampler
+from LOTlib3.Testing.Grammars import arithmetic, lambdas, ArithmeticHypothesis
+
+
+def test_proposals_share_and_do_not_change_the_tree():
+    for g in (arithmetic(), lambdas()):
+        random.seed(6)
+        for _ in range(200):
+            t = g.generate()
+            before = str(t), copy(t)
+            p, fb = regeneration_proposal(g, t)
+            assert (str(t), t) == before
+            assert p is not t and p.parent is None
+
+def test_proposals_share_unchanged_subtrees():
+    g = arithmetic()
+    random.seed(8)
+    shared = 0
+    for _ in range(200):
+        t = g.generate()
+        p, _ = regeneration_proposal(g, t)
+        shared += len(set(map(id, t)).intersection(map(id, p)))
+    assert shared > 0
+
+def test_deepcopy_of_a_chain():
+    # shared subtrees have parents in earlier trees, which deepcopy must not follow
+    random.seed(0)
+    data = [FunctionData(input=[x], output=x*x+x+1, alpha=0.9) for x in range(5)]
+    values = [h.value for h in MetropolisHastingsSampler(ArithmeticHypothesis(), data, steps=3000)]
+    for t in values[::100]:
+        d = deepcopy(t)
+        assert d == t and d.parent is None
+        assert all(a.parent is n for n in d for a in n.argFunctionNodes())
+        assert not set(map(id, d)).intersection(map(id, t))
+
+def paths(t):
+    """ Every path from the root of t, with the indices of the children it takes """
+    stack = [([t], ())]
+    while stack:
+        path, idx = stack.pop()
+        yield path, idx
+        for i, a in enumerate(path[-1].argFunctionNodes()):
+            stack.append((path + [a], idx + (i,)))
+
+def follow(t, idx):
+    for i in idx:
+        kids = list(t.argFunctionNodes())
+        if i >= len(kids):
+            return None
+        t = kids[i]
+    return t
+
+def brute_force_proposal_probability(g, t1, t2):
+    """ The log probability of regenerating t2 from t1 (without bound variables), trying every node """
+    lps = []
+    for path, idx in paths(t1):
+        n2 = follow(t2, idx)
+        if n2 is not None and n2.returntype == path[-1].returntype and t1.replace_subnode(path, copy(n2)) == t2:
+            lps.append(-log(t1.count_nodes()) + g.log_probability(n2))
+    return logsumexp(lps)
+
+
+def test_matches_brute_force():
+    random.seed(22)
+    g, p = arithmetic(), RegenerationProposer()
+    for _ in range(300):
+        t1 = g.generate()
+        t2 = p.propose_tree(g, t1)
+        f, b = brute_force_proposal_probability(g, t1, t2), brute_force_proposal_probability(g, t2, t1)
+        assert abs(p.compute_proposal_probability(g, t1, t2) - f) < 1e-9
+        assert abs(p.compute_fb(g, t1, t2) - (f - b)) < 1e-9
+
+def test_fb_is_antisymmetric():
+    random.seed(23)
+    g, p = lambdas(), RegenerationProposer()
+    for _ in range(300):
+        t1 = g.generate()
+        t2 = p.propose_tree(g, t1)
+        assert abs(p.compute_fb(g, t1, t2) + p.compute_fb(g, t2, t1)) < 1e-9
+        assert p.compute_fb(g, t1, copy(t1)) == 0.0
+
+def test_samples_the_prior_with_no_data():
+    random.seed(24)
+    g, p, n = lambdas(), RegenerationProposer(), 15000
+    t = g.generate()
+    lp = g.log_probability(t)
+    counts = Counter()
+    for _ in range(n):
+        t2 = p.propose_tree(g, t)
+        lp2 = g.log_probability(t2)
+        if random.random() < exp(min(0.0, lp2 - lp - p.compute_fb(g, t, t2))):
+            t, lp = t2, lp2
+        counts[t.args[0].name] += 1
+    for name, q in (('and_', 0.2), ('not_', 0.2), ('exists_', 0.2), ('is_color_', 0.4)):
+        assert abs(counts[name]/n - q) < 0.04
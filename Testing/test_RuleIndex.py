@@ -0,0 +1,68 @@
+import pytest
+import random
+from collections import Counter
+from math import exp
+
+from LOTlib3.BVRuleContextManager import BVRuleContextManager
+from LOTlib3.Testing.Grammars import arithmetic, lambdas
+
+
+def total_probability(idx):
+    return sum(exp(idx.log_probability(i)) for i in range(len(idx)))
+
+
+def test_index_follows_the_rules():
+    g = arithmetic()
+    idx = g.get_rule_index('EXPR')
+    assert idx.rules == g.rules['EXPR'] and len(idx) == 5
+    assert abs(total_probability(idx) - 1.0) < 1e-12
+    for i, r in enumerate(g.rules['EXPR']):
+        assert idx.position(r.get_rule_signature()) == i
+        assert abs(exp(idx.log_probability(i)) - r.p/7.5) < 1e-12
+    assert idx.position(('EXPR', 'nothing')) is None
+
+def test_changes_rebuild_the_index():
+    g = arithmetic()
+    v = g.version
+    g.get_rule_index('EXPR')
+    r = g.add_rule('EXPR', '2', None, 1.0)
+    assert g.version > v and g.get_rule_index('EXPR').rules[-1] is r
+
+    v = g.version
+    g.renormalize()
+    assert g.version > v and abs(g.get_rule_index('EXPR').Z - 1.0) < 1e-12
+
+    v = g.version
+    g.rules['EXPR'][0].p = 5.0 # by hand, so we have to say so
+    g.mark_changed('EXPR')
+    idx = g.get_rule_index('EXPR')
+    assert g.version > v and abs(idx.Z - sum(r.p for r in g.rules['EXPR'])) < 1e-12
+    assert abs(total_probability(idx) - 1.0) < 1e-12
+
+def test_sampling_follows_p():
+    random.seed(1)
+    idx = arithmetic().get_rule_index('EXPR')
+    n = 20000
+    counts = Counter(idx.sample() for _ in range(n))
+    for i, r in enumerate(idx.rules):
+        p = r.p / idx.Z
+        assert abs(counts[i]/n - p) < 4*(p*(1-p)/n)**0.5
+
+def test_bound_variables_extend_the_index():
+    random.seed(2)
+    g = lambdas()
+    base = list(g.get_rule_index('OBJECT').rules)
+    for _ in range(200):
+        for x in g.generate():
+            if x.added_rule is not None:
+                with BVRuleContextManager(g, x):
+                    idx = g.get_rule_index('OBJECT')
+                    assert idx.rules[:len(base)] == base and idx.rules[-1] is x.added_rule
+                    assert abs(total_probability(idx) - 1.0) < 1e-12
+                assert g.get_rule_index('OBJECT').rules == base
+
+def test_duplicate_rules_are_errors():
+    g = arithmetic()
+    g.add_rule('EXPR', 'x', None, 1.0)
+    with pytest.raises(AssertionError):
+        g.get_rule_index('EXPR').position(('EXPR', 'x'))
@@ -0,0 +1,73 @@
+import random
+from collections import Counter
+from copy import deepcopy
+from math import exp, log
+
+from LOTlib3.DefaultGrammars import infiniteTestGrammar
+from LOTlib3.Testing.Grammars import arithmetic, lambdas, ArithmeticHypothesis
+
+
+def small_trees(g, maxnodes):
+    """ Every tree from g with at most maxnodes nodes (a tree of n nodes is less than n deep) """
+    return [t for t in g.enumerate(maxnodes) if t.count_nodes() <= maxnodes]
+
+
+def test_bounded_trees_are_small_enough():
+    random.seed(2)
+    for g, bounds in ((arithmetic(), (2, 3, 5, 10, 25)), (lambdas(), (4, 5, 8, 12))):
+        for maxnodes in bounds:
+            for _ in range(200):
+                t = g.generate_bounded(maxnodes)
+                assert t.count_nodes() <= maxnodes
+                assert g.log_probability(t) > -float('inf')
+
+def test_probability_size_at_most():
+    for g, maxnodes in ((arithmetic(), 4), (lambdas(), 5)):
+        total = sum(exp(g.log_probability(t)) for t in small_trees(g, maxnodes))
+        assert abs(log(total) - g.log_probability_size_at_most(g.start, maxnodes)) < 1e-9
+
+def test_probability_size_at_most_with_bound_variables():
+    random.seed(4)
+    g, maxnodes, n = lambdas(), 9, 20000
+    p = exp(g.log_probability_size_at_most(g.start, maxnodes))
+    hits = sum(g.generate().count_nodes() <= maxnodes for _ in range(n))
+    assert abs(hits/n - p) < 4*(p*(1-p)/n)**0.5
+
+def test_samples_from_the_conditioned_prior():
+    random.seed(3)
+    g, maxnodes, n = arithmetic(), 4, 20000
+    lz = g.log_probability_size_at_most(g.start, maxnodes)
+    counts = Counter(str(g.generate_bounded(maxnodes)) for _ in range(n))
+    for t in small_trees(g, maxnodes):
+        p = exp(g.log_probability(t) - lz)
+        assert abs(counts[str(t)]/n - p) < 4*(p*(1-p)/n)**0.5 + 1e-3
+
+def test_follows_grammar_changes():
+    g = arithmetic()
+    g.generate_bounded(5)
+    g.add_rule('EXPR', '2', None, 100.0)
+    assert sum(str(g.generate_bounded(5)).count('2') for _ in range(50)) > 25
+
+def test_nested_bound_variables():
+    random.seed(5)
+    g, maxnodes, n = deepcopy(infiniteTestGrammar), 7, 20000
+    lz = g.log_probability_size_at_most(g.start, maxnodes)
+    trees, counts = dict(), Counter()
+    for _ in range(n):
+        t = g.generate_bounded(maxnodes)
+        assert t.count_nodes() <= maxnodes
+        trees[str(t)] = t
+        counts[str(t)] += 1
+    for s, k in counts.most_common(20):
+        p = exp(g.log_probability(trees[s]) - lz)
+        assert abs(k/n - p) < 4*(p*(1-p)/n)**0.5 + 1e-3
+
+def test_scopes_count_kinds_of_bound_variables():
+    g = deepcopy(infiniteTestGrammar)
+    g.generate_bounded(25)
+    # two kinds of bound variables, so at most one scope for each pair of counts
+    assert len(g.get_size_table(25).scopes) <= 26*27//2
+
+def test_hypotheses_start_small_enough():
+    for _ in range(100):
+        assert ArithmeticHypothesis(maxnodes=6).value.count_nodes() <= 6
@@ -0,0 +1,96 @@
+import random
+from copy import copy
+
+from LOTlib3.Subtrees import differing_subtrees, least_common_difference, least_common_difference_path, same_subtree
+from LOTlib3.Testing.Grammars import arithmetic, lambdas
+
+
+def positions(t):
+    """ {id(node): indices of the children taken to reach it} for the nodes of t """
+    out, stack = dict(), [(t, ())]
+    while stack:
+        x, idx = stack.pop()
+        out[id(x)] = idx
+        stack.extend((a, idx + (i,)) for i, a in enumerate(x.argFunctionNodes()))
+    return out
+
+def follow(t, idx):
+    for i in idx:
+        t = list(t.argFunctionNodes())[i]
+    return t
+
+def index_of(path):
+    return positions(path[0])[id(path[-1])]
+
+def patch(t1, pairs):
+    """ t1 with the subtree at the end of each path1 replaced by the one at the end of path2 """
+    t = copy(t1)
+    for idx, new in sorted(((index_of(p1), p2[-1]) for p1, p2 in pairs), reverse=True):
+        follow(t, idx).setto(copy(new))
+    return t
+
+def nested(a, b):
+    """ Is the node at indices a above or below the one at b? """
+    n = min(len(a), len(b))
+    return a[:n] == b[:n]
+
+def mutate(g, t, k):
+    """ A copy of t with up to k nodes regenerated (maybe to the same thing), none of them below another """
+    t = copy(t)
+    pos = positions(t)
+    chosen = []
+    for x in random.sample(list(t), len(pos)):
+        if x.parent is not None and not any(nested(pos[id(x)], pos[id(y)]) for y in chosen):
+            chosen.append(x)
+        if len(chosen) == k:
+            break
+    for x in chosen:
+        x.setto(g.generate(x.returntype))
+    return t
+
+
+def test_identical_trees():
+    random.seed(25)
+    for g in (arithmetic(), lambdas()):
+        for _ in range(100):
+            t = g.generate()
+            c = copy(t)
+            assert same_subtree(t, c) and least_common_difference_path(t, c) == (None, None)
+            assert least_common_difference(t, c) == (None, None) and differing_subtrees(t, c) == []
+
+def test_least_common_difference():
+    random.seed(26)
+    g = arithmetic()
+    for _ in range(300):
+        t1 = g.generate()
+        t2 = mutate(g, t1, 1)
+        path1, path2 = least_common_difference_path(t1, t2)
+        if t1 == t2:
+            assert path1 is None
+            continue
+        assert path1[0] is t1 and path2[0] is t2 and index_of(path1) == index_of(path2)
+        assert not same_subtree(path1[-1], path2[-1]) and patch(t1, [(path1, path2)]) == t2
+        assert least_common_difference(t1, t2) == (path1[-1], path2[-1])
+        assert [(path1, path2)] == differing_subtrees(t1, t2) or len(differing_subtrees(t1, t2)) > 1
+
+def test_differing_subtrees():
+    random.seed(27)
+    # in lambdas, a differing subtree may use a bound variable that is named differently above it, so we can't patch
+    for g, patchable in ((arithmetic(), True), (lambdas(), False)):
+        for _ in range(300):
+            t1 = g.generate()
+            t2 = mutate(g, t1, 3)
+            pairs = differing_subtrees(t1, t2)
+            assert (pairs == []) == (t1 == t2)
+            assert patch(t1, pairs) == t2 or not patchable
+            assert [index_of(p1) for p1, _ in pairs] == sorted(index_of(p1) for p1, _ in pairs)
+            for p1, p2 in pairs:
+                assert index_of(p1) == index_of(p2) and not same_subtree(p1[-1], p2[-1])
+
+def test_same_subtree_is_equality():
+    random.seed(28)
+    g = arithmetic()
+    trees = [g.generate() for _ in range(100)]
+    for a in trees:
+        for b in trees:
+            assert same_subtree(a, b) == (a == b)
@@ -1,4 +1,5 @@
 import heapq
+from LOTlib3.FunctionNode import isFunctionNode
 from LOTlib3.Miscellaneous import Infinity
 
 class QueueItem(object):
@@ -22,10 +23,11 @@ class TopN(object):
             It works by storing a priority queue (in the opposite order), and popping off the worst as we need to add more
     """
 
-    def __init__(self, N=Infinity, key='posterior_score'):
+    def __init__(self, N=Infinity, key='posterior_score', store=None):
         assert N > 0, "*** TopN must have N>0"
         self.N = N
         self.key = key
+        self.store = store # an optional LOTlib3.NodeStore.NodeStore; if given, the values we keep share their subtrees
 
         self.Q = [] # we use heapq to
         self.unique_set = set()
@@ -53,6 +55,14 @@ class TopN(object):
             l = len(self.Q)
             assert l <= self.N
 
+            if self.store is not None and isFunctionNode(getattr(x, 'value', None)):
+                # keep a copy whose value is shared, since x may still be in use (e.g. by a sampler). Hypotheses we
+                # return from here have shared values, so use store.thaw on them before changing them
+                y = type(x).__new__(type(x)) # not type(x)(), which may need arguments or make (and compile) a value
+                y.__dict__.update(x.__dict__)
+                y.value = self.store.intern(x.value)
+                x = y
+
             heapq.heappush(self.Q, QueueItem(x,p))
             self.unique_set.add(x)
 